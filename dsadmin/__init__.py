@@ -34,17 +34,29 @@ import shutil
 import datetime
 import select
 import logging
+from collections import deque
 
 from ldap.ldapobject import SimpleLDAPObject
 from ldapurl import LDAPUrl
+try:
+    from ldap.controls import SimplePagedResultsControl
+    HASPAGEDRESULTS = True
+except ImportError:
+    HASPAGEDRESULTS = False
+try:
+    from ldap.controls.psearch import PersistentSearchControl
+    HASPSEARCH = True
+except ImportError:
+    HASPSEARCH = False
 from ldap.cidict import cidict
 from ldap import LDAPError
 # file in this package
 
 from dsadmin._constants import *
 from dsadmin._entry import Entry
-from dsadmin._replication import CSN, RUV
-from dsadmin._ldifconn import LDIFConn
+from dsadmin._dn import DN
+from dsadmin._replication import CSN, RUV, ReplicationTopology
+from dsadmin._ldifconn import LDIFConn, get_ldif_entry
 from dsadmin.utils import (
     isLocalHost, 
     is_a_dn, 
@@ -56,9 +68,6 @@ from dsadmin.utils import (
 # mixin
 #from dsadmin.tools import DSAdminTools
 
-RE_DBMONATTR = re.compile(r'^([a-zA-Z]+)-([1-9][0-9]*)$')
-RE_DBMONATTRSUN = re.compile(r'^([a-zA-Z]+)-([a-zA-Z]+)$')
-
 
 
 # My logger
@@ -91,58 +100,13 @@ class  DsError(Error):
 
 
 
-def wrapper(f, name):
-    """Wrapper of all superclass methods using dsadmin.Entry.
-        @param f - DSAdmin method inherited from SimpleLDAPObject
-        @param name - method to call
-        
-    This seems to need to be an unbound method, that's why it's outside of DSAdmin.  Perhaps there
-    is some way to do this with the new classmethod or staticmethod of 2.4.
-    
-    We replace every call to a method in SimpleLDAPObject (the superclass
-    of DSAdmin) with a call to inner.  The f argument to wrapper is the bound method
-    of DSAdmin (which is inherited from the superclass).  Bound means that it will implicitly
-    be called with the self argument, it is not in the args list.  name is the name of
-    the method to call.  If name is a method that returns entry objects (e.g. result),
-    we wrap the data returned by an Entry class.  If name is a method that takes an entry
-    argument, we extract the raw data from the entry object to pass in."""
-    def inner(*args, **kargs):
-        if name == 'result':
-            objtype, data = f(*args, **kargs)
-            # data is either a 2-tuple or a list of 2-tuples
-            # print data
-            if data:
-                if isinstance(data, tuple):
-                    return objtype, Entry(data)
-                elif isinstance(data, list):
-                    # AD sends back these search references
-#                     if objtype == ldap.RES_SEARCH_RESULT and \
-#                        isinstance(data[-1],tuple) and \
-#                        not data[-1][0]:
-#                         print "Received search reference: "
-#                         pprint.pprint(data[-1][1])
-#                         data.pop() # remove the last non-entry element
-
-                    return objtype, [Entry(x) for x in data]
-                else:
-                    raise TypeError("unknown data type %s returned by result" %
-                                    type(data))
-            else:
-                return objtype, data
-        elif name.startswith('add'):
-            # the first arg is self
-            # the second and third arg are the dn and the data to send
-            # We need to convert the Entry into the format used by
-            # python-ldap
-            ent = args[0]
-            if isinstance(ent, Entry):
-                return f(ent.dn, ent.toTupleList(), *args[2:])
-            else:
-                return f(*args, **kargs)
-        else:
-            return f(*args, **kargs)
-    return inner
-
+def _add_args(args):
+    """Convert the leading Entry of the add* arguments into the (dn, modlist)
+    used by python-ldap. Other arguments are returned untouched."""
+    if args and isinstance(args[0], Entry):
+        ent = args[0]
+        return (ent.dn, ent.toTupleList()) + tuple(args[2:])
+    return args
 
 
 class DSAdmin(SimpleLDAPObject):
@@ -153,8 +117,8 @@ class DSAdmin(SimpleLDAPObject):
         """
         conffile = self.confdir + '/dse.ldif'
         try:
-            dse_ldif = LDIFConn(conffile)
-            cnconfig = dse_ldif.get(DN_CONFIG)
+            # just read up to cn=config, not the whole dse.ldif
+            cnconfig = get_ldif_entry(conffile, DN_CONFIG)
             if cnconfig:
                 return cnconfig.getValue(attrname)
             return None
@@ -264,13 +228,21 @@ class DSAdmin(SimpleLDAPObject):
         from dsadmin.brooker import (
             Replica,
             Backend,
-            Config)
+            Config,
+            Topology)
         self.replica = Replica(self)
         self.backend = Backend(self)
         self.config = Config(self)
+        # keep sharing the invalidations of a pool after __localinit__
+        generation = None
+        if 'topology' in self.__dict__:
+            generation = self.topology.generation
+        self.topology = Topology(self, generation=generation)
+        from dsadmin.tasks import TaskManager
+        self.tasks = TaskManager(self)
     
     def __init__(self, host='localhost', port=389, binddn='', bindpw='', nobind=False, sslport=0, verbose=False):  # default to anon bind
-        """We just set our instance variables and wrap the methods.
+        """We just set our instance variables.
             The real work is done in the following methods, reused during
             instance creation & co.
                 * __localinit__
@@ -280,7 +252,6 @@ class DSAdmin(SimpleLDAPObject):
              not create a new instance"""
         log.info("Initializing %s with %s:%s" % (self.__class__,
                  host, sslport or port))
-        self.__wrapmethods()
         self.verbose = verbose
         self.port = port
         self.sslport = sslport
@@ -344,6 +315,152 @@ class DSAdmin(SimpleLDAPObject):
                 raise NoSuchEntryError("Entry is None")
             return obj[0]
 
+    def iter_search(self, base, scope=ldap.SCOPE_SUBTREE, filterstr='(objectClass=*)', attrlist=None, page_size=500, timeout=-1):
+        """Generator yielding the entries matching the search as they arrive.
+            @param base - search base
+            @param scope - search scope, default ldap.SCOPE_SUBTREE
+            @param filterstr - filter, default '(objectClass=*)'
+            @param attrlist - list of attributes to retrieve
+            @param page_size - entries per page requested with the Simple
+                Paged Results control. If 0, or if the control is not
+                supported, entries are just read one by one
+            @param timeout - timeout passed to each result3() call
+
+            Unlike search_s, entries are never collected in a list, so
+            the memory footprint doesn't depend on the number of entries.
+            Search references are skipped.
+
+            ex. for e in conn.iter_search('dc=example,dc=com', page_size=1000):
+                    print e.dn
+        """
+        pagectrl = None
+        if page_size and HASPAGEDRESULTS:
+            pagectrl = SimplePagedResultsControl(True, size=page_size, cookie='')
+        msgid = None
+        first = True
+        try:
+            while True:
+                serverctrls = None
+                if pagectrl:
+                    serverctrls = [pagectrl]
+                msgid = self.search_ext(base, scope, filterstr, attrlist,
+                                        serverctrls=serverctrls)
+                rtype = None
+                try:
+                    while rtype != ldap.RES_SEARCH_RESULT:
+                        rtype, rdata, rmsgid, rctrls = self.result3(
+                            msgid, all=0, timeout=timeout)
+                        if rtype == ldap.RES_SEARCH_ENTRY:
+                            for dn_data in rdata:
+                                first = False
+                                yield Entry(dn_data)
+                except ldap.UNAVAILABLE_CRITICAL_EXTENSION:
+                    if not pagectrl or not first:
+                        raise
+                    log.info("Paged results not supported: reading entries one by one")
+                    pagectrl = None
+                    continue
+                msgid = None
+                if not pagectrl:
+                    break
+                cookies = [c.cookie for c in rctrls or []
+                           if c.controlType == SimplePagedResultsControl.controlType]
+                if not cookies or not cookies[0]:
+                    break
+                pagectrl.cookie = cookies[0]
+        finally:
+            # stop the server from sending entries nobody will read
+            if msgid is not None:
+                try:
+                    self.abandon(msgid)
+                except ldap.LDAPError:
+                    log.exception("Cannot abandon search %r" % msgid)
+
+    def _read_entry(self, dn, attrlist=None):
+        """Return the entry dn, or None if it doesn't exist."""
+        try:
+            return self.getEntry(dn, ldap.SCOPE_BASE, '(objectclass=*)', attrlist)
+        except (NoSuchEntryError, ldap.NO_SUCH_OBJECT):
+            return None
+
+    def watchEntry(self, dn, attrlist=None, timeout=None, poll_min=0.1, poll_max=2.0):
+        """Generator yielding the entry dn (or None if it doesn't exist)
+            first as it is now, then each time it may have changed.
+            @param dn - the entry dn
+            @param attrlist - list of attributes to retrieve
+            @param timeout - stop after timeout seconds, default never
+            @param poll_min, poll_max - bounds of the polling interval
+
+            Changes are notified with a Persistent Search on the parent
+            entry. The entry is polled too, with an interval doubling from
+            poll_min up to poll_max: this is the only way to notice
+            changes when the server doesn't support the control, and a
+            safety net for the changes it doesn't notify (eg. internal
+            operations).
+
+            ex. for e in conn.watchEntry(taskdn, timeout=600):
+                    if e and e.nsTaskExitCode:
+                        break
+        """
+        if isinstance(dn, Entry):
+            dn = dn.dn
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        ndn = normalizeDN(dn)
+        rdns = ldap.explode_dn(dn)
+        msgid = None
+        if HASPSEARCH and len(rdns) > 1:
+            # the entry may not exist yet: watch the children of its parent
+            psctrl = PersistentSearchControl(
+                criticality=True, changesOnly=True, returnECs=False)
+            try:
+                msgid = self.search_ext(','.join(rdns[1:]), ldap.SCOPE_ONELEVEL,
+                                        '(objectclass=*)', ['1.1'],
+                                        serverctrls=[psctrl])
+            except ldap.LDAPError, e:
+                log.info("Cannot start persistent search, polling %r: %s" % (dn, e))
+        interval = poll_min
+        try:
+            # read the entry after the persistent search started,
+            # so that no change can be missed
+            yield self._read_entry(dn, attrlist)
+            while True:
+                wait = interval
+                if deadline is not None:
+                    wait = min(wait, deadline - time.time())
+                    if wait <= 0:
+                        break
+                interval = min(interval * 2, poll_max)
+                if msgid is None:
+                    time.sleep(wait)
+                    yield self._read_entry(dn, attrlist)
+                    continue
+                try:
+                    rtype, rdata, rmsgid, rctrls = self.result3(
+                        msgid, all=0, timeout=max(wait, 0.01))
+                except ldap.TIMEOUT:
+                    rtype, rdata = None, None
+                except ldap.LDAPError, e:
+                    log.info("Persistent search failed, polling %r: %s" % (dn, e))
+                    rtype, rdata, msgid = None, None, None
+                if rtype == ldap.RES_SEARCH_RESULT:
+                    # the server ended the persistent search
+                    msgid = None
+                elif rtype == ldap.RES_SEARCH_ENTRY:
+                    changed = [x for x in rdata if normalizeDN(x[0]) == ndn]
+                    if not changed:
+                        # a sibling changed: keep waiting
+                        continue
+                    interval = poll_min
+                yield self._read_entry(dn, attrlist)
+        finally:
+            if msgid is not None:
+                try:
+                    self.abandon(msgid)
+                except ldap.LDAPError:
+                    log.exception("Cannot abandon persistent search %r" % msgid)
+
     def _test_entry(self, dn, scope=ldap.SCOPE_BASE):
         try:
             entry = self.getEntry(dn, scope)
@@ -354,31 +471,73 @@ class DSAdmin(SimpleLDAPObject):
             raise MissingEntryError("Entry %s was added successfully, but I cannot search it" % dn)
 
     def getMTEntry(self, suffix, attrs=None):
-        """Given a suffix, return the mapping tree entry for it.  If attrs is
-        given, only fetch those attributes, otherwise, get all attributes.
+        """Given a suffix, return the mapping tree entry for it.
+
+            The entry is a copy from the topology cache, with all the
+            attributes or just attrs.
         """
-        attrs = attrs or []
-        filtr = suffixfilt(suffix)
-        try:
-            entry = self.getEntry(
-                DN_MAPPING_TREE, ldap.SCOPE_ONELEVEL, filtr, attrs)
-            return entry
-        except NoSuchEntryError:
+        entry = self.topology.mt_entry(suffix, attrs)
+        if entry is None:
             raise NoSuchEntryError(
                 "Cannot find suffix in mapping tree: %r " % suffix)
-        except ldap.FILTER_ERROR, e:
-            log.error("Error searching for %r" % filtr)
-            raise e
-
-    def __wrapmethods(self):
-        """This wraps all methods of SimpleLDAPObject, so that we can intercept
-        the methods that deal with entries.  Instead of using a raw list of tuples
-        of lists of hashes of arrays as the entry object, we want to wrap entries
-        in an Entry class that provides some useful methods"""
-        for name in dir(self.__class__.__bases__[0]):
-            attr = getattr(self, name)
-            if callable(attr):
-                setattr(self, name, wrapper(attr, name))
+        return entry
+
+    #
+    # SimpleLDAPObject overrides using dsadmin.Entry
+    #
+    # Instead of using a raw list of tuples of lists of hashes of arrays as
+    # the entry object, we want to wrap entries in an Entry class that
+    # provides some useful methods.
+    #   - result() returns Entry objects. All the synchronous search*_s
+    #     methods are implemented in python-ldap on top of result(), so they
+    #     return entries too. result2/3 still return the raw data;
+    #   - add*() accept an Entry instead of (dn, modlist);
+    #   - writes invalidate the topology cache (see brooker.Topology).
+    # Everything else is inherited as is, so there's no per-connection
+    # wrapping and no extra call frame.
+    #
+    def result(self, *args, **kwargs):
+        objtype, data = SimpleLDAPObject.result(self, *args, **kwargs)
+        # data is either a 2-tuple or a list of 2-tuples
+        if data:
+            if isinstance(data, tuple):
+                return objtype, Entry(data)
+            elif isinstance(data, list):
+                # AD sends back search references too: they are
+                # returned as Entry with the ref attribute set
+                return objtype, [Entry(x) for x in data]
+            else:
+                raise TypeError("unknown data type %s returned by result" %
+                                type(data))
+        return objtype, data
+
+    def add(self, *args, **kwargs):
+        return SimpleLDAPObject.add(self, *_add_args(args), **kwargs)
+
+    def add_s(self, *args, **kwargs):
+        return SimpleLDAPObject.add_s(self, *_add_args(args), **kwargs)
+
+    def add_ext(self, *args, **kwargs):
+        args = _add_args(args)
+        self.topology.invalidate(args[0])
+        return SimpleLDAPObject.add_ext(self, *args, **kwargs)
+
+    # python-ldap implements every write on top of these methods:
+    # just invalidate the topology cache if they touch it
+    def modify_ext(self, dn, *args, **kwargs):
+        self.topology.invalidate(dn)
+        return SimpleLDAPObject.modify_ext(self, dn, *args, **kwargs)
+
+    def delete_ext(self, dn, *args, **kwargs):
+        self.topology.invalidate(dn)
+        return SimpleLDAPObject.delete_ext(self, dn, *args, **kwargs)
+
+    def rename(self, dn, *args, **kwargs):
+        self.topology.invalidate(dn)
+        return SimpleLDAPObject.rename(self, dn, *args, **kwargs)
+
+    def add_ext_s(self, *args, **kwargs):
+        return SimpleLDAPObject.add_ext_s(self, *_add_args(args), **kwargs)
 
     def startTask(self, entry, verbose=False):
         # start the task
@@ -400,16 +559,18 @@ class DSAdmin(SimpleLDAPObject):
         done = False
         exitCode = 0
         dn = entry.dn
-        while not done:
-            entry = self.getEntry(dn, attrlist=attrlist)
+        if dowait:
+            entries = self.watchEntry(dn, attrlist)
+        else:
+            entries = [self._read_entry(dn, attrlist)]
+        for entry in entries:
+            if entry is None:
+                raise NoSuchEntryError("no such task entry %r" % dn)
             log.debug("task entry %r" % entry)
 
             if entry.nsTaskExitCode:
                 exitCode = int(entry.nsTaskExitCode)
                 done = True
-            if dowait:
-                time.sleep(1)
-            else:
                 break
         return (done, exitCode)
 
@@ -419,101 +580,82 @@ class DSAdmin(SimpleLDAPObject):
         return exitCode
 
     def importLDIF(self, ldiffile, suffix, be=None, verbose=False):
-        cn = "import" + str(int(time.time()))
-        dn = "cn=%s,cn=import,cn=tasks,cn=config" % cn
-        entry = Entry(dn)
-        entry.setValues('objectclass', 'top', 'extensibleObject')
-        entry.setValues('cn', cn)
-        entry.setValues('nsFilename', ldiffile)
-        if be:
-            entry.setValues('nsInstance', be)
-        else:
-            entry.setValues('nsIncludeSuffix', suffix)
-
-        rc = self.startTaskAndWait(entry, verbose)
+        """Import ldiffile and return the task exit code.
+            To run many tasks concurrently, use self.tasks.importLDIF
+        """
+        task = self.tasks.importLDIF(ldiffile, suffix, be)
+        rc = task.result()
 
         if rc:
             if verbose:
                 log.error("Error: import task %s for file %s exited with %d" % (
-                    cn, ldiffile, rc))
+                    task.name, ldiffile, rc))
         else:
             if verbose:
                 log.info("Import task %s for file %s completed successfully" % (
-                    cn, ldiffile))
+                    task.name, ldiffile))
         return rc
 
     def exportLDIF(self, ldiffile, suffix, be=None, forrepl=False, verbose=False):
-        cn = "export%d" % time.time()
-        dn = "cn=%s,cn=export,cn=tasks,cn=config" % cn
-        entry = Entry(dn)
-        entry.update({
-            'objectclass': ['top', 'extensibleObject'],
-            'cn': cn,
-            'nsFilename': ldiffile
-        })
-        if be:
-            entry.setValues('nsInstance', be)
-        else:
-            entry.setValues('nsIncludeSuffix', suffix)
-        if forrepl:
-            entry.setValues('nsExportReplica', 'true')
-
-        rc = self.startTaskAndWait(entry, verbose)
+        """Export to ldiffile and return the task exit code.
+            To run many tasks concurrently, use self.tasks.exportLDIF
+        """
+        task = self.tasks.exportLDIF(ldiffile, suffix, be, forrepl)
+        rc = task.result()
 
         if rc:
             if verbose:
                 log.error("Error: export task %s for file %s exited with %d" % (
-                    cn, ldiffile, rc))
+                    task.name, ldiffile, rc))
         else:
             if verbose:
                 log.info("Export task %s for file %s completed successfully" % (
-                    cn, ldiffile))
+                    task.name, ldiffile))
         return rc
 
     def createIndex(self, suffix, attr, verbose=False):
-        entries_backend = self.getBackendsForSuffix(suffix, ['cn'])
-        cn = "index%d" % time.time()
-        dn = "cn=%s,cn=index,cn=tasks,cn=config" % cn
-        entry = Entry(dn)
-        entry.update({
-            'objectclass': ['top', 'extensibleObject'],
-            'cn': cn,
-            'nsIndexAttribute': attr,
-            'nsInstance': entries_backend[0].cn
-        })
-        # assume 1 local backend
-        rc = self.startTaskAndWait(entry, verbose)
+        """Index attr and return the task exit code.
+            To run many tasks concurrently, use self.tasks.createIndex
+        """
+        task = self.tasks.createIndex(suffix, attr)
+        rc = task.result()
 
         if rc:
-            log.error("Error: index task %s for file %s exited with %d" % (
-                    cn, ldiffile, rc))
+            log.error("Error: index task %s for attribute %s exited with %d" % (
+                    task.name, attr, rc))
         else:
-            log.info("Index task %s for file %s completed successfully" % (
-                    cn, ldiffile))
+            log.info("Index task %s for attribute %s completed successfully" % (
+                    task.name, attr))
         return rc
 
     def fixupMemberOf(self, suffix, filt=None, verbose=False):
-        cn = "fixupmemberof%d" % time.time()
-        dn = "cn=%s,cn=memberOf task,cn=tasks,cn=config" % cn
-        entry = Entry(dn)
-        entry.setValues('objectclass', 'top', 'extensibleObject')
-        entry.setValues('cn', cn)
-        entry.setValues('basedn', suffix)
-        if filt:
-            entry.setValues('filter', filt)
-        rc = self.startTaskAndWait(entry, verbose)
+        """Fix up memberOf under suffix and return the task exit code.
+            To run many tasks concurrently, use self.tasks.fixupMemberOf
+        """
+        task = self.tasks.fixupMemberOf(suffix, filt)
+        rc = task.result()
 
         if rc:
             if verbose:
-                log.error("Error: fixupMemberOf task %s for basedn %s exited with %d" % (cn, suffix, rc))
+                log.error("Error: fixupMemberOf task %s for basedn %s exited with %d" % (task.name, suffix, rc))
         else:
             if verbose:
-                log.info("fixupMemberOf task %s for basedn %s completed successfully" % (cn, suffix))
+                log.info("fixupMemberOf task %s for basedn %s completed successfully" % (task.name, suffix))
         return rc
 
-    def addLDIF(self, input_file, cont=False):
+    def addLDIF(self, input_file, cont=False, window=None):
+        """Add the entries of an LDIF file and return the number of added entries.
+            @param input_file - file name or file object
+            @param cont - log and skip the entries that cannot be added
+            @param window - if set, send the adds asynchronously keeping
+                    at most `window` operations outstanding, instead of
+                    waiting for each add_s to complete.
+
+            NOTE: with window and cont=False, the entries already sent
+                  after the failing one are still added before raising.
+        """
         class LDIFAdder(ldif.LDIFParser):
-            def __init__(self, input_file, conn, cont=False,
+            def __init__(self, input_file, conn, cont=False, window=None,
                          ignored_attr_types=None, max_entries=0, process_url_schemes=None
                          ):
                 myfile = input_file
@@ -521,24 +663,80 @@ class DSAdmin(SimpleLDAPObject):
                     myfile = open(input_file, "r")
                 self.conn = conn
                 self.cont = cont
+                self.window = window
+                self.added = 0
+                # (msgid, dn, normalized dn) of the outstanding adds, oldest first
+                self.pending = deque()
+                self.pending_dns = set()
                 ldif.LDIFParser.__init__(self, myfile, ignored_attr_types,
                                          max_entries, process_url_schemes)
-                self.parse()
-                if isinstance(input_file, basestring):
-                    myfile.close()
+                try:
+                    self.parse()
+                    self.collect(0)
+                finally:
+                    if isinstance(input_file, basestring):
+                        myfile.close()
+
+            def failed(self, dn, e):
+                if not self.cont:
+                    raise e
+                log.exception("Error: could not add entry %s" % dn)
+
+            def collect(self, maxpending):
+                """Wait for the oldest adds until at most maxpending are
+                    outstanding. Without cont, the first error is raised
+                    once all the outstanding adds are read, so that no
+                    result is left on the connection.
+                """
+                error = None
+                while len(self.pending) > maxpending:
+                    msgid, dn, ndn = self.pending.popleft()
+                    self.pending_dns.discard(ndn)
+                    try:
+                        self.conn.result2(msgid)
+                        self.added += 1
+                    except ldap.LDAPError, e:
+                        if self.cont:
+                            self.failed(dn, e)
+                        elif error is None:
+                            error = e
+                            maxpending = 0
+                        else:
+                            log.error("Error: could not add entry %s: %s" % (dn, e))
+                if error is not None:
+                    raise error
 
             def handle(self, dn, entry):
                 if not dn:
                     dn = ''
                 newentry = Entry((dn, entry))
+                if self.window:
+                    ndn = DN(dn)
+                    # the server runs the adds in parallel: a child must
+                    # wait for its parent to be added
+                    parent = ndn.parent
+                    if parent is not None and parent.normalized in self.pending_dns:
+                        self.collect(0)
+                    else:
+                        self.collect(self.window - 1)
+                    self.pending.append((self.conn.add(newentry), dn, ndn.normalized))
+                    self.pending_dns.add(ndn.normalized)
+                    return
                 try:
                     self.conn.add_s(newentry)
+                    self.added += 1
                 except ldap.LDAPError, e:
-                    if not self.cont:
-                        raise e
-                    log.exception("Error: could not add entry %s" % dn)
-
-        adder = LDIFAdder(input_file, self, cont)
+                    self.failed(dn, e)
+
+        start = time.time()
+        adder = LDIFAdder(input_file, self, cont, window)
+        elapsed = time.time() - start
+        rate = 0
+        if elapsed:
+            rate = adder.added / elapsed
+        log.info("Added %d entries in %.2fs: %.1f entries/s" % (
+            adder.added, elapsed, rate))
+        return adder.added
 
     def getSuffixes(self):
         """@return a list of cn suffixes"""
@@ -585,13 +783,10 @@ class DSAdmin(SimpleLDAPObject):
         
 
     def getBackendsForSuffix(self, suffix, attrs=None):
-        # TESTME removed try..except and raise if NoSuchEntryError
-        attrs = attrs or []
-        nsuffix = normalizeDN(suffix)
-        entries = self.search_s("cn=plugins,cn=config", ldap.SCOPE_SUBTREE,
-                                "(&(objectclass=nsBackendInstance)(|(nsslapd-suffix=%s)(nsslapd-suffix=%s)))" % (suffix, nsuffix),
-                                attrs)
-        return entries
+        """Return copies of the backend entries for suffix from the
+            topology cache, with all the attributes or just attrs.
+        """
+        return self.topology.backends(suffix, attrs=attrs)
 
     def getSuffixForBackend(self, bename, attrs=None):
         """Return the mapping tree entry of `bename` or None if not found"""
@@ -607,19 +802,10 @@ class DSAdmin(SimpleLDAPObject):
             return None
 
     def findParentSuffix(self, suffix):
-        """see if the given suffix has a parent suffix"""
-        rdns = ldap.explode_dn(suffix)
-        del rdns[0]
-
-        while len(rdns) > 0:
-            suffix = ','.join(rdns)
-            try:
-                mapent = self.getMTEntry(suffix)
-                return suffix
-            except NoSuchEntryError:
-                del rdns[0]
-
-        return ""
+        """Return the normalized parent suffix of suffix, or "" if it is
+            a top level one. See brooker.Topology.parent_suffix.
+        """
+        return self.topology.parent_suffix(suffix) or ""
 
     def addSuffix(self, suffix, binddn=None, bindpw=None, urls=None, bename=None, beattrs=None):
         """Create and return a suffix and its backend.
@@ -656,156 +842,30 @@ class DSAdmin(SimpleLDAPObject):
                 "Couldn't create suffix for %s %s" % (bename, suffix))
             raise
 
+    def readDBStats(self):
+        """Return a dsadmin.monitor.DBStats with the database monitor of
+            all the backends, read with a single search.
+        """
+        from dsadmin.monitor import DBStats
+        return DBStats(DBStats.search(self))
+
     def getDBStats(self, suffix, bename=''):
-        if bename:
-            dn = ','.join(("cn=monitor,cn=%s" % bename, DN_LDBM))
-        else:
-            entries_backend = self.getBackendsForSuffix(suffix)
-            dn = "cn=monitor," + entries_backend[0].dn
-        dbmondn = "cn=monitor," + DN_LDBM
-        dbdbdn = "cn=database,cn=monitor," + DN_LDBM
+        """Return the database monitor of a backend as a text table.
+            Use readDBStats to get the counters.
+        """
+        if not bename:
+            bename = self.getBackendsForSuffix(suffix)[0].cn
         try:
-            # entrycache and dncache stats
-            ent = self.getEntry(dn, ldap.SCOPE_BASE)
-            monent = self.getEntry(dbmondn, ldap.SCOPE_BASE)
-            dbdbent = self.getEntry(dbdbdn, ldap.SCOPE_BASE)
-            ret = "cache   available ratio    count unitsize\n"
-            mecs = ent.maxentrycachesize or "0"
-            cecs = ent.currententrycachesize or "0"
-            rem = int(mecs) - int(cecs)
-            ratio = ent.entrycachehitratio or "0"
-            ratio = int(ratio)
-            count = ent.currententrycachecount or "0"
-            count = int(count)
-            if count:
-                size = int(cecs) / count
-            else:
-                size = 0
-            ret += "entry % 11d   % 3d % 8d % 5d" % (rem, ratio, count, size)
-            if ent.maxdncachesize:
-                mdcs = ent.maxdncachesize or "0"
-                cdcs = ent.currentdncachesize or "0"
-                rem = int(mdcs) - int(cdcs)
-                dct = ent.dncachetries or "0"
-                tries = int(dct)
-                if tries:
-                    ratio = (100 * int(ent.dncachehits)) / tries
-                else:
-                    ratio = 0
-                count = ent.currentdncachecount or "0"
-                count = int(count)
-                if count:
-                    size = int(cdcs) / count
-                else:
-                    size = 0
-                ret += "\ndn    % 11d   % 3d % 8d % 5d" % (
-                    rem, ratio, count, size)
-
-            if ent.hasAttr('entrycache-hashtables'):
-                ret += "\n\n" + ent.getValue('entrycache-hashtables')
-
-            # global db stats
-            ret += "\n\nglobal db stats"
-            dbattrs = 'dbcachehits dbcachetries dbcachehitratio dbcachepagein dbcachepageout dbcacheroevict dbcacherwevict'.split(' ')
-            cols = {'dbcachehits': [len('cachehits'), 'cachehits'], 'dbcachetries': [10, 'cachetries'],
-                    'dbcachehitratio': [5, 'ratio'], 'dbcachepagein': [6, 'pagein'],
-                    'dbcachepageout': [7, 'pageout'], 'dbcacheroevict': [7, 'roevict'],
-                    'dbcacherwevict': [7, 'rwevict']}
-            dbrec = {}
-            for attr, vals in monent.iterAttrs():
-                if attr.startswith('dbcache'):
-                    val = vals[0]
-                    dbrec[attr] = val
-                    vallen = len(val)
-                    if vallen > cols[attr][0]:
-                        cols[attr][0] = vallen
-            # construct the format string based on the field widths
-            fmtstr = ''
-            ret += "\n"
-            for attr in dbattrs:
-                fmtstr += ' %%(%s)%ds' % (attr, cols[attr][0])
-                ret += ' %*s' % tuple(cols[attr])
-            ret += "\n" + (fmtstr % dbrec)
-
-            # other db stats
-            skips = {'nsslapd-db-cache-hit': 'nsslapd-db-cache-hit', 'nsslapd-db-cache-try': 'nsslapd-db-cache-try',
-                     'nsslapd-db-page-write-rate': 'nsslapd-db-page-write-rate',
-                     'nsslapd-db-page-read-rate': 'nsslapd-db-page-read-rate',
-                     'nsslapd-db-page-ro-evict-rate': 'nsslapd-db-page-ro-evict-rate',
-                     'nsslapd-db-page-rw-evict-rate': 'nsslapd-db-page-rw-evict-rate'}
-
-            hline = ''  # header line
-            vline = ''  # val line
-            for attr, vals in dbdbent.iterAttrs():
-                if attr in skips:
-                    continue
-                if attr.startswith('nsslapd-db-'):
-                    short = attr.replace('nsslapd-db-', '')
-                    val = vals[0]
-                    width = max(len(short), len(val))
-                    if len(hline) + width > 70:
-                        ret += "\n" + hline + "\n" + vline
-                        hline = vline = ''
-                    hline += ' %*s' % (width, short)
-                    vline += ' %*s' % (width, val)
-
-            # per file db stats
-            ret += "\n\nper file stats"
-            # key is number
-            # data is dict - key is attr name without the number - val is the attr val
-            dbrec = {}
-            dbattrs = ['dbfilename', 'dbfilecachehit',
-                       'dbfilecachemiss', 'dbfilepagein', 'dbfilepageout']
-            # cols maps dbattr name to column header and width
-            cols = {'dbfilename': [len('dbfilename'), 'dbfilename'], 'dbfilecachehit': [9, 'cachehits'],
-                    'dbfilecachemiss': [11, 'cachemisses'], 'dbfilepagein': [6, 'pagein'],
-                    'dbfilepageout': [7, 'pageout']}
-            for attr, vals in ent.iterAttrs():
-                match = RE_DBMONATTR.match(attr)
-                if match:
-                    name = match.group(1)
-                    num = match.group(2)
-                    val = vals[0]
-                    if name == 'dbfilename':
-                        val = val.split('/')[-1]
-                    dbrec.setdefault(num, {})[name] = val
-                    vallen = len(val)
-                    if vallen > cols[name][0]:
-                        cols[name][0] = vallen
-                match = RE_DBMONATTRSUN.match(attr)
-                if match:
-                    name = match.group(1)
-                    if name == 'entrycache':
-                        continue
-                    num = match.group(2)
-                    val = vals[0]
-                    if name == 'dbfilename':
-                        val = val.split('/')[-1]
-                    dbrec.setdefault(num, {})[name] = val
-                    vallen = len(val)
-                    if vallen > cols[name][0]:
-                        cols[name][0] = vallen
-            # construct the format string based on the field widths
-            fmtstr = ''
-            ret += "\n"
-            for attr in dbattrs:
-                fmtstr += ' %%(%s)%ds' % (attr, cols[attr][0])
-                ret += ' %*s' % tuple(cols[attr])
-            for dbf in dbrec.itervalues():
-                ret += "\n" + (fmtstr % dbf)
-            return ret
-        except Exception, e:
-            print "caught exception", str(e)
+            return self.readDBStats().format(bename)
+        except (ldap.LDAPError, KeyError), e:
+            log.exception("Cannot read the database stats of %r" % bename)
         return ''
 
     def waitForEntry(self, dn, timeout=7200, attr='', quiet=True):
-        scope = ldap.SCOPE_BASE
-        filt = "(objectclass=*)"
         attrlist = []
         if attr:
-            filt = "(%s=*)" % attr
             attrlist.append(attr)
-        timeout += int(time.time())
+        deadline = time.time() + timeout
 
         if isinstance(dn, Entry):
             dn = dn.dn
@@ -815,23 +875,18 @@ class DSAdmin(SimpleLDAPObject):
             sys.stdout.write("Waiting for %s %s:%s " % (self, dn, attr))
             sys.stdout.flush()
         entry = None
-        while not entry and int(time.time()) < timeout:
-            try:
-                entry = self.getEntry(dn, scope, filt, attrlist)
-            except NoSuchEntryError:
-                pass  # found entry, but no attr
-            except ldap.NO_SUCH_OBJECT:
-                pass  # no entry yet
-            except ldap.LDAPError, e:  # badness
-                print "\nError reading entry", dn, e
-                break
-            if not entry:
+        try:
+            for entry in self.watchEntry(dn, attrlist, timeout):
+                if entry and (not attr or entry.hasAttr(attr)):
+                    break
+                entry = None
                 if not quiet:
                     sys.stdout.write(".")
                     sys.stdout.flush()
-                time.sleep(1)
+        except ldap.LDAPError, e:  # badness
+            print "\nError reading entry", dn, e
 
-        if not entry and int(time.time()) > timeout:
+        if not entry and time.time() >= deadline:
             print "\nwaitForEntry timeout for %s for %s" % (self, dn)
         elif entry:
             if not quiet:
@@ -965,10 +1020,12 @@ class DSAdmin(SimpleLDAPObject):
         return self.enableChainOnUpdate(suffix, chainbe)
 
 
-    def setupBindDN(self, binddn, bindpw, attrs=None):
+    def setupBindDN(self, binddn, bindpw, attrs=None, verify=True):
         """ Return - eventually creating - a person entry with the given dn and pwd.
 
             binddn can be a dsadmin.Entry
+            @param verify - read the entry back after adding it.
+                    If False, return the local entry
         """
         try:
             assert binddn
@@ -998,6 +1055,8 @@ class DSAdmin(SimpleLDAPObject):
         except ldap.ALREADY_EXISTS:
             log.warn("Entry %s already exists" % binddn)
 
+        if not verify:
+            return ent
         try:
             entry = self._test_entry(binddn, ldap.SCOPE_BASE)
             return entry
@@ -1325,14 +1384,10 @@ class DSAdmin(SimpleLDAPObject):
         self.setDNPwdPolicy(DN_CONFIG, pwdpolicy, **pwdargs)
 
     def setDNPwdPolicy(self, dn, pwdpolicy, **pwdargs):
-        """input is dict of attr/vals"""
-        mods = []
-        for (attr, val) in pwdpolicy.iteritems():
-            mods.append((ldap.MOD_REPLACE, attr, str(val)))
-        if pwdargs:
-            for (attr, val) in pwdargs.iteritems():
-                mods.append((ldap.MOD_REPLACE, attr, str(val)))
-        self.modify_s(dn, mods)
+        """input is dict of attr/vals. Only the changed values are written."""
+        attrs = dict(pwdpolicy)
+        attrs.update(pwdargs)
+        return self.config.apply({dn: attrs})
 
     
     # Moved to config
@@ -1359,7 +1414,8 @@ class DSAdmin(SimpleLDAPObject):
             secargs is a dict like {
                 'nsSSLPersonalitySSL': 'Server-Cert'
             }
-            
+            @return the list of changes written, see Config.apply
+
             XXX moved to brooker.Config
         """
         return self.config.enable_ssl(secport, secargs)
@@ -21,6 +21,7 @@ DN_LDBM = "cn=ldbm database,cn=plugins,cn=config"
 DN_MAPPING_TREE = "cn=mapping tree,cn=config"
 DN_CHAIN = "cn=chaining database,cn=plugins,cn=config"
 DN_CHANGELOG = "cn=changelog5,cn=config"
+DN_TASKS = "cn=tasks,cn=config"
 
 #
 # constants
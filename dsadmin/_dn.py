@@ -0,0 +1,371 @@
+"""Distinguished names, parsed once.
+
+    parse_dn() reads a string DN (RFC 4514, plus the quoted values and
+    ';' separators of RFC 2253) with a single regular expression pass and
+    returns its RDNs. The DN class keeps them together with the
+    normalized form used as key by the suffix and backend lookups:
+
+        dn = DN('uid=Joe, ou=People, dc=Example, dc=com')
+        dn.normalized      # 'uid=joe,ou=people,dc=example,dc=com'
+        dn.parent          # DN('ou=People, dc=Example, dc=com')
+        dn.is_descendant_of('dc=example,dc=com')    # True
+
+    Values are escaped in a single pass, looking up the escaped form of
+    each special character in a precomputed table.
+
+    SuffixTree indexes suffixes by RDN to find the suffix holding a DN,
+    or the parent and children of a suffix, without searching.
+"""
+__all__ = ['DN', 'SuffixTree', 'parse_dn', 'escape_value', 'escape_dn_value',
+           'escape_filter_value']
+
+import re
+import binascii
+
+import ldap
+
+
+# one attribute=value pair, with the separator that follows it
+RE_AVA = re.compile(r'''
+    [ ]*
+    (?P<type>[A-Za-z][A-Za-z0-9-]*|(?:[Oo][Ii][Dd]\.)?[0-9]+(?:\.[0-9]+)*)
+    [ ]*=[ ]*
+    (?:
+        "(?P<quoted>(?:[^"\\]|\\.)*)"[ ]*
+      | \#(?P<hex>(?:[0-9A-Fa-f]{2})+)[ ]*
+      | (?P<value>(?:[^,+;"\\]|\\.)*)
+    )
+    (?P<sep>[,;+]|$)
+''', re.X | re.S)
+RE_UNESCAPE = re.compile(r'\\([0-9A-Fa-f]{2}|.)', re.S)
+# most DNs have no escapes, quotes, multi-valued RDNs or special values:
+# they are just split on ',' and '='
+RE_PLAIN_DN = re.compile(r'''^[ ]*[A-Za-z][A-Za-z0-9-]*[ ]*=[^,=+;"\\<>#\0]*
+    (?:,[ ]*[A-Za-z][A-Za-z0-9-]*[ ]*=[^,=+;"\\<>#\0]*)*\Z''', re.X)
+
+
+def _unescape(match):
+    char = match.group(1)
+    if len(char) == 2:
+        return chr(int(char, 16))
+    return char
+
+
+def _value(match):
+    """Return the unescaped value of an RE_AVA match."""
+    value = match.group('value')
+    if value is not None:
+        # trailing spaces are not part of the value, unless escaped
+        stripped = value.rstrip(' ')
+        if len(stripped) < len(value):
+            tail = len(stripped) - len(stripped.rstrip('\\'))
+            if tail % 2:
+                stripped += ' '
+        value = stripped
+    elif match.group('quoted') is not None:
+        value = match.group('quoted')
+    else:
+        return binascii.unhexlify(match.group('hex'))
+    if '\\' in value:
+        value = RE_UNESCAPE.sub(_unescape, value)
+    return value
+
+
+def _parse_plain(dn):
+    """Return the RDNs and the normalized RDNs of a DN matching
+        RE_PLAIN_DN: its values need no escaping.
+    """
+    rdns = []
+    key = []
+    for rdn in dn.split(','):
+        atype, value = rdn.split('=')
+        atype, value = atype.strip(' '), value.strip(' ')
+        rdns.append(((atype, value),))
+        key.append(atype + '=' + value)
+    return tuple(rdns), tuple(','.join(key).lower().split(','))
+
+
+def parse_dn(dn):
+    """Return the RDNs of dn, each a tuple of (type, value) pairs with
+        the unescaped values. Raise ldap.DECODING_ERROR on invalid DNs.
+
+        ex. parse_dn('cn=a+sn=b,dc=com') ->
+                ((('cn', 'a'), ('sn', 'b')), (('dc', 'com'),))
+    """
+    if RE_PLAIN_DN.match(dn):
+        return _parse_plain(dn)[0]
+    if not dn.strip(' '):
+        return ()
+    rdns = []
+    rdn = []
+    pos, end = 0, len(dn)
+    while pos < end:
+        match = RE_AVA.match(dn, pos)
+        if match is None or match.end() == pos:
+            raise ldap.DECODING_ERROR("Invalid DN %r at position %d" % (dn, pos))
+        rdn.append((match.group('type'), _value(match)))
+        sep = match.group('sep')
+        if sep != '+':
+            rdns.append(tuple(rdn))
+            rdn = []
+        pos = match.end()
+        if sep and pos == end:
+            raise ldap.DECODING_ERROR("Invalid DN %r: trailing %r" % (dn, sep))
+    return tuple(rdns)
+
+
+#
+# Escaping: one table for each flavour, mapping every special character
+# to its escaped form. Strings without specials are returned as they
+# are, the others are escaped with a single re.sub pass.
+#
+def _table(chars, fmt):
+    return dict([(c, fmt % {'c': c, 'x': ord(c)}) for c in chars])
+
+# RDN values, as python-ldap escape_dn_chars() does
+DN_SPECIALS = '\\,+"<>;=\0'
+DN_ESCAPES = _table(DN_SPECIALS, '\\%(c)s')
+RE_DN_SPECIALS = re.compile('[%s]' % re.escape(DN_SPECIALS))
+# escapeDNValue: a whole DN in a RDN value, eg. cn=dc\=example\,dc\=com
+VALUE_SPECIALS = ' "+,;<>='
+VALUE_ESCAPES = _table(VALUE_SPECIALS, '\\%(c)s')
+RE_VALUE_SPECIALS = re.compile('[%s]' % re.escape(VALUE_SPECIALS))
+# escapeDNFiltValue: the same in a search filter
+FILTER_ESCAPES = _table(VALUE_SPECIALS, '\\%(x)x')
+
+
+def _translate(value, pattern, table):
+    if pattern.search(value) is None:
+        return value
+    return pattern.sub(lambda m: table[m.group()], value)
+
+
+def escape_dn_value(value):
+    """Escape an attribute value to be put in a DN (RFC 4514)."""
+    if not value:
+        return value
+    value = _translate(value, RE_DN_SPECIALS, DN_ESCAPES)
+    if value[0] in '# ':
+        value = '\\' + value
+    if value[-1] == ' ':
+        value = value[:-1] + '\\ '
+    return value
+
+
+def escape_value(value):
+    """Escape the separators and spaces of value, eg. a DN put in a RDN."""
+    return _translate(value, RE_VALUE_SPECIALS, VALUE_ESCAPES)
+
+
+def escape_filter_value(value):
+    """Like escape_value, with the hex escapes of search filters."""
+    return _translate(value, RE_VALUE_SPECIALS, FILTER_ESCAPES)
+
+
+def _format_rdn(rdn):
+    if len(rdn) == 1:
+        return rdn[0][0] + '=' + escape_dn_value(rdn[0][1])
+    return '+'.join(['%s=%s' % (t, escape_dn_value(v)) for t, v in rdn])
+
+
+class DN(object):
+    """A parsed DN.
+
+        rdns - tuple of RDNs, each a tuple of (type, value), see parse_dn
+        key - tuple of the normalized RDN strings
+        normalized - the lowercase DN string without spaces, as
+                normalizeDN() returns it
+
+        DNs compare and hash by their normalized form.
+    """
+    __slots__ = ('rdns', '_key')
+
+    def __init__(self, dn):
+        """@param dn - a string, a DN or a tuple of RDNs"""
+        if isinstance(dn, DN):
+            self.rdns, self._key = dn.rdns, dn._key
+            return
+        self._key = None
+        if isinstance(dn, tuple):
+            self.rdns = dn
+        elif RE_PLAIN_DN.match(dn):
+            self.rdns, self._key = _parse_plain(dn)
+        else:
+            self.rdns = parse_dn(dn)
+
+    def _get_key(self):
+        if self._key is None:
+            self._key = tuple([_format_rdn(rdn).lower() for rdn in self.rdns])
+        return self._key
+    key = property(_get_key)
+
+    def _get_normalized(self):
+        return ','.join(self.key)
+    normalized = property(_get_normalized)
+
+    def format(self, sep=',', lower=True):
+        """Return the DN string, with RDNs joined by sep."""
+        if lower:
+            return sep.join(self.key)
+        return sep.join([_format_rdn(rdn) for rdn in self.rdns])
+
+    def _get_parent(self):
+        if not self.rdns:
+            return None
+        parent = DN(self.rdns[1:])
+        if self._key is not None:
+            parent._key = self._key[1:]
+        return parent
+    parent = property(_get_parent)
+
+    def _get_rdn(self):
+        if not self.rdns:
+            return None
+        return self.rdns[0]
+    rdn = property(_get_rdn)
+
+    def is_descendant_of(self, other, strict=True):
+        """True if self is under other.
+            @param other - a DN or a string
+            @param strict - if False, a DN is a descendant of itself
+        """
+        if not isinstance(other, DN):
+            other = DN(other)
+        mine, theirs = self.key, other.key
+        if len(mine) < len(theirs) or (strict and len(mine) == len(theirs)):
+            return False
+        return not theirs or mine[-len(theirs):] == theirs
+
+    def __len__(self):
+        return len(self.rdns)
+
+    def __eq__(self, other):
+        if not isinstance(other, DN):
+            return False
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __str__(self):
+        return self.normalized
+
+    def __repr__(self):
+        return "DN(%r)" % self.format(lower=False)
+
+
+class SuffixTree(object):
+    """Suffixes indexed by their RDNs, from the root down.
+
+        Every lookup walks the tree along the RDNs of the given DN, so
+        it costs O(depth) whatever the number of suffixes:
+
+            tree = SuffixTree()
+            tree.add('dc=example,dc=com', mtentry)
+            tree.add('ou=people,dc=example,dc=com', mtentry2)
+            tree.lookup('uid=joe,ou=people,dc=example,dc=com')
+                -> ('ou=people,dc=example,dc=com', mtentry2)
+            tree.parent('ou=people,dc=example,dc=com')
+                -> ('dc=example,dc=com', mtentry)
+    """
+    # nodes are lists: [{rdn: child node}, normalized suffix or None, value]
+
+    def __init__(self):
+        self.root = [{}, None, None]
+        self.size = 0
+
+    def _path(self, dn):
+        """Return the normalized RDNs of dn, from the root down."""
+        if not isinstance(dn, DN):
+            dn = DN(dn)
+        key = list(dn.key)
+        key.reverse()
+        return key
+
+    def add(self, dn, value=None):
+        """Add the suffix dn, replacing its value if already there."""
+        node = self.root
+        path = self._path(dn)
+        for rdn in path:
+            node = node[0].setdefault(rdn, [{}, None, None])
+        if node[1] is None:
+            self.size += 1
+        node[1] = ','.join(reversed(path))
+        node[2] = value
+
+    def _walk(self, dn):
+        """Return the suffix nodes along the path of dn, top down, and
+            the node of dn itself or None.
+        """
+        found = []
+        node = self.root
+        for rdn in self._path(dn):
+            node = node[0].get(rdn)
+            if node is None:
+                return found, None
+            if node[1] is not None:
+                found.append(node)
+        return found, node
+
+    def get(self, dn, default=None):
+        """Return the value of the suffix dn."""
+        found, node = self._walk(dn)
+        if node is None or node[1] is None:
+            return default
+        return node[2]
+
+    def __contains__(self, dn):
+        found, node = self._walk(dn)
+        return node is not None and node[1] is not None
+
+    def __len__(self):
+        return self.size
+
+    def lookup(self, dn):
+        """Return (suffix, value) of the suffix holding dn (dn itself if
+            it is a suffix), or None.
+        """
+        found, node = self._walk(dn)
+        if not found:
+            return None
+        return found[-1][1], found[-1][2]
+
+    def parent(self, dn):
+        """Return (suffix, value) of the nearest suffix above dn, or None."""
+        found, node = self._walk(dn)
+        if node is not None and node[1] is not None:
+            found.pop()
+        if not found:
+            return None
+        return found[-1][1], found[-1][2]
+
+    def children(self, dn):
+        """Return [(suffix, value)] of the nearest suffixes below dn."""
+        found, node = self._walk(dn)
+        if node is None:
+            return []
+        ret = []
+        stack = node[0].values()
+        while stack:
+            child = stack.pop()
+            if child[1] is not None:
+                ret.append((child[1], child[2]))
+            else:
+                stack.extend(child[0].values())
+        ret.sort()
+        return ret
+
+    def items(self):
+        """Return [(suffix, value)] of all the suffixes."""
+        ret = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node[1] is not None:
+                ret.append((node[1], node[2]))
+            stack.extend(node[0].values())
+        ret.sort()
+        return ret
@@ -30,7 +30,14 @@ class Entry(object):
         Instance variables:
           dn - string - the string DN of the entry
           data - cidict - case insensitive dict of the attributes and values
+
+        Entries are slotted and lazy: the raw dict returned by python-ldap
+        is kept as is, and the cidict is built only when `data` is accessed
+        or the entry is modified. Attribute lookups on an unmodified entry
+        just build a small lowercase -> attribute name index.
     """
+    __slots__ = ('dn', 'ref', '_raw', '_index', '_data')
+
     # the ldif class base64 encodes some attrs which I would rather see in raw form - to
     # encode specific attrs as base64, add them to the list below
     ldif.safe_string_re = re.compile('^$')
@@ -45,33 +52,77 @@ class Entry(object):
 
         If creating a new empty entry, data is the string DN.
         """
+        self.dn = None
         self.ref = None
+        self._raw = None
+        self._index = None
+        self._data = None
         if entrydata:
             if isinstance(entrydata, tuple):
                 if entrydata[0] is None:
                     self.ref = entrydata[1]  # continuation reference
                 else:
                     self.dn = entrydata[0]
-                    self.data = cidict(entrydata[1])
+                    self._raw = entrydata[1]
             elif isinstance(entrydata, basestring):
                 if not '=' in entrydata:
                     raise ValueError('Entry dn must contain "="')
-                    
+
                 self.dn = entrydata
-                self.data = cidict()
+                self._data = cidict()
         else:
             #
             self.dn = ''
-            self.data = cidict()
+            self._data = cidict()
+
+    def _get_data(self):
+        """Return the cidict of attributes, building it on first access."""
+        if self._data is None and self._raw is not None:
+            self._data = cidict(self._raw)
+            self._raw = self._index = None
+        return self._data
+
+    def _set_data(self, data):
+        self._data = data
+        self._raw = self._index = None
+
+    data = property(_get_data, _set_data)
+
+    def _lookup(self, name, default=None):
+        """Return the values of `name` without materializing the cidict."""
+        if self._data is not None:
+            return self._data.get(name, default)
+        raw = self._raw
+        if raw is None:
+            return default
+        try:
+            return raw[name]
+        except KeyError:
+            pass
+        if self._index is None:
+            self._index = dict([(key.lower(), key) for key in raw])
+        key = self._index.get(name.lower())
+        if key is None:
+            return default
+        return raw[key]
+
+    def __getstate__(self):
+        return (self.dn, self.ref, self.data)
+
+    def __setstate__(self, state):
+        self.dn, self.ref, self._data = state
+        self._raw = self._index = None
 
     def __nonzero__(self):
         """This allows us to do tests like if entry: returns false if there is no data,
         true otherwise"""
-        return self.data is not None and len(self.data) > 0
+        if self._data is None:
+            return bool(self._raw)
+        return len(self._data) > 0
 
     def hasAttr(self, name):
         """Return True if this entry has an attribute named name, False otherwise"""
-        return self.data and name in self.data
+        return self._lookup(name) is not None
 
     def __getattr__(self, name):
         """If name is the name of an LDAP attribute, return the first value for that
@@ -81,38 +132,41 @@ class Entry(object):
             entry.getValue('cn')
         This also allows us to return None if an attribute is not found rather than
         throwing an exception"""
-        if name == 'dn' or name == 'data':
-            return self.__dict__.get(name, None)
+        if name.startswith('__'):
+            # don't fool copy, pickle & co. looking for special methods
+            raise AttributeError(name)
         return self.getValue(name)
 
     def getValues(self, name):
         """Get the list (array) of values for the attribute named name"""
-        return self.data.get(name, [])
+        return self._lookup(name, [])
 
     def getValue(self, name):
         """Get the first value for the attribute named name"""
-        return self.data.get(name, [None])[0]
+        return self._lookup(name, [None])[0]
 
     def hasValue(self, name, val=None):
         """True if the given attribute is present and has the given value
         
             TODO: list comparison preserves order: should I use a set?
         """
-        if not self.hasAttr(name):
+        values = self._lookup(name)
+        if values is None:
             return False
         if not val:
             return True
         if isinstance(val, list):
-            return val == self.data.get(name)
+            return val == values
         if isinstance(val, tuple):
-            return list(val) == self.data.get(name)
-        return val in self.data.get(name)
+            return list(val) == values
+        return val in values
 
     def hasValueCase(self, name, val):
         """True if the given attribute is present and has the given value - case insensitive value match"""
-        if not self.hasAttr(name):
+        values = self._lookup(name)
+        if values is None:
             return False
-        return val.lower() in [x.lower() for x in self.data.get(name)]
+        return val.lower() in [x.lower() for x in values]
 
     def setValue(self, name, *value):
         """Value passed in may be a single value, several values, or a single sequence.
@@ -129,11 +183,17 @@ class Entry(object):
             self.data[name] = value
 
     def getAttrs(self):
-        if not self.data:
-            return []
-        return self.data.keys()
+        if self._data is None:
+            if not self._raw:
+                return []
+            return self._raw.keys()
+        return self._data.keys()
 
     def iterAttrs(self, attrsOnly=False):
+        if self._data is None and self._raw is not None:
+            if attrsOnly:
+                return self._raw.iterkeys()
+            return self._raw.iteritems()
         if attrsOnly:
             return self.data.iterkeys()
         else:
@@ -145,6 +205,8 @@ class Entry(object):
         """Convert the attrs and values to a list of 2-tuples.  The first element
         of the tuple is the attribute name.  The second element is either a
         single value or a list of values."""
+        if self._data is None and self._raw is not None:
+            return self._raw.items()
         return self.data.items()
 
     def getref(self):
@@ -172,7 +234,10 @@ class Entry(object):
         # but in the meantime, we have to convert to a plain old dict for printing
         # I also don't want to see wrapping, so set the line width really high (1000)
         newdata = {}
-        newdata.update(self.data)
+        if self._data is None and self._raw is not None:
+            newdata.update(self._raw)
+        else:
+            newdata.update(self.data)
         ldif.LDIFWriter(
             sio, Entry.base64_attrs, 1000).unparse(self.dn, newdata)
         return sio.getvalue()
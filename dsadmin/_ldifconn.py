@@ -1,8 +1,13 @@
-__all__ = ['LDIFConn']
+__all__ = ['LDIFConn', 'LDIFIndex', 'iter_ldif', 'get_ldif_entry']
+import anydbm
+import base64
+import cStringIO
+import os
 import ldif
 from dsadmin._entry import Entry
 from dsadmin.utils import normalizeDN
 
+
 class LDIFConn(ldif.LDIFParser):
     def __init__(
         self,
@@ -15,6 +20,9 @@ class LDIFConn(ldif.LDIFParser):
         Additional Parameters:
         all_records
         List instance for storing parsed records
+
+        NOTE: this keeps every entry in memory. To scan big files
+              use iter_ldif, get_ldif_entry or LDIFIndex.
         """
         self.dndict = {}  # maps dn to Entry
         self.dnlist = []  # contains entries in order read
@@ -41,3 +49,161 @@ class LDIFConn(ldif.LDIFParser):
         ndn = normalizeDN(dn)
         return self.dndict.get(ndn, Entry(None))
 
+
+class _RecordParser(ldif.LDIFParser):
+    """Parse the text of a single LDIF record."""
+    def __init__(self, text):
+        self.entry = None
+        ldif.LDIFParser.__init__(self, cStringIO.StringIO(text))
+        self.parse()
+
+    def handle(self, dn, entry):
+        if not dn:
+            dn = ''
+        self.entry = Entry((dn, entry))
+
+
+def _records(myfile):
+    """Yield (offset, dn, text) for each record of an LDIF file.
+
+        Records are split on empty lines, and only the dn line is decoded:
+        the full parsing is left to _RecordParser. Records without a dn
+        (eg. adm.conf) have dn ''.
+    """
+    offset = myfile.tell()
+    lines = []
+    while True:
+        line = myfile.readline()
+        if line and line.strip():
+            lines.append(line)
+            continue
+        if lines:
+            dn = ''
+            for i, item in enumerate(lines):
+                if item[:3].lower() == 'dn:':
+                    # unfold continuation lines
+                    value = item.rstrip('\r\n')
+                    for cont in lines[i + 1:]:
+                        if not cont.startswith(' '):
+                            break
+                        value += cont[1:].rstrip('\r\n')
+                    if value[3:4] == ':':
+                        dn = base64.b64decode(value[4:].strip())
+                    else:
+                        dn = value[3:].strip()
+                    break
+            yield offset, dn, ''.join(lines)
+            lines = []
+        if not line:
+            break
+        offset = myfile.tell()
+
+
+def _open(input_file):
+    """Return (file object, close it when done)."""
+    if isinstance(input_file, basestring):
+        return open(input_file, "r"), True
+    return input_file, False
+
+
+def iter_ldif(input_file):
+    """Yield the entries of an LDIF file one at a time.
+        @param input_file - file name or file object
+    """
+    myfile, toclose = _open(input_file)
+    try:
+        for offset, dn, text in _records(myfile):
+            entry = _RecordParser(text).entry
+            if entry is not None:
+                yield entry
+    finally:
+        if toclose:
+            myfile.close()
+
+
+def get_ldif_entry(input_file, dn):
+    """Return the first entry of an LDIF file matching dn, or Entry(None).
+
+        Only the matching record is parsed, and the file is read up to it.
+    """
+    ndn = normalizeDN(dn)
+    myfile, toclose = _open(input_file)
+    try:
+        for offset, recdn, text in _records(myfile):
+            if normalizeDN(recdn) == ndn:
+                entry = _RecordParser(text).entry
+                if entry is not None:
+                    return entry
+    finally:
+        if toclose:
+            myfile.close()
+    return Entry(None)
+
+
+class LDIFIndex(object):
+    """Random access to the entries of an LDIF file without loading them.
+
+        The index maps each normalized dn to the offset of its record:
+        get(dn) just seeks and parses that record. If indexfile is given
+        the index is stored there with anydbm, and reused until the LDIF
+        file changes.
+
+        ex. index = LDIFIndex('/tmp/export.ldif', '/tmp/export.idx')
+            entry = index.get('uid=user1,ou=People,dc=example,dc=com')
+            for entry in index:
+                ...
+    """
+    STAMP_KEY = '\0stamp'
+
+    def __init__(self, path, indexfile=None):
+        self.path = path
+        self.indexfile = indexfile
+        stat = os.stat(path)
+        stamp = "%d:%d" % (stat.st_size, int(stat.st_mtime))
+        if indexfile:
+            self.offsets = anydbm.open(indexfile, 'c')
+            if not self.offsets.has_key(LDIFIndex.STAMP_KEY) or \
+                    self.offsets[LDIFIndex.STAMP_KEY] != stamp:
+                self.offsets.close()
+                self.offsets = anydbm.open(indexfile, 'n')
+                self._build()
+                self.offsets[LDIFIndex.STAMP_KEY] = stamp
+        else:
+            self.offsets = {}
+            self._build()
+
+    def _build(self):
+        myfile = open(self.path, "r")
+        try:
+            for offset, dn, text in _records(myfile):
+                ndn = normalizeDN(dn)
+                # like LDIFConn, the last record wins
+                self.offsets[ndn] = str(offset)
+        finally:
+            myfile.close()
+
+    def __iter__(self):
+        return iter_ldif(self.path)
+
+    def __contains__(self, dn):
+        return self.offsets.has_key(normalizeDN(dn))
+
+    def get(self, dn):
+        ndn = normalizeDN(dn)
+        if not self.offsets.has_key(ndn):
+            return Entry(None)
+        myfile = open(self.path, "r")
+        try:
+            myfile.seek(int(self.offsets[ndn]))
+            for offset, recdn, text in _records(myfile):
+                entry = _RecordParser(text).entry
+                if entry is not None:
+                    return entry
+                break
+        finally:
+            myfile.close()
+        return Entry(None)
+
+    def close(self):
+        if self.indexfile:
+            self.offsets.close()
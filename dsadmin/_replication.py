@@ -1,33 +1,86 @@
+import array
+import datetime
+import re
+import threading
+import time
+
+from dsadmin._entry import FormatDict
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# A CSN string is 20 hex digits: ts(8) seq(4) rid(4) subseq(4).
+# As subseq is not used, ts, seq and rid are packed in a 64 bit key
+# sorting like the CSNs: key = ts << 32 | seq << 16 | rid
+if array.array('L').itemsize >= 8:
+    def _keyarray(keys):
+        return array.array('L', keys)
+else:
+    # no 64 bit array type: fall back to a list of longs
+    def _keyarray(keys):
+        return list(keys)
+
+
+def csn_key(csnstr):
+    """Return the packed key of a CSN string, 0 if empty or invalid."""
+    if len(csnstr) >= 20:
+        try:
+            return int(csnstr[:16], 16)
+        except ValueError:
+            pass
+    if csnstr:
+        log.info("%r is not a valid CSN" % csnstr)
+    return 0
+
+
+def parse_csns(csnstrs):
+    """Return the keys of many CSN strings in an array."""
+    return _keyarray([csn_key(x) for x in csnstrs])
+
+
+def key_ts(key):
+    """Return the timestamp of a packed CSN key."""
+    return key >> 32
+
 
 class CSN(object):
     """CSN is Change Sequence Number
         csn.ts is the timestamp (time_t - seconds)
         csn.seq is the sequence number (max 65535)
         csn.rid is the replica ID of the originating master
-        csn.subseq is not currently used"""
-    import re
-    import time
-    csnpat = r'(.{8})(.{4})(.{4})(.{4})'
-    csnre = re.compile(csnpat)
+        csn.subseq is not currently used
+        csn.key packs ts, seq and rid in a sortable 64 bit int
+
+        NOTE: cmp(csn1, csn2) is 1 when csn2 is newer.
+    """
+    __slots__ = ('csnstr', 'key', 'subseq')
 
     def __init__(self, csnstr):
-        match = CSN.csnre.match(csnstr)
         self.csnstr = csnstr
-        self.ts = 0
-        self.seq = 0
-        self.rid = 0
+        self.key = csn_key(csnstr)
         self.subseq = 0
-        if match:
-            self.ts = int(match.group(1), 16)
-            self.seq = int(match.group(2), 16)
-            self.rid = int(match.group(3), 16)
-            self.subseq = int(match.group(4), 16)
-        elif csnstr:
-            self.ts = 0
-            self.seq = 0
-            self.rid = 0
-            self.subseq = 0
-            log.info("%r is not a valid CSN" % csnstr)
+        if self.key:
+            self.subseq = int(csnstr[16:20], 16)
+
+    @staticmethod
+    def fromkey(key):
+        """Return the CSN of a packed key."""
+        if not key:
+            return CSN('')
+        return CSN("%016x0000" % key)
+
+    def _get_ts(self):
+        return self.key >> 32
+    ts = property(_get_ts)
+
+    def _get_seq(self):
+        return (self.key >> 16) & 0xffff
+    seq = property(_get_seq)
+
+    def _get_rid(self):
+        return self.key & 0xffff
+    rid = property(_get_rid)
 
     def csndiff(self, oth):
         return (oth.ts - self.ts, oth.seq - self.seq, oth.rid - self.rid, oth.subseq - self.subseq)
@@ -35,15 +88,7 @@ class CSN(object):
     def __cmp__(self, oth):
         if self is oth:
             return 0
-        (tsdiff, seqdiff, riddiff, subseqdiff) = self.csndiff(oth)
-
-        diff = tsdiff or seqdiff or riddiff or subseqdiff
-        ret = 0
-        if diff > 0:
-            ret = 1
-        elif diff < 0:
-            ret = -1
-        return ret
+        return cmp((oth.key, oth.subseq), (self.key, self.subseq))
 
     def __eq__(self, oth):
         return cmp(self, oth) == 0
@@ -80,12 +125,21 @@ class CSN(object):
         return self.__repr__()
 
 
-
+def _sign(value):
+    if value > 0:
+        return 1
+    elif value < 0:
+        return -1
+    return 0
 
 
 class RUV(object):
     """RUV is Replica Update Vector
         ruv.gen is the generation CSN
+        ruv.rids, ruv.mins, ruv.maxs and ruv.lastmods are parallel arrays:
+          the replica IDs, the packed min and max CSN keys and the last
+          modified timestamps
+        ruv.urls is the list of purls
         ruv.rid[1] through ruv.rid[N] are dicts - the number (1-N) is the replica ID
           ruv.rid[N][url] is the purl
           ruv.rid[N][min] is the min csn
@@ -94,40 +148,67 @@ class RUV(object):
         example ruv attr:
         nsds50ruv: {replicageneration} 3b0ebc7f000000010000
         nsds50ruv: {replica 1 ldap://myhost:51010} 3b0ebc9f000000010000 3b0ebef7000000010000
-        nsre_ruvplicaLastModified: {replica 1 ldap://myhost:51010} 292398402093
+        nsruvReplicaLastModified: {replica 1 ldap://myhost:51010} 292398402093
         if the tryrepl flag is true, if getting the ruv from the suffix fails, try getting
         the ruv from the cn=replica entry
     """
-    import re
-    import time
     pre_gen = r'\{replicageneration\}\s+(\w+)'
     re_gen = re.compile(pre_gen)
     pre_ruv = r'\{replica\s+(\d+)\s+(.+?)\}\s*(\w*)\s*(\w*)'
     re_ruv = re.compile(pre_ruv)
 
     def __init__(self, ent):
-        # rid is a dict
-        # key is replica ID - val is dict of url, min csn, max csn
-        self.rid = {}
+        self.gen = None
+        rids, urls, mins, maxs = [], [], [], []
         for item in ent.getValues('nsds50ruv'):
             matchgen = RUV.re_gen.match(item)
             matchruv = RUV.re_ruv.match(item)
             if matchgen:
                 self.gen = CSN(matchgen.group(1))
             elif matchruv:
-                rid = int(matchruv.group(1))
-                self.rid[rid] = {'url': matchruv.group(2),
-                                 'min': CSN(matchruv.group(3)),
-                                 'max': CSN(matchruv.group(4))}
+                rids.append(int(matchruv.group(1)))
+                urls.append(matchruv.group(2))
+                mins.append(matchruv.group(3))
+                maxs.append(matchruv.group(4))
             else:
                 log.info("unknown RUV element %r" % item)
-        for item in ent.getValues('nsre_ruvplicaLastModified'):
+        self.rids = array.array('l', rids)
+        self.urls = urls
+        self.mins = parse_csns(mins)
+        self.maxs = parse_csns(maxs)
+        self.index = dict([(rid, i) for i, rid in enumerate(rids)])
+        # -1 if unknown
+        self.lastmods = array.array('l', [-1]) * len(rids)
+        for item in ent.getValues('nsruvReplicaLastModified'):
             matchruv = RUV.re_ruv.match(item)
-            if matchruv:
-                rid = int(matchruv.group(1))
-                self.rid[rid]['lastmod'] = int(matchruv.group(3), 16)
+            if matchruv and int(matchruv.group(1)) in self.index:
+                i = self.index[int(matchruv.group(1))]
+                self.lastmods[i] = int(matchruv.group(3), 16)
             else:
-                log.info("unknown nsre_ruvplicaLastModified item %r" % item)
+                log.info("unknown nsruvReplicaLastModified item %r" % item)
+        self._rid = None
+
+    def _get_rid(self):
+        """The dict view of the arrays, built on first use."""
+        if self._rid is None:
+            self._rid = {}
+            for i, rid in enumerate(self.rids):
+                elem = {'url': self.urls[i],
+                        'min': CSN.fromkey(self.mins[i]),
+                        'max': CSN.fromkey(self.maxs[i])}
+                if self.lastmods[i] >= 0:
+                    elem['lastmod'] = self.lastmods[i]
+                self._rid[rid] = elem
+        return self._rid
+    rid = property(_get_rid)
+
+    def keys(self, rids, item='max'):
+        """Return the `item` ('max' or 'min') keys of rids in an array,
+            0 for the replica IDs missing from this RUV.
+        """
+        values = getattr(self, item + 's')
+        index = self.index
+        return _keyarray([rid in index and values[index[rid]] or 0 for rid in rids])
 
     def __cmp__(self, oth):
         if self is oth:
@@ -139,20 +220,12 @@ class RUV(object):
         diff = cmp(self.gen, oth.gen)
         if diff:
             return diff
-        for rid in self.rid.keys():
-            for item in ('max', 'min'):
-                csn = self.rid[rid][item]
-                csnoth = oth.rid[rid][item]
-                diff = cmp(csn, csnoth)
-                if diff:
-                    return diff
-        for rid in oth.rid.keys():
-            for item in ('max', 'min'):
-                csn = oth.rid[rid][item]
-                csnoth = self.rid[rid][item]
-                diff = cmp(csnoth, csn)
-                if diff:
-                    return diff
+        rids = union_rids([self, oth])
+        for item in ('max', 'min'):
+            for mine, theirs in zip(self.keys(rids, item), oth.keys(rids, item)):
+                if mine != theirs:
+                    # same sign as CSN.__cmp__
+                    return _sign(theirs - mine)
         return 0
 
     def __eq__(self, oth):
@@ -160,9 +233,10 @@ class RUV(object):
 
     def __str__(self):
         ret = 'generation: %s\n' % self.gen
-        for rid in self.rid.keys():
+        for rid in sorted(self.rids):
+            i = self.index[rid]
             ret = ret + 'rid: %s url: %s min: [%s] max: [%s]\n' % \
-                (rid, self.rid[rid]['url'], self.rid[rid].get('min', ''), self. rid[rid].get('max', ''))
+                (rid, self.urls[i], CSN.fromkey(self.mins[i]), CSN.fromkey(self.maxs[i]))
         return ret
 
     def getdiffs(self, oth):
@@ -179,18 +253,288 @@ class RUV(object):
         if diff:
             return (diff, "\tgeneration [" + str(self.gen) + "] not equal to [" + str(oth.gen) + "]: likely not yet initialized")
         retstr = ''
-        for rid in self.rid.keys():
-            for item in ('max', 'min'):
-                csn = self.rid[rid][item]
-                csnoth = oth.rid[rid][item]
-                csndiff = cmp(csn, csnoth)
-                if csndiff:
-                    if len(retstr):
-                        retstr += "\n"
-                    retstr += "\trid %d %scsn %s\n\t[%s] vs [%s]" % (rid, item, csn.diff2str(csnoth),
-                                                                     csn, csnoth)
-                    if not diff:
-                        diff = csndiff
+        rids = sorted(self.rids)
+        mymaxs, mymins = self.keys(rids, 'max'), self.keys(rids, 'min')
+        maxs, mins = oth.keys(rids, 'max'), oth.keys(rids, 'min')
+        for i, rid in enumerate(rids):
+            for item, mine, theirs in (('max', mymaxs[i], maxs[i]),
+                                       ('min', mymins[i], mins[i])):
+                if mine == theirs:
+                    continue
+                csn, csnoth = CSN.fromkey(mine), CSN.fromkey(theirs)
+                if len(retstr):
+                    retstr += "\n"
+                retstr += "\trid %d %scsn %s\n\t[%s] vs [%s]" % (rid, item, csn.diff2str(csnoth),
+                                                                 csn, csnoth)
+                if not diff:
+                    diff = _sign(theirs - mine)
         if not diff:
             retstr = "\tup-to-date - RUVs are equal"
         return (diff, retstr)
+
+
+def union_rids(ruvs):
+    """Return the sorted replica IDs found in any of ruvs."""
+    rids = {}
+    for ruv in ruvs:
+        for rid in ruv.rids:
+            rids[rid] = True
+    ret = rids.keys()
+    ret.sort()
+    return ret
+
+
+def align(ruvs, item='max'):
+    """Return (rids, rows): the sorted replica IDs of all the ruvs and,
+        for each ruv, the array of its `item` keys aligned to rids, with
+        0 for the missing replica IDs. Comparing N RUVs is then column
+        arithmetic on the rows.
+    """
+    rids = union_rids(ruvs)
+    return rids, [ruv.keys(rids, item) for ruv in ruvs]
+
+
+def changes_by_rid(value):
+    """Return {rid: (sent, skipped)} from the "rid:sent/skipped" items of
+        a nsds5replicaChangesSentSinceStartup value. {} for a plain number.
+    """
+    ret = {}
+    for item in value.split(' '):
+        ary = item.split(":")
+        if ary and len(ary) > 1:
+            counts = ary[1].split("/")
+            skipped = 0
+            if len(counts) > 1:
+                skipped = int(counts[1])
+            ret[int(ary[0])] = (int(counts[0]), skipped)
+    return ret
+
+
+def changes_sent(value):
+    """Return the number of changes in a nsds5replicaChangesSentSinceStartup
+        value: either a number or "rid:sent/skipped" items.
+    """
+    items = value.split(' ')
+    if len(items) == 1 and ':' not in items[0]:
+        return int(items[0])
+    return sum([sent for sent, skipped in changes_by_rid(value).values()])
+
+
+def parse_gentime(value):
+    """Return the datetime of a GeneralizedTime value like 20130415120023Z,
+        None if empty or 0 (never).
+    """
+    if not value or value == '0':
+        return None
+    try:
+        return datetime.datetime(*time.strptime(value[:14], "%Y%m%d%H%M%S")[:6])
+    except ValueError:
+        log.info("%r is not a valid GeneralizedTime" % value)
+        return None
+
+
+class AgreementStatus(object):
+    """The status of a replication agreement, parsed from its entry.
+        str() gives the report of Replica.status.
+    """
+    ATTRS = ['cn', 'nsDS5ReplicaRoot', 'nsds5BeginReplicaRefresh',
+             'nsds5replicaUpdateInProgress', 'nsds5ReplicaLastInitStatus',
+             'nsds5ReplicaLastInitStart', 'nsds5ReplicaLastInitEnd',
+             'nsds5replicaReapActive', 'nsds5replicaLastUpdateStart',
+             'nsds5replicaLastUpdateEnd', 'nsds5replicaChangesSentSinceStartup',
+             'nsds5replicaLastUpdateStatus', 'nsds5replicaChangesSkippedSinceStartup',
+             'nsds5ReplicaHost', 'nsds5ReplicaPort']
+    FORMAT = (
+        "Status for %(cn)s agmt %(nsDS5ReplicaHost)s:%(nsDS5ReplicaPort)s" "\n"
+        "Update in progress: %(nsds5replicaUpdateInProgress)s" "\n"
+        "Last Update Start: %(nsds5replicaLastUpdateStart)s" "\n"
+        "Last Update End: %(nsds5replicaLastUpdateEnd)s" "\n"
+        "Num. Changes Sent: %(nsds5replicaChangesSentSinceStartup)s" "\n"
+        "Num. changes Skipped: %(nsds5replicaChangesSkippedSinceStartup)s" "\n"
+        "Last update Status: %(nsds5replicaLastUpdateStatus)s" "\n"
+        "Init in progress: %(nsds5BeginReplicaRefresh)s" "\n"
+        "Last Init Start: %(nsds5ReplicaLastInitStart)s" "\n"
+        "Last Init End: %(nsds5ReplicaLastInitEnd)s" "\n"
+        "Last Init Status: %(nsds5ReplicaLastInitStatus)s" "\n"
+        "Reap Active: %(nsds5ReplicaReapActive)s" "\n"
+    )
+    re_status = re.compile(r'^\s*(-?\d+)')
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.dn = entry.dn
+        self.cn = entry.cn
+        self.suffix = entry.nsDS5ReplicaRoot
+        self.host = entry.nsDS5ReplicaHost
+        self.port = None
+        if entry.nsDS5ReplicaPort:
+            self.port = int(entry.nsDS5ReplicaPort)
+        self.update_in_progress = (
+            (entry.nsds5replicaUpdateInProgress or '').lower() == 'true')
+        self.last_update_start = parse_gentime(entry.nsds5replicaLastUpdateStart)
+        self.last_update_end = parse_gentime(entry.nsds5replicaLastUpdateEnd)
+        self.last_update_status = entry.nsds5replicaLastUpdateStatus
+        self.last_update_code = self._code(self.last_update_status)
+        sent = entry.nsds5replicaChangesSentSinceStartup or '0'
+        self.changes_by_rid = changes_by_rid(sent)
+        self.changes_sent = changes_sent(sent)
+        self.changes_skipped = int(entry.nsds5replicaChangesSkippedSinceStartup or 0)
+        self.init_in_progress = bool(entry.nsds5BeginReplicaRefresh)
+        self.last_init_start = parse_gentime(entry.nsds5ReplicaLastInitStart)
+        self.last_init_end = parse_gentime(entry.nsds5ReplicaLastInitEnd)
+        self.last_init_status = entry.nsds5ReplicaLastInitStatus
+        self.reap_active = entry.nsds5replicaReapActive not in (None, '0')
+
+    def _code(self, status):
+        """The status values start with the ldap/replication error code."""
+        match = AgreementStatus.re_status.match(status or '')
+        if match:
+            return int(match.group(1))
+        return None
+
+    def __str__(self):
+        # FormatDict manages missing fields in string formatting
+        return AgreementStatus.FORMAT % FormatDict(self.entry.data)
+
+    def __repr__(self):
+        return "<AgreementStatus %s>" % self.dn
+
+
+class ReplicationTopology(object):
+    """The RUVs of a suffix on all the servers of a replication topology.
+
+        fetch() reads the RUVs concurrently, one thread per server, so it
+        takes as long as the slowest server (or timeout), not the sum.
+        The lags are then computed locally, without further round trips:
+
+        topo = ReplicationTopology([m1, m2, m3], 'dc=example,dc=com')
+        topo.fetch(timeout=30)
+        for rid, (server, lag) in topo.worst_lag().items():
+            print "rid %d: %s is %s seconds behind" % (rid, server, lag)
+
+        Servers are named by str(conn), ie. host:port. Each connection
+        is used by one thread only.
+    """
+    def __init__(self, conns, suffix, tryrepl=False):
+        """@param conns - DSAdmin instances
+            @param suffix - the replicated suffix
+            @param tryrepl - passed to Replica.ruv
+        """
+        self.conns = conns
+        self.suffix = suffix
+        self.tryrepl = tryrepl
+        self.ruvs = {}  # server name -> RUV
+        self.errors = {}  # server name -> exception or error string
+
+    def _fetch_one(self, conn, results):
+        try:
+            results[str(conn)] = conn.replica.ruv(self.suffix, self.tryrepl)
+        except Exception, e:
+            results[str(conn)] = e
+
+    def fetch(self, timeout=None):
+        """Read the RUV from every server and return self.
+            @param timeout - give up on the servers not answering within
+                    timeout seconds: they are reported in self.errors
+        """
+        results = {}
+        threads = []
+        for conn in self.conns:
+            thread = threading.Thread(target=self._fetch_one, args=(conn, results),
+                                      name="ruv %s" % conn)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        for thread in threads:
+            if deadline is None:
+                thread.join()
+            else:
+                thread.join(max(0, deadline - time.time()))
+        self.ruvs = {}
+        self.errors = {}
+        for conn in self.conns:
+            name = str(conn)
+            # read once: a late thread may still write it
+            result = results.get(name)
+            if result is None:
+                self.errors[name] = "no answer within %s seconds" % timeout
+            elif isinstance(result, Exception):
+                log.error("Cannot read RUV from %s: %s" % (name, result))
+                self.errors[name] = result
+            else:
+                self.ruvs[name] = result
+        return self
+
+    def _align(self):
+        """Return (servers, rids, rows of max timestamps, 0 if missing)."""
+        servers = self.ruvs.keys()
+        servers.sort()
+        rids, rows = align([self.ruvs[x] for x in servers])
+        return servers, rids, [[key_ts(key) for key in row] for row in rows]
+
+    def maxcsns(self):
+        """Return {rid: {server: max CSN}}.
+            A server without changes from rid has no entry.
+        """
+        ret = {}
+        servers = self.ruvs.keys()
+        servers.sort()
+        rids, rows = align([self.ruvs[x] for x in servers])
+        for name, row in zip(servers, rows):
+            for rid, key in zip(rids, row):
+                if key:
+                    ret.setdefault(rid, {})[name] = CSN.fromkey(key)
+        return ret
+
+    def lag_matrix(self):
+        """Return {rid: {(a, b): seconds}}: how many seconds server a is
+            behind server b on the changes of rid. Negative if ahead,
+            None if a has no change from rid yet.
+        """
+        servers, rids, rows = self._align()
+        ret = {}
+        for j, rid in enumerate(rids):
+            column = [row[j] for row in rows]
+            matrix = ret[rid] = {}
+            for a, tsa in zip(servers, column):
+                for b, tsb in zip(servers, column):
+                    if a == b or not tsb:
+                        continue
+                    if not tsa:
+                        matrix[(a, b)] = None
+                    else:
+                        matrix[(a, b)] = tsb - tsa
+        return ret
+
+    def worst_lag(self):
+        """Return {rid: (server, seconds)}: the server most behind the
+            most up to date one for each replica ID. seconds is None if
+            the server has no change from rid yet.
+        """
+        servers, rids, rows = self._align()
+        ret = {}
+        for j, rid in enumerate(rids):
+            column = [row[j] for row in rows]
+            if min(column) == 0:
+                ret[rid] = (servers[column.index(0)], None)
+            else:
+                oldest = min(column)
+                ret[rid] = (servers[column.index(oldest)], max(column) - oldest)
+        return ret
+
+    def __str__(self):
+        ret = "Replication lag for %s\n" % self.suffix
+        rids = self.worst_lag().items()
+        rids.sort()
+        for rid, (name, lag) in rids:
+            if lag is None:
+                ret += "rid %d: %s has no change yet\n" % (rid, name)
+            else:
+                ret += "rid %d: %s is %s behind\n" % (
+                    rid, name, datetime.timedelta(seconds=lag))
+        for name, error in self.errors.items():
+            ret += "%s: %s\n" % (name, error)
+        return ret
@@ -0,0 +1,179 @@
+"""HTTP client of the admin server CGIs.
+
+    An AdminServerClient keeps its HTTP/1.1 connections to an admin
+    server alive between requests, and can be shared by many threads:
+    each request checks out an idle connection, or opens a new one.
+
+        client = get_client('ldap1.example.com', 9830, 'admin', 'password')
+        rc = client.post('/slapd-ldap1/Tasks/Operation/stop')
+
+    The Basic authentication header is computed once: base64.MAXBINSIZE
+    is left alone.
+"""
+__all__ = ['AdminServerClient', 'get_client']
+
+import base64
+import httplib
+import Queue
+import socket
+import threading
+import urllib
+
+from dsadmin import DsError
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# make admin server think we are the console
+USER_AGENT = 'Fedora-Console/1.0'
+CHUNK_SIZE = 8192
+
+
+class AdminServerClient(object):
+    """Keep-alive connections to an admin server, with Basic auth."""
+
+    def __init__(self, host, port, username, password, secure=False, size=4, timeout=None):
+        """@param secure - use https
+            @param size - max idle connections kept open
+            @param timeout - socket timeout in seconds, None for the default
+        """
+        self.host = host
+        self.port = int(port)
+        self.secure = secure
+        self.timeout = timeout
+        self.headers = {
+            'Authorization': 'Basic ' + base64.b64encode("%s:%s" % (username, password)),
+            'User-Agent': USER_AGENT,
+            'Content-Type': 'application/x-www-form-urlencoded',
+        }
+        self._idle = Queue.Queue(size)
+
+    def __str__(self):
+        prefix = 'http'
+        if self.secure:
+            prefix = 'https'
+        return '%s://%s:%s' % (prefix, self.host, self.port)
+
+    def _connect(self):
+        kwargs = {}
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+        if self.secure:
+            return httplib.HTTPSConnection(self.host, self.port, **kwargs)
+        return httplib.HTTPConnection(self.host, self.port, **kwargs)
+
+    def _get(self):
+        """Return an idle connection and True, or a new one and False."""
+        try:
+            return self._idle.get(False), True
+        except Queue.Empty:
+            return self._connect(), False
+
+    def _put(self, conn):
+        try:
+            self._idle.put(conn, False)
+        except Queue.Full:
+            conn.close()
+
+    def _request(self, conn, uri, body):
+        conn.request('POST', uri, body, self.headers)
+        return conn.getresponse()
+
+    def post(self, uri, args=None, verbose=False):
+        """Post args to the CGI at uri and return its NMC_Status as an
+            int, 1 if the output has none.
+            @raise DsError - if the admin server answers with an HTTP error
+        """
+        body = urllib.urlencode(args or {})
+        if verbose:
+            log.info("requesting url %s%s" % (self, uri))
+        conn, reused = self._get()
+        try:
+            resp = self._request(conn, uri, body)
+        except (httplib.HTTPException, socket.error), e:
+            conn.close()
+            if not reused:
+                raise
+            # the server closed the idle connection: retry on a new one
+            log.debug("Stale connection to %s: %s" % (self, e))
+            conn = self._connect()
+            try:
+                resp = self._request(conn, uri, body)
+            except:
+                conn.close()
+                raise
+        try:
+            status = self._parse(resp, verbose)
+        except:
+            conn.close()
+            raise
+        if resp.will_close:
+            conn.close()
+        else:
+            self._put(conn)
+        if resp.status != httplib.OK:
+            raise DsError("%s%s: HTTP %d %s" % (self, uri, resp.status, resp.reason))
+        return status
+
+    def _parse(self, resp, verbose):
+        """Read the whole response, chunk by chunk, and return its
+            NMC_Status. The body is drained even after the status is
+            found, so that the connection can be reused.
+        """
+        status = 1
+        found = False
+        tail = ''
+        while True:
+            chunk = resp.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if found:
+                continue
+            lines = (tail + chunk).split('\n')
+            tail = lines.pop()
+            for line in lines:
+                found, status = self._status(line, verbose)
+                if found:
+                    break
+        if not found and tail:
+            found, status = self._status(tail, verbose)
+        if not found:
+            status = 1
+        return status
+
+    def _status(self, line, verbose):
+        """Return (True, status) if line is the NMC_Status one."""
+        if verbose:
+            log.info(line.rstrip('\r'))
+        ary = line.split(":")
+        if len(ary) > 1 and ary[0] == 'NMC_Status':
+            return True, int(ary[1].strip())
+        return False, 1
+
+    def close(self):
+        """Close the idle connections."""
+        while True:
+            try:
+                conn = self._idle.get(False)
+            except Queue.Empty:
+                break
+            conn.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(host, port, username, password, secure=False):
+    """Return the shared AdminServerClient of an admin server and user."""
+    key = (host.lower(), int(port), username, password, bool(secure))
+    _clients_lock.acquire()
+    try:
+        client = _clients.get(key)
+        if client is None:
+            client = AdminServerClient(host, port, username, password, secure)
+            _clients[key] = client
+        return client
+    finally:
+        _clients_lock.release()
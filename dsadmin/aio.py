@@ -0,0 +1,406 @@
+"""Many concurrent operations on one connection, without threads.
+
+    python-ldap asynchronous calls return a message id right away. An
+    AsyncDSAdmin sends them on a bound DSAdmin, keeps an LdapFuture for
+    each message id and completes it when its results arrive. A single
+    thread can keep thousands of operations outstanding:
+
+        aconn = AsyncDSAdmin(conn)
+        futures = [aconn.getEntry(dn) for dn in dns]
+        aconn.run(futures)
+        entries = [f.result() for f in futures]
+
+    Event loops drive it with fileno() and process() instead of run():
+    watch fileno() for reading and call process() when it is readable,
+    or when next_timeout() seconds have passed (to poll running tasks).
+
+    Futures complete, and their callbacks run, inside process(): an
+    AsyncDSAdmin and its connection must be used by one thread only.
+"""
+__all__ = ['AsyncDSAdmin', 'LdapFuture']
+
+import select
+import time
+from collections import deque
+
+import ldap
+
+from dsadmin import Entry, NoSuchEntryError
+from dsadmin._constants import DN_MAPPING_TREE, DN_TASKS
+from dsadmin._replication import AgreementStatus
+from dsadmin.tasks import TaskManager, task_entry
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# python-ldap 3 reports the message id of failed operations, so the
+# results of all the operations can be read with one RES_ANY call.
+# Older versions lose it: every outstanding message id is polled.
+HASERRORMSGID = int(ldap.__version__.split('.')[0]) >= 3
+
+
+class LdapFuture(object):
+    """The result of an operation sent by AsyncDSAdmin."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.msgid = None
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self, timeout=None):
+        """Return the result, running the client until it is available.
+            Raise the operation error, or ldap.TIMEOUT after timeout seconds.
+        """
+        if not self._done:
+            self.client.run([self], timeout)
+        if not self._done:
+            raise ldap.TIMEOUT("%s not done after %s seconds" % (self.name, timeout))
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self):
+        """Return the error of a completed operation, or None."""
+        return self._exception
+
+    def add_done_callback(self, func):
+        """Call func(future) when done (at once if already done)."""
+        if self._done:
+            func(self)
+        else:
+            self._callbacks.append(func)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self._finish()
+
+    def _finish(self):
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            try:
+                func(self)
+            except Exception:
+                log.exception("Callback of %s failed" % self.name)
+
+    def __repr__(self):
+        state = 'pending'
+        if self._done:
+            state = 'done'
+        return "<LdapFuture %s %s msgid=%r>" % (self.name, state, self.msgid)
+
+
+class _Operation(object):
+    """An operation to send, and how to handle its results."""
+    __slots__ = ('future', 'send', 'entries', 'done')
+
+    def __init__(self, future, send, done):
+        self.future = future
+        self.send = send  # () -> msgid
+        self.done = done  # (entries) -> result
+        self.entries = []
+
+
+class AsyncDSAdmin(object):
+    """Asynchronous facade of a bound DSAdmin."""
+
+    def __init__(self, conn, max_outstanding=1000, poll_min=0.1, poll_max=2.0):
+        """@param conn - a bound DSAdmin, not shared with other threads
+            @param max_outstanding - operations sent and not answered yet:
+                    the others wait in a queue
+            @param poll_min, poll_max - bounds of the task polling interval,
+                    doubling while no task completes
+        """
+        self.conn = conn
+        self.max_outstanding = max_outstanding
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        self.queued = deque()
+        self.outstanding = {}  # msgid -> _Operation
+        self.tasks = {}  # normalized task cn -> LdapFuture
+        self.task_search = None
+        self.poll_interval = poll_min
+        self.next_poll = None
+
+    def fileno(self):
+        """The connection socket, readable when results arrive."""
+        return self.conn.fileno()
+
+    def pending(self):
+        """Return the number of operations not completed yet."""
+        return len(self.queued) + len(self.outstanding) + len(self.tasks)
+
+    #
+    # sending
+    #
+    def _submit(self, name, send, done):
+        future = LdapFuture(self, name)
+        self.queued.append(_Operation(future, send, done))
+        self._send()
+        return future
+
+    def _send(self):
+        while self.queued and len(self.outstanding) < self.max_outstanding:
+            op = self.queued.popleft()
+            try:
+                op.future.msgid = op.send()
+            except ldap.LDAPError, e:
+                op.future.set_exception(e)
+                continue
+            self.outstanding[op.future.msgid] = op
+
+    #
+    # operations
+    #
+    def search(self, base, scope=ldap.SCOPE_SUBTREE, filterstr='(objectClass=*)', attrlist=None):
+        """Return a future of the list of matching entries."""
+        def send():
+            return self.conn.search_ext(base, scope, filterstr, attrlist)
+        return self._submit("search %s" % base, send, lambda entries: entries)
+
+    def getEntry(self, dn, scope=ldap.SCOPE_BASE, filterstr='(objectClass=*)', attrlist=None):
+        """Return a future of the first matching entry. Like
+            DSAdmin.getEntry, it fails with NoSuchEntryError if none matches.
+        """
+        def send():
+            return self.conn.search_ext(dn, scope, filterstr, attrlist)
+
+        def done(entries):
+            if not entries:
+                raise NoSuchEntryError("no such entry for %r" % dn)
+            return entries[0]
+        return self._submit("getEntry %s" % dn, send, done)
+
+    def add(self, entry):
+        """Return a future, done when entry is added."""
+        return self._submit("add %s" % entry.dn,
+                            lambda: self.conn.add_ext(entry), lambda x: True)
+
+    def modify(self, dn, mods):
+        """Return a future, done when dn is modified."""
+        return self._submit("modify %s" % dn,
+                            lambda: self.conn.modify_ext(dn, mods), lambda x: True)
+
+    def delete(self, dn):
+        """Return a future, done when dn is deleted."""
+        return self._submit("delete %s" % dn,
+                            lambda: self.conn.delete_ext(dn), lambda x: True)
+
+    #
+    # tasks
+    #
+    def startTask(self, entry):
+        """Add a task entry and return a future of its exit code.
+            future.entry is the task entry as last read, with its log.
+        """
+        future = LdapFuture(self, "task %s" % entry.cn)
+        future.entry = entry
+
+        def started(add):
+            if add.exception() is not None:
+                future.set_exception(add.exception())
+                return
+            self.tasks[entry.cn.lower()] = future
+            if self.next_poll is None and self.task_search is None:
+                self.poll_interval = self.poll_min
+                self.next_poll = time.time() + self.poll_interval
+        self.add(entry).add_done_callback(started)
+        return future
+
+    def importLDIF(self, ldiffile, suffix, be=None):
+        """Start an import task, see TaskManager.importLDIF."""
+        if be:
+            suffix = None
+        return self.startTask(task_entry('import', 'import', nsFilename=ldiffile,
+                                         nsInstance=be, nsIncludeSuffix=suffix))
+
+    def exportLDIF(self, ldiffile, suffix, be=None, forrepl=False):
+        """Start an export task, see TaskManager.exportLDIF."""
+        if be:
+            suffix = None
+        nsExportReplica = None
+        if forrepl:
+            nsExportReplica = 'true'
+        return self.startTask(task_entry('export', 'export', nsFilename=ldiffile,
+                                         nsInstance=be, nsIncludeSuffix=suffix,
+                                         nsExportReplica=nsExportReplica))
+
+    def fixupMemberOf(self, suffix, filt=None):
+        """Start a memberOf fixup task under suffix."""
+        return self.startTask(task_entry('fixupmemberof', 'memberOf task',
+                                         basedn=suffix, filter=filt))
+
+    def _poll_tasks(self):
+        """Read all the running tasks with one search."""
+        self.next_poll = None
+        filt = "(|%s)" % ''.join(["(cn=%s)" % cn for cn in self.tasks])
+        self.task_search = self.search(DN_TASKS, ldap.SCOPE_SUBTREE, filt,
+                                       TaskManager.ATTRS)
+        self.task_search.add_done_callback(self._tasks_read)
+
+    def _tasks_read(self, search):
+        self.task_search = None
+        if search.exception() is not None:
+            log.error("Cannot read the running tasks: %s" % search.exception())
+            entries = []
+        else:
+            entries = search.result()
+        finished = False
+        for entry in entries:
+            future = self.tasks.get((entry.cn or '').lower())
+            if future is None:
+                continue
+            future.entry = entry
+            if entry.nsTaskExitCode:
+                del self.tasks[entry.cn.lower()]
+                future.set_result(int(entry.nsTaskExitCode))
+                finished = True
+        if finished:
+            self.poll_interval = self.poll_min
+        else:
+            self.poll_interval = min(self.poll_interval * 2, self.poll_max)
+        if self.tasks:
+            self.next_poll = time.time() + self.poll_interval
+
+    #
+    # replication
+    #
+    def status_all(self, filtr=''):
+        """Return a future of the AgreementStatus of every agreement,
+            see Replica.status_all.
+        """
+        realfiltr = "(objectclass=nsds5ReplicationAgreement)"
+        if filtr:
+            realfiltr = "(&%s%s)" % (realfiltr, filtr)
+
+        def send():
+            return self.conn.search_ext(DN_MAPPING_TREE, ldap.SCOPE_SUBTREE,
+                                        realfiltr, AgreementStatus.ATTRS)
+
+        def done(entries):
+            return [AgreementStatus(ent) for ent in entries]
+        return self._submit("status_all", send, done)
+
+    def status(self, agreement_dn):
+        """Return a future of the formatted status of an agreement,
+            see Replica.status.
+        """
+        def send():
+            return self.conn.search_ext(agreement_dn, ldap.SCOPE_BASE,
+                                        "(objectclass=*)", AgreementStatus.ATTRS)
+
+        def done(entries):
+            if not entries:
+                raise NoSuchEntryError("Error reading status from agreement", agreement_dn)
+            return str(AgreementStatus(entries[0]))
+        return self._submit("status %s" % agreement_dn, send, done)
+
+    #
+    # receiving
+    #
+    def _read(self, msgid):
+        """Read a result without waiting: return False if none is there."""
+        try:
+            rtype, data, rmsgid, ctrls = self.conn.result3(msgid, 0, 0)
+        except ldap.LDAPError, e:
+            info = e.args and isinstance(e.args[0], dict) and e.args[0] or {}
+            rmsgid = info.get('msgid', msgid)
+            op = self.outstanding.pop(rmsgid, None)
+            if op is None:
+                raise
+            op.future.set_exception(e)
+            return True
+        if rtype is None:
+            return False
+        op = self.outstanding.get(rmsgid)
+        if op is None:
+            log.warning("Unexpected result %r for msgid %r" % (rtype, rmsgid))
+            return True
+        if rtype == ldap.RES_SEARCH_ENTRY:
+            op.entries.extend([Entry(x) for x in data])
+            return True
+        if rtype == ldap.RES_SEARCH_REFERENCE:
+            return True
+        # the final result
+        del self.outstanding[rmsgid]
+        try:
+            result = op.done(op.entries)
+        except Exception, e:
+            op.future.set_exception(e)
+        else:
+            op.future.set_result(result)
+        return True
+
+    def process(self):
+        """Read all the results already received, complete their futures
+            and send the queued operations. Never blocks.
+            @return the number of messages read
+        """
+        count = 0
+        while True:
+            if self.next_poll is not None and self.next_poll <= time.time():
+                self._poll_tasks()
+            self._send()
+            if not self.outstanding:
+                break
+            read = 0
+            if HASERRORMSGID:
+                while self._read(ldap.RES_ANY):
+                    read += 1
+            else:
+                for msgid in self.outstanding.keys():
+                    while msgid in self.outstanding and self._read(msgid):
+                        read += 1
+            if not read:
+                break
+            count += read
+        return count
+
+    def next_timeout(self):
+        """Seconds before process() has to run anyway, None if only
+            incoming results matter.
+        """
+        if self.next_poll is None:
+            return None
+        return max(0, self.next_poll - time.time())
+
+    def run(self, futures=None, timeout=None):
+        """Process results until futures (by default all the pending
+            operations) are done, or timeout seconds have passed.
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            self.process()
+            if futures is None:
+                if not self.pending():
+                    return
+            elif not [f for f in futures if not f.done()]:
+                return
+            wait = self.next_timeout()
+            if deadline is not None:
+                left = deadline - time.time()
+                if left <= 0:
+                    return
+                if wait is None or left < wait:
+                    wait = left
+            if not self.outstanding and not self.queued:
+                if wait is None:
+                    # nothing will ever complete the futures
+                    return
+                time.sleep(wait)
+            else:
+                select.select([self.fileno()], [], [], wait)
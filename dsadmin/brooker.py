@@ -10,6 +10,7 @@
 import ldap
 import os
 import re
+import threading
 import time
 
 
@@ -31,8 +32,8 @@ from dsadmin._constants import (
     REPLICA_RDWR_TYPE
 )
 
-from dsadmin._replication import RUV, CSN
-from dsadmin._entry import FormatDict
+from dsadmin._replication import RUV, CSN, AgreementStatus, changes_sent
+from dsadmin._dn import SuffixTree
 
 
 class Replica(object):
@@ -55,11 +56,13 @@ class Replica(object):
         mtent = self.conn.getMTEntry(suffix)
         return ','.join(("cn=replica", mtent.dn))
 
-    def changelog(self, dbname='changelogdb'):
+    def changelog(self, dbname='changelogdb', verify=True):
         """Add and return the replication changelog entry.
 
             If dbname starts with "/" then it's considered a full path,
             otherwise it's relative to self.dbdir
+            @param verify - read the entry back after adding it.
+                    If False, return the local entry
         """
         dn = DN_CHANGELOG
         dirpath = os.path.join(self.conn.dbdir, dbname)
@@ -75,32 +78,37 @@ class Replica(object):
         except ldap.ALREADY_EXISTS:
             self.log.warn("entry %s already exists" % dn)
 
+        if not verify:
+            return entry
         return self.conn._test_entry(dn, ldap.SCOPE_BASE)
 
     def list(self, suffix=None):
         """Return a list of replica entries under the given suffix.
             @param suffix - if suffix is None, return all replicas
         """
-        if suffix:
-            filtr = "(&(objectclass=nsds5Replica)(nsds5replicaroot=%s))" % suffix
-        else:
-            filtr = "(objectclass=nsds5Replica)"
-        ents = self.conn.search_s(DN_MAPPING_TREE, ldap.SCOPE_SUBTREE, filtr)
-        return ents
+        return self.conn.topology.replicas(suffix)
+
+    # agreement attributes telling the status of a total update
+    INIT_ATTRS = ['cn', 'nsds5BeginReplicaRefresh', 'nsds5replicaUpdateInProgress',
+                  'nsds5ReplicaLastInitStatus', 'nsds5ReplicaLastInitStart',
+                  'nsds5ReplicaLastInitEnd']
 
     def check_init(self, agmtdn):
         """returns tuple - first element is done/not done, 2nd is no error/has error
             @param agmtdn - the agreement dn
         """
-        done, hasError = False, 0
-        attrlist = ['cn', 'nsds5BeginReplicaRefresh', 'nsds5replicaUpdateInProgress',
-                    'nsds5ReplicaLastInitStatus', 'nsds5ReplicaLastInitStart',
-                    'nsds5ReplicaLastInitEnd']
         try:
             entry = self.conn.getEntry(
-                agmtdn, ldap.SCOPE_BASE, "(objectclass=*)", attrlist)
+                agmtdn, ldap.SCOPE_BASE, "(objectclass=*)", Replica.INIT_ATTRS)
         except NoSuchEntryError:
-            self.log.exception("Error reading status from agreement %r" % agmtdn)
+            entry = None
+        return self._init_status(agmtdn, entry)
+
+    def _init_status(self, agmtdn, entry):
+        """Return the check_init tuple for the agreement entry."""
+        done, hasError = False, 0
+        if entry is None:
+            self.log.error("Error reading status from agreement %r" % agmtdn)
             hasError = 1
         else:
             refresh = entry.nsds5BeginReplicaRefresh
@@ -136,15 +144,88 @@ class Replica(object):
                 rc = self.start_and_wait(agmtdn)
         return rc
 
+    def init_many(self, agmtdns, max_parallel=4, retries=5, backoff=1, backoff_max=60, poll_min=0.1, poll_max=2.0):
+        """Initialize the consumers of many agreements, max_parallel at a
+            time, and return their results when they are all done.
+            @param agmtdns - agreement dns
+            @param max_parallel - max total updates running together
+            @param retries - times a "replica busy" init is retried
+            @param backoff, backoff_max - the first retry waits backoff
+                    seconds, then the delay doubles up to backoff_max
+            @param poll_min, poll_max - bounds of the polling interval
+
+            All the running inits are checked with one search per poll.
+            An agreement that cannot be started (eg. missing, or no
+            access) gets rc 1, and the others go on.
+            Return {agmtdn: {'rc': 0 ok, 1 error, 2 replica busy,
+                             'attempts': n, 'start': time, 'end': time,
+                             'elapsed': seconds}}
+        """
+        results = {}
+        pending = []  # (not before time, agmtdn)
+        for agmtdn in agmtdns:
+            results[agmtdn] = {'rc': None, 'attempts': 0, 'start': None,
+                               'end': None, 'elapsed': None}
+            pending.append((0, agmtdn))
+        running = {}  # normalized dn -> agmtdn
+        interval = poll_min
+        while pending or running:
+            now = time.time()
+            for item in pending[:]:
+                if len(running) >= max_parallel:
+                    break
+                if item[0] > now:
+                    continue
+                pending.remove(item)
+                agmtdn = item[1]
+                result = results[agmtdn]
+                result['attempts'] += 1
+                if result['start'] is None:
+                    result['start'] = now
+                try:
+                    self.start_async(agmtdn)
+                except ldap.LDAPError, e:
+                    self.log.error("Cannot initialize %s: %s" % (agmtdn, e))
+                    result['rc'] = 1
+                    result['end'] = time.time()
+                    result['elapsed'] = result['end'] - result['start']
+                    continue
+                running[normalizeDN(agmtdn)] = agmtdn
+            if running:
+                time.sleep(interval)
+                interval = min(interval * 2, poll_max)
+                ents = self.agreements(attrs=Replica.INIT_ATTRS, dn=False)
+                bydn = dict([(normalizeDN(ent.dn), ent) for ent in ents])
+                for ndn, agmtdn in running.items():
+                    done, haserror = self._init_status(agmtdn, bydn.get(ndn))
+                    if not done and not haserror:
+                        continue
+                    del running[ndn]
+                    interval = poll_min
+                    result = results[agmtdn]
+                    if haserror == 2 and result['attempts'] <= retries:
+                        delay = min(backoff * 2 ** (result['attempts'] - 1), backoff_max)
+                        self.log.info("Replica busy: retrying %s in %ss" % (agmtdn, delay))
+                        pending.append((time.time() + delay, agmtdn))
+                        continue
+                    result['rc'] = haserror
+                    result['end'] = time.time()
+                    result['elapsed'] = result['end'] - result['start']
+            elif pending:
+                # everything is waiting for a retry
+                time.sleep(max(0, min([x[0] for x in pending]) - time.time()))
+        return results
+
     def wait_init(self, agmtdn):
         """Initialize replication and wait for completion.
         @oaram agmtdn - agreement dn
         """
-        done = False
         haserror = 0
-        while not done and not haserror:
-            time.sleep(1)  # give it a few seconds to get going
-            done, haserror = self.check_init(agmtdn)
+        # woken up by the agreement changes instead of polling every second
+        for entry in self.conn.watchEntry(agmtdn, Replica.INIT_ATTRS):
+            done, haserror = self._init_status(agmtdn, entry)
+            if done or haserror:
+                break
         return haserror
 
     def start_async(self, agmtdn):
@@ -202,39 +283,26 @@ class Replica(object):
         """Return a formatted string with the replica status.
             @param agreement_dn - 
         """
-
-        attrlist = ['cn', 'nsds5BeginReplicaRefresh', 'nsds5replicaUpdateInProgress',
-                    'nsds5ReplicaLastInitStatus', 'nsds5ReplicaLastInitStart',
-                    'nsds5ReplicaLastInitEnd', 'nsds5replicaReapActive',
-                    'nsds5replicaLastUpdateStart', 'nsds5replicaLastUpdateEnd',
-                    'nsds5replicaChangesSentSinceStartup', 'nsds5replicaLastUpdateStatus',
-                    'nsds5replicaChangesSkippedSinceStartup', 'nsds5ReplicaHost',
-                    'nsds5ReplicaPort']
         try:
             ent = self.conn.getEntry(
-                agreement_dn, ldap.SCOPE_BASE, "(objectclass=*)", attrlist)
+                agreement_dn, ldap.SCOPE_BASE, "(objectclass=*)",
+                AgreementStatus.ATTRS)
         except NoSuchEntryError:
             raise NoSuchEntryError(
                 "Error reading status from agreement", agreement_dn)
         else:
-            retstr = (
-                "Status for %(cn)s agmt %(nsDS5ReplicaHost)s:%(nsDS5ReplicaPort)s" "\n"
-                "Update in progress: %(nsds5replicaUpdateInProgress)s" "\n"
-                "Last Update Start: %(nsds5replicaLastUpdateStart)s" "\n"
-                "Last Update End: %(nsds5replicaLastUpdateEnd)s" "\n"
-                "Num. Changes Sent: %(nsds5replicaChangesSentSinceStartup)s" "\n"
-                "Num. changes Skipped: %(nsds5replicaChangesSkippedSinceStartup)s" "\n"
-                "Last update Status: %(nsds5replicaLastUpdateStatus)s" "\n"
-                "Init in progress: %(nsds5BeginReplicaRefresh)s" "\n"
-                "Last Init Start: %(nsds5ReplicaLastInitStart)s" "\n"
-                "Last Init End: %(nsds5ReplicaLastInitEnd)s" "\n"
-                "Last Init Status: %(nsds5ReplicaLastInitStatus)s" "\n"
-                "Reap Active: %(nsds5ReplicaReapActive)s" "\n"
-            )
-            # FormatDict manages missing fields in string formatting
-            return retstr % FormatDict(ent.data)
-
-    def add(self, suffix, binddn, bindpw, rtype=MASTER_TYPE, rid=None, tombstone_purgedelay=None, purgedelay=None, referrals=None, legacy=False):
+            return str(AgreementStatus(ent))
+
+    def status_all(self, filtr=''):
+        """Return the AgreementStatus of every agreement, read with a
+            single search.
+            @param filtr - get only agreements matching the given filter
+                            eg. '(nsDS5ReplicaRoot=dc=example,dc=com)'
+        """
+        ents = self.agreements(filtr, AgreementStatus.ATTRS, dn=False)
+        return [AgreementStatus(ent) for ent in ents]
+
+    def add(self, suffix, binddn, bindpw, rtype=MASTER_TYPE, rid=None, tombstone_purgedelay=None, purgedelay=None, referrals=None, legacy=False, verify=True):
         """Setup a replica entry on an existing suffix.
             @param suffix - dn of suffix
             @param binddn - the replication bind dn for this replica
@@ -249,6 +317,7 @@ class Replica(object):
             @param tombstone_purgedelay
             @param purgedelay - changelog expiration time in seconds
             @param referrals
+            @param verify - read the replica entry back after adding it
 
             Ex. replica.add(**{
                     'suffix': "dc=example,dc=com",
@@ -273,14 +342,11 @@ class Replica(object):
         nsuffix = normalizeDN(suffix)
         mtent = self.conn.getMTEntry(suffix)
         dn_replica = ','.join(("cn=replica", mtent.dn))
-        try:
-            entry = self.conn.getEntry(dn_replica, ldap.SCOPE_BASE)
+        if self.conn.topology.replica(dn_replica):
             self.log.warn("Already setup replica for suffix %r" % suffix)
             rec = self.conn.suffixes.setdefault(nsuffix, {})
             rec.update({'dn': dn_replica, 'type': rtype})
             return rec
-        except ldap.NO_SUCH_OBJECT:
-            entry = None
 
         # If a replica does not exist
         binddnlist = []
@@ -314,7 +380,8 @@ class Replica(object):
         self.conn.add_s(entry)
 
         # check if the entry exists TODO better to raise!
-        self.conn._test_entry(dn_replica, ldap.SCOPE_BASE)
+        if verify:
+            self.conn._test_entry(dn_replica, ldap.SCOPE_BASE)
 
         self.conn.suffixes[nsuffix] = {'dn': dn_replica, 'type': rtype}
         return {'dn': dn_replica, 'type': rtype}
@@ -366,7 +433,7 @@ class Replica(object):
             return [ent.dn for ent in ents]
         return ents
 
-    def agreement_add(self, consumer, suffix=None, binddn=None, bindpw=None, cn_format=r'meTo_$host:$port', description_format=r'me to $host:$port', timeout=120, auto_init=False, bindmethod='simple', starttls=False, schedule=ALWAYS, args=None):
+    def agreement_add(self, consumer, suffix=None, binddn=None, bindpw=None, cn_format=r'meTo_$host:$port', description_format=r'me to $host:$port', timeout=120, auto_init=False, bindmethod='simple', starttls=False, schedule=ALWAYS, args=None, verify=True):
         """Create (and return) a replication agreement from self to consumer.
             - self is the supplier,
 
@@ -386,6 +453,8 @@ class Replica(object):
                     'fractional',
                     'stripattrs',
                     'winsync'
+            @param verify    - look for an existing agreement before
+                    adding it, and wait for it after
                     
             @raise NosuchEntryError    - if a replica doesn't exist for that suffix
             @raise ALREADY_EXISTS
@@ -421,12 +490,13 @@ class Replica(object):
 
         # This is probably unnecessary because
         # we can just raise ALREADY_EXISTS
-        try:
-            entry = self.conn.getEntry(dn_agreement, ldap.SCOPE_BASE)
-            self.log.warn("Agreement exists: %r" % dn_agreement)
-            raise ldap.ALREADY_EXISTS
-        except ldap.NO_SUCH_OBJECT:
-            entry = None
+        if verify:
+            try:
+                entry = self.conn.getEntry(dn_agreement, ldap.SCOPE_BASE)
+                self.log.warn("Agreement exists: %r" % dn_agreement)
+                raise ldap.ALREADY_EXISTS
+            except ldap.NO_SUCH_OBJECT:
+                entry = None
 
         # In a separate function in this scope?
         entry = Entry(dn_agreement)
@@ -478,7 +548,8 @@ class Replica(object):
             #  FIXME check please!
             raise
 
-        entry = self.conn.waitForEntry(dn_agreement)
+        if verify:
+            entry = self.conn.waitForEntry(dn_agreement)
         if entry:
             # More verbose but shows what's going on
             if 'chain' in args:
@@ -521,18 +592,19 @@ class Replica(object):
                 "Error reading status from agreement", agmtdn)
 
         if ent.nsds5replicaChangesSentSinceStartup:
-            val = ent.nsds5replicaChangesSentSinceStartup
-            items = val.split(' ')
-            if len(items) == 1:
-                retval = int(items[0])
-            else:
-                for item in items:
-                    ary = item.split(":")
-                    if ary and len(ary) > 1:
-                        retval = retval + int(ary[1].split("/")[0])
+            retval = changes_sent(ent.nsds5replicaChangesSentSinceStartup)
         return retval
 
 
+def _values(value):
+    """Return value as a list of strings, None stays None."""
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        return [str(x) for x in value]
+    return [str(value)]
+
+
 class Config(object):
     """
         Manage "cn=config" tree, including:
@@ -540,6 +612,20 @@ class Config(object):
         - set access and error logging
         - get and set "cn=config" attributes
     """
+    # on/off and enumerated attributes the server reads ignoring case:
+    # mods() compares their values case insensitively, all the others
+    # (paths, passwords, certificate nicknames...) exactly
+    CASE_INSENSITIVE = set([
+        'nsslapd-security', 'nsslapd-ssl-check-hostname', 'nsssl2', 'nsssl3',
+        'nsssl3sessiontimeout', 'nssslclientauth', 'nsslactivation',
+        'nsslapd-accesslog-logbuffering', 'nsslapd-accesslog-logging-enabled',
+        'nsslapd-errorlog-logging-enabled', 'nsslapd-auditlog-logging-enabled',
+        'nsslapd-readonly', 'nsslapd-pwpolicy-local', 'passwordexp',
+        'passwordchecksyntax', 'passwordhistory', 'passwordlockout',
+        'passwordmustchange', 'passwordchange', 'passwordstoragescheme',
+        'nsslapd-allow-anonymous-access', 'nsslapd-require-secure-binds',
+    ])
+
     def __init__(self, conn):
         """@param conn - a DSAdmin instance """
         self.conn = conn
@@ -550,16 +636,138 @@ class Config(object):
             @param key - the attribute name
             @param value - attribute value as string
             
+            @return the list of changes (see apply), empty if the
+                    value was already set
+
             eg. set('passwordExp', 'on')
         """
         self.log.debug("set(%r, %r)" % (key, value))
-        return self.conn.modify(DN_CONFIG,
-            [(ldap.MOD_REPLACE, key, value)])
+        return self.apply({DN_CONFIG: {key: value}})
             
     def get(self, key):
         """Get an attribute under cn=config"""
         return self.conn.getEntry(DN_CONFIG).__getattr__(key)
 
+    def read(self, attrs):
+        """Read many entries at once: all the base searches are sent
+            before waiting for the first result.
+            @param attrs - a dict or a list of (dn, attribute names)
+            @return a dict {dn: Entry, or None if the entry is missing}
+            @raise ldap.LDAPError - any other search error, once the
+                    outstanding searches are abandoned
+        """
+        if isinstance(attrs, dict):
+            attrs = attrs.items()
+        msgids = []
+        try:
+            for dn, attrlist in attrs:
+                msgids.append((dn, self.conn.search(
+                    dn, ldap.SCOPE_BASE, '(objectclass=*)', list(attrlist))))
+            entries = {}
+            while msgids:
+                dn, msgid = msgids.pop(0)
+                try:
+                    rtype, data = self.conn.result(msgid)
+                except ldap.NO_SUCH_OBJECT:
+                    data = None
+                if data:
+                    entries[dn] = data[0]
+                else:
+                    entries[dn] = None
+            return entries
+        finally:
+            # on error, don't leave the other results on the connection
+            for dn, msgid in msgids:
+                try:
+                    self.conn.abandon(msgid)
+                except ldap.LDAPError:
+                    pass
+
+    @staticmethod
+    def mods(entry, attrs):
+        """Return the modlist turning entry into the desired attrs.
+            @param entry - the current Entry
+            @param attrs - a dict {attribute: value(s)}, None to delete
+                    the attribute. Values are compared as sets, ignoring
+                    case only for the Config.CASE_INSENSITIVE attributes.
+                    objectclass is only used to add missing entries, and
+                    never modified.
+        """
+        mods = []
+        for attr, value in attrs.items():
+            if attr.lower() == 'objectclass':
+                continue
+            values = _values(value)
+            current = entry.getValues(attr)
+            if values is None:
+                if current:
+                    mods.append((ldap.MOD_DELETE, attr, None))
+                continue
+            if not current:
+                mods.append((ldap.MOD_ADD, attr, values))
+                continue
+            old, new = current, values
+            if attr.lower() in Config.CASE_INSENSITIVE:
+                old = [x.lower() for x in old]
+                new = [x.lower() for x in new]
+            if sorted(old) != sorted(new):
+                mods.append((ldap.MOD_REPLACE, attr, values))
+        return mods
+
+    def diff(self, desired):
+        """Compare the desired state with the server one, using a single
+            round of searches.
+            @param desired - a dict {dn: {attribute: value(s)}}, or a
+                    list of (dn, attributes) to keep the changes in order
+            @return the list of changes, each a dict with
+                    dn, action ('add' or 'modify') and mods. Missing
+                    entries are added when objectclass is given.
+        """
+        if isinstance(desired, dict):
+            desired = desired.items()
+        entries = self.read([(dn, attrs.keys()) for dn, attrs in desired])
+        changes = []
+        for dn, attrs in desired:
+            entry = entries[dn]
+            if entry is None:
+                if not [x for x in attrs if x.lower() == 'objectclass']:
+                    raise NoSuchEntryError("Missing entry without objectclass: %r" % dn)
+                mods = [(attr, _values(value)) for attr, value in attrs.items()
+                        if value is not None]
+                changes.append({'dn': dn, 'action': 'add', 'mods': mods})
+                continue
+            mods = Config.mods(entry, attrs)
+            if mods:
+                changes.append({'dn': dn, 'action': 'modify', 'mods': mods})
+        return changes
+
+    def apply(self, desired, dryrun=False):
+        """Bring the entries to the desired state, writing only what
+            actually changed.
+            @param desired - {dn: {attribute: value(s)}}, see diff()
+            @param dryrun - just return the changes
+            @return the list of changes (see diff), empty if there
+                    was nothing to do
+
+            ex. apply({DN_CONFIG: {'nsslapd-accesslog-logbuffering': 'off'},
+                       'cn=RSA,cn=encryption,cn=config': {
+                           'objectclass': ['top', 'nsEncryptionModule'],
+                           'nsSSLToken': 'internal (software)'}})
+        """
+        return self._write(self.diff(desired), dryrun)
+
+    def _write(self, changes, dryrun=False):
+        """Write the changes returned by diff(), in order."""
+        for change in changes:
+            self.log.debug("%s %s: %r" % (change['action'], change['dn'], change['mods']))
+            if dryrun:
+                continue
+            if change['action'] == 'add':
+                self.conn.add_s(Entry((change['dn'], dict(change['mods']))))
+            else:
+                self.conn.modify_s(change['dn'], change['mods'])
+        return changes
+
     def loglevel(self, vals=(LOG_DEFAULT,), level='error', update=False):
         """Set the access or error log level.
         @param vals - a list of log level codes (eg. dsadmin.LOG_*) 
@@ -582,57 +790,257 @@ class Config(object):
         else:
             self.log.debug("Replace %s with value: %r" % (level, tot))
 
-        self.set(level, str(tot))
+        self.apply({DN_CONFIG: {level: str(tot)}})
         return tot
 
-    def enable_ssl(self, secport=636, secargs=None):
+    def enable_ssl(self, secport=636, secargs=None, dryrun=False):
         """Configure SSL support into cn=encryption,cn=config.
 
             secargs is a dict like {
                 'nsSSLPersonalitySSL': 'Server-Cert'
             }
+            The three entries are read in a single round of searches,
+            and only the values differing from secargs (or the
+            defaults) are written. cn=RSA,cn=encryption,cn=config is
+            added with them if missing, an existing one is left alone.
+            @return the list of changes (see apply), empty if SSL was
+                    already configured
         """
         self.log.debug("configuring SSL with secargs:%r" % secargs)
         secargs = secargs or {}
 
         dn_enc = 'cn=encryption,cn=config'
+        dn_rsa = 'cn=RSA,cn=encryption,cn=config'
         ciphers = '-rsa_null_md5,+rsa_rc4_128_md5,+rsa_rc4_40_md5,+rsa_rc2_40_md5,+rsa_des_sha,' + \
             '+rsa_fips_des_sha,+rsa_3des_sha,+rsa_fips_3des_sha,' + \
             '+tls_rsa_export1024_with_rc4_56_sha,+tls_rsa_export1024_with_des_cbc_sha'
-        mod = [(ldap.MOD_REPLACE, 'nsSSL3', secargs.get('nsSSL3', 'on')),
-               (ldap.MOD_REPLACE, 'nsSSLClientAuth',
-                secargs.get('nsSSLClientAuth', 'allowed')),
-               (ldap.MOD_REPLACE, 'nsSSL3Ciphers', secargs.get('nsSSL3Ciphers', ciphers))]
-        self.conn.modify_s(dn_enc, mod)
+        # in order: the RSA module must be there when security is on
+        changes = self.diff([
+            (dn_enc, {
+                'nsSSL3': secargs.get('nsSSL3', 'on'),
+                'nsSSLClientAuth': secargs.get('nsSSLClientAuth', 'allowed'),
+                'nsSSL3Ciphers': secargs.get('nsSSL3Ciphers', ciphers)}),
+            (dn_rsa, {
+                'objectclass': ['top', 'nsEncryptionModule'],
+                'nsSSLPersonalitySSL': secargs.get('nsSSLPersonalitySSL', 'Server-Cert'),
+                'nsSSLToken': secargs.get('nsSSLToken', 'internal (software)'),
+                'nsSSLActivation': secargs.get('nsSSLActivation', 'on')}),
+            (DN_CONFIG, {
+                'nsslapd-security': secargs.get('nsslapd-security', 'on'),
+                'nsslapd-ssl-check-hostname': secargs.get('nsslapd-ssl-check-hostname', 'off'),
+                'nsslapd-secureport': str(secport)}),
+        ])
+        # don't replace the certificate nickname or token of an existing module
+        changes = [x for x in changes
+                   if not (x['dn'] == dn_rsa and x['action'] == 'modify')]
+        return self._write(changes, dryrun)
 
-        dn_rsa = 'cn=RSA,cn=encryption,cn=config'
-        e_rsa = Entry(dn_rsa)
-        e_rsa.update({
-            'objectclass': ['top', 'nsEncryptionModule'],
-            'nsSSLPersonalitySSL': secargs.get('nsSSLPersonalitySSL', 'Server-Cert'),
-            'nsSSLToken': secargs.get('nsSSLToken', 'internal (software)'),
-            'nsSSLActivation': secargs.get('nsSSLActivation', 'on')
-        })
+
+
+
+class TopologyGeneration(object):
+    """A counter bumped by each write invalidating a Topology cache.
+        Caches sharing it are stale when it changes.
+    """
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def bump(self):
+        self.lock.acquire()
         try:
-            self.conn.add_s(e_rsa)
-        except ldap.ALREADY_EXISTS:
-            pass
+            self.value += 1
+        finally:
+            self.lock.release()
+
 
-        mod = [
-            (ldap.MOD_REPLACE,
-                'nsslapd-security', secargs.get('nsslapd-security', 'on')),
-            (ldap.MOD_REPLACE,
-                'nsslapd-ssl-check-hostname', secargs.get('nsslapd-ssl-check-hostname', 'off')),
-            (ldap.MOD_REPLACE,
-                'nsslapd-secureport', str(secport))
-        ]
-        self.log.debug("trying to modify %r with %r" % (DN_CONFIG, mod))
-        self.conn.modify_s(DN_CONFIG, mod)
+class Topology(object):
+    """Cache of the backends, mapping tree entries and replicas.
 
-        fields = 'nsslapd-security nsslapd-ssl-check-hostname'.split()
-        return self.conn.getEntry(DN_CONFIG, attrlist=fields)
+        The whole topology is loaded with one search under
+        "cn=plugins,cn=config" and one under "cn=mapping tree,cn=config",
+        then indexed by normalized suffix, backend name and replica dn.
+        Suffixes also go in a SuffixTree, to find the suffix serving a DN
+        and the parent or children of a suffix without searching.
 
+        DSAdmin add, modify, delete and rename calls on those subtrees
+        invalidate the cache, that is reloaded on the next lookup.
+        Connections sharing a TopologyGeneration (eg. the ones of a
+        DSAdminPool) invalidate each other's caches. Changes made by
+        other clients need an explicit refresh(), or a ttl.
+
+        Lookups return copies of the cached entries, with all the
+        attributes or just the attrs asked for: callers can modify them.
+    """
+    MT_FILTER = "(|(objectclass=nsMappingTree)(objectclass=nsds5Replica))"
+
+    def __init__(self, conn, ttl=None, generation=None):
+        """@param conn - a DSAdmin instance
+            @param ttl - reload the cache when older than ttl seconds,
+                    None keeps it until invalidated
+            @param generation - a TopologyGeneration shared with the
+                    caches of other connections to the same server
+        """
+        self.conn = conn
+        self.log = conn.log
+        self.ttl = ttl
+        self.generation = generation or TopologyGeneration()
+        self.loaded = None  # generation of the cached data
+        self.loaded_at = 0
+        self.searches = 0
+
+    def _get_stale(self):
+        if self.loaded != self.generation.value:
+            return True
+        return self.ttl is not None and time.time() - self.loaded_at > self.ttl
+    stale = property(_get_stale)
+
+    def invalidate(self, dn=None):
+        """Mark the cache stale if dn is in a cached subtree (or dn is None)."""
+        if dn is None:
+            self.generation.bump()
+            return
+        ldn = dn.lower()
+        if ldn.rstrip().endswith('cn=config') and \
+                ('mapping tree' in ldn or 'cn=plugins' in ldn):
+            self.generation.bump()
+
+    def refresh(self):
+        """Reload the cache from the server."""
+        # read before searching: a write during the searches makes it stale
+        generation = self.generation.value
+        self.by_bename = {}  # lowercase cn -> backend entry
+        self.be_by_suffix = {}  # normalized suffix -> [backend entries]
+        self.mt_by_suffix = {}  # normalized suffix -> mapping tree entry
+        self.replica_by_dn = {}  # normalized dn -> replica entry
+        self.replica_by_suffix = {}  # normalized suffix -> [replica entries]
+
+        self.backend_list = self.conn.search_s("cn=plugins,cn=config",
+            ldap.SCOPE_SUBTREE, "(objectclass=nsBackendInstance)")
+        for ent in self.backend_list:
+            self.by_bename[(ent.cn or '').lower()] = ent
+            nsuffix = normalizeDN(ent.getValue('nsslapd-suffix') or '')
+            self.be_by_suffix.setdefault(nsuffix, []).append(ent)
+
+        self.mt_list = []
+        self.tree = SuffixTree()  # suffix -> mapping tree entry
+        self.replica_list = []
+        for ent in self.conn.search_s(DN_MAPPING_TREE, ldap.SCOPE_SUBTREE,
+                                      Topology.MT_FILTER):
+            if ent.hasValueCase('objectclass', 'nsds5Replica'):
+                self.replica_list.append(ent)
+                self.replica_by_dn[normalizeDN(ent.dn)] = ent
+                nsuffix = normalizeDN(ent.nsds5replicaroot or '')
+                self.replica_by_suffix.setdefault(nsuffix, []).append(ent)
+                continue
+            self.mt_list.append(ent)
+            # cn holds the suffix, quoted or not
+            for val in ent.getValues('cn'):
+                try:
+                    self.mt_by_suffix[normalizeDN(val.strip('"'))] = ent
+                    self.tree.add(val.strip('"'), ent)
+                except ldap.LDAPError:
+                    self.log.debug("skipping bad suffix %r" % val)
+        self.searches += 2
+        self.loaded = generation
+        self.loaded_at = time.time()
+
+    def _check(self):
+        if self.stale:
+            self.refresh()
+
+    @staticmethod
+    def copy(entry, attrs=None):
+        """Return a copy of a cached entry, None if entry is None.
+            @param attrs - the attribute names to keep, like in a
+                    search: None, [] or '*' keep all of them
+        """
+        if entry is None:
+            return None
+        if attrs and '*' not in attrs:
+            wanted = set([x.lower() for x in attrs])
+            data = [(k, list(v)) for k, v in entry.iterAttrs()
+                    if k.lower() in wanted]
+        else:
+            data = [(k, list(v)) for k, v in entry.iterAttrs()]
+        return Entry((entry.dn, dict(data)))
 
+    def backends(self, suffix=None, name=None, attrs=None):
+        """Return the backend entries for suffix or name, or all of them."""
+        self._check()
+        if name:
+            ents = [self.by_bename.get(name.lower())]
+            if ents[0] is None:
+                return []
+        elif suffix:
+            ents = self.be_by_suffix.get(normalizeDN(suffix), [])
+        else:
+            ents = self.backend_list
+        return [Topology.copy(x, attrs) for x in ents]
+
+    def mt_entry(self, suffix, attrs=None):
+        """Return the mapping tree entry for suffix or None."""
+        self._check()
+        return Topology.copy(self.mt_by_suffix.get(normalizeDN(suffix)), attrs)
+
+    def suffixes(self):
+        """Return the normalized suffixes in the mapping tree."""
+        self._check()
+        return self.mt_by_suffix.keys()
+
+    def suffix_for(self, dn):
+        """Return the normalized suffix holding dn (or dn itself if it is
+            a suffix), None if dn is not in any suffix.
+        """
+        self._check()
+        found = self.tree.lookup(dn)
+        if found is None:
+            return None
+        return found[0]
+
+    def parent_suffix(self, suffix):
+        """Return the nearest normalized suffix above suffix, or None."""
+        self._check()
+        found = self.tree.parent(suffix)
+        if found is None:
+            return None
+        return found[0]
+
+    def child_suffixes(self, suffix=''):
+        """Return the nearest normalized suffixes below suffix,
+            by default the top level ones.
+        """
+        self._check()
+        return [x[0] for x in self.tree.children(suffix)]
+
+    def backends_for(self, dn, attrs=None):
+        """Return the backend entries serving dn, following the
+            nsslapd-backend of the mapping tree entry of its suffix.
+        """
+        self._check()
+        found = self.tree.lookup(dn)
+        if found is None:
+            return []
+        ret = []
+        for bename in found[1].getValues('nsslapd-backend'):
+            ent = self.by_bename.get(bename.lower())
+            if ent is not None:
+                ret.append(Topology.copy(ent, attrs))
+        return ret
+
+    def replicas(self, suffix=None, attrs=None):
+        """Return the replica entries for suffix, or all of them."""
+        self._check()
+        if suffix:
+            ents = self.replica_by_suffix.get(normalizeDN(suffix), [])
+        else:
+            ents = self.replica_list
+        return [Topology.copy(x, attrs) for x in ents]
+
+    def replica(self, dn, attrs=None):
+        """Return the replica entry with the given dn or None."""
+        self._check()
+        return Topology.copy(self.replica_by_dn.get(normalizeDN(dn)), attrs)
 
 
 class Backend(object):
@@ -651,35 +1059,27 @@ class Backend(object):
         """Get backends by name or suffix
             @param name -   backend name
             @param suffix   -   get backend for suffix
+
+            @param attrs - the attributes to return, all if None
+
+            Entries are copies from the topology cache.
+
+            @raise ldap.NO_SUCH_OBJECT - if there is no backend `name`
         """
-        attrs = attrs or []
-        
         # raise errors asap
         if name and suffix:
             raise ValueError("Can't specify both name and suffix")
         
-        def _list_by_suffix(self, suffix, attrs=None):    
-            if suffix:
-                nsuffix = normalizeDN(suffix)
-            else:
-                suffix = nsuffix = '*'
-                
-            entries = self.conn.search_s("cn=plugins,cn=config", ldap.SCOPE_SUBTREE,
-                                    "(&(objectclass=nsBackendInstance)(|(nsslapd-suffix=%s)(nsslapd-suffix=%s)))" % (suffix, nsuffix),
-                                    attrs)
-            return entries
-
-        def _list_by_name(self, name, attrs=None):
-            backend_dn = ','.join(('cn=' + name, DN_LDBM))
-            return self.conn.search_s(backend_dn, ldap.SCOPE_BASE, attrlist=attrs)
-            
         if name:
-            return _list_by_name(self, name, attrs)
-        elif suffix:
-            return _list_by_suffix(self, suffix, attrs)
-            
-        return self.conn.search_s("cn=plugins,cn=config", 
-            ldap.SCOPE_SUBTREE, "(objectclass=nsBackendInstance)", attrs)
+            # like a base search on cn=name,DN_LDBM
+            ndn = normalizeDN(','.join(('cn=' + name, DN_LDBM)))
+            ents = [ent for ent in self.conn.topology.backends(name=name, attrs=attrs)
+                    if normalizeDN(ent.dn) == ndn]
+            if not ents:
+                raise ldap.NO_SUCH_OBJECT({'desc': 'No such object', 'matched': DN_LDBM,
+                                           'info': "no backend %r" % name})
+            return ents
+        return self.conn.topology.backends(suffix, attrs=attrs)
 
         
     def readonly(self, bename=None, readonly='on', suffix=None):
@@ -817,14 +1217,10 @@ class Backend(object):
         else:
             nparent = ""
             
-        filt = suffixfilt(suffix)
         # if suffix exists, return
-        try:
-            entry = self.conn.getEntry(
-                DN_MAPPING_TREE, ldap.SCOPE_SUBTREE, filt)
+        entry = self.conn.topology.mt_entry(suffix)
+        if entry:
             return entry
-        except NoSuchEntryError:
-            entry = None
 
         # fix me when we can actually used escaped DNs
         #dn = "cn=%s,cn=mapping tree,cn=config" % escapedn
@@ -0,0 +1,231 @@
+"""Follow the errors log of an instance as it grows.
+
+    ErrorLogFollower opens the log at its end and returns the new lines
+    as soon as they are written: on Linux it sleeps on an inotify watch
+    of the file, elsewhere it polls the file size. While the log is
+    moved or deleted and not yet created again, it polls the path too.
+
+    Lines are parsed into LogEvents, for the messages telling what the
+    server is doing:
+
+        follower = ErrorLogFollower(errlog)
+        os.system(startcmd)
+        for event in follower.events(timeout=120):
+            if event.kind in (STARTED, BIND_CONFLICT):
+                break
+        follower.close()
+"""
+__all__ = ['ErrorLogFollower', 'LogEvent', 'parse_line',
+           'STARTED', 'STOPPED', 'BIND_CONFLICT', 'INIT_FAILED', 'EXITING']
+
+import os
+import select
+import struct
+import time
+
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    _inotify_init = _libc.inotify_init
+    _inotify_add_watch = _libc.inotify_add_watch
+    _inotify_rm_watch = _libc.inotify_rm_watch
+    HASINOTIFY = True
+except (ImportError, OSError, AttributeError):
+    HASINOTIFY = False
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# inotify(7) event masks
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+# struct inotify_event: wd, mask, cookie, len, then len bytes of name
+EVENT_HEADER = 'iIII'
+EVENT_HEADER_SIZE = struct.calcsize(EVENT_HEADER)
+
+# event kinds, and the messages they are parsed from
+STARTED = 'started'
+STOPPED = 'stopped'
+BIND_CONFLICT = 'bind_conflict'
+INIT_FAILED = 'init_failed'
+EXITING = 'exiting'
+PATTERNS = (
+    ('slapd started.', STARTED),
+    ('slapd stopped.', STOPPED),
+    ('PR_Bind', BIND_CONFLICT),
+    ('Initialization Failed', INIT_FAILED),
+    ('exiting.', EXITING),
+)
+
+
+class LogEvent(object):
+    """A meaningful errors log line.
+        kind - one of STARTED, STOPPED, BIND_CONFLICT, INIT_FAILED, EXITING
+        when - the timestamp of the line, eg. '18/Oct/2013:10:00:00 +0200'
+    """
+    __slots__ = ('kind', 'when', 'line')
+
+    def __init__(self, kind, when, line):
+        self.kind = kind
+        self.when = when
+        self.line = line
+
+    def __repr__(self):
+        return "<LogEvent %s %r>" % (self.kind, self.line)
+
+
+def parse_line(line):
+    """Return the LogEvent of an errors log line, None if not meaningful."""
+    for pattern, kind in PATTERNS:
+        if pattern in line:
+            when = None
+            if line.startswith('['):
+                end = line.find(']')
+                if end > 0:
+                    when = line[1:end]
+            return LogEvent(kind, when, line.rstrip('\n'))
+    return None
+
+
+class ErrorLogFollower(object):
+    """Return the lines appended to a log file, waking up on writes."""
+
+    def __init__(self, path, poll_interval=0.1):
+        """Open path at its end.
+            @param poll_interval - seconds between two size checks when
+                    inotify is not available
+        """
+        self.path = path
+        self.poll_interval = poll_interval
+        self.buf = ''
+        self.fd = None
+        self.inotify = None
+        self.wd = None
+        # the watched file was moved or deleted: poll until path is back
+        self.gone = False
+        if HASINOTIFY:
+            fd = _inotify_init()
+            if fd < 0:
+                log.info("inotify_init failed, polling %s: errno %d" % (
+                         path, ctypes.get_errno()))
+            else:
+                self.inotify = fd
+        self._open(os.SEEK_END)
+
+    def _open(self, whence):
+        # a raw descriptor: stdio may not read past a previous end of file
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = os.open(self.path, os.O_RDONLY)
+        os.lseek(self.fd, 0, whence)
+        self.gone = False
+        if self.inotify is not None:
+            # the old file may still be written: stop watching it
+            if self.wd is not None:
+                _inotify_rm_watch(self.inotify, self.wd)
+            mask = IN_MODIFY | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF
+            self.wd = _inotify_add_watch(self.inotify, self.path, mask)
+            if self.wd < 0:
+                log.info("Cannot watch %s, polling: errno %d" % (
+                         self.path, ctypes.get_errno()))
+                os.close(self.inotify)
+                self.inotify = None
+                self.wd = None
+
+    def fileno(self):
+        """The inotify descriptor, readable when the log changes, or None."""
+        return self.inotify
+
+    def close(self):
+        if self.inotify is not None:
+            os.close(self.inotify)
+            self.inotify = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _rotated(self):
+        """True if path is now another file, or was truncated. Marks
+            the file gone while path does not exist.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            self.gone = True
+            return False
+        fst = os.fstat(self.fd)
+        if st.st_ino != fst.st_ino or st.st_size < os.lseek(self.fd, 0, os.SEEK_CUR):
+            return True
+        # moved back in place: the watch is still good
+        self.gone = False
+        return False
+
+    def _read(self):
+        chunks = []
+        while True:
+            chunk = os.read(self.fd, 65536)
+            if not chunk:
+                return ''.join(chunks)
+            chunks.append(chunk)
+
+    def read_lines(self):
+        """Return the complete lines written since the last call."""
+        data = self._read()
+        if not data and self._rotated():
+            log.debug("%s rotated, reading the new file" % self.path)
+            self._open(os.SEEK_SET)
+            data = self._read()
+        if not data:
+            return []
+        lines = (self.buf + data).split('\n')
+        # the last one is incomplete, or empty
+        self.buf = lines.pop()
+        return [x + '\n' for x in lines]
+
+    def wait(self, timeout):
+        """Sleep until the log changes, or at most timeout seconds."""
+        if timeout <= 0:
+            return
+        if self.inotify is None or self.gone:
+            time.sleep(min(timeout, self.poll_interval))
+            return
+        ready = select.select([self.inotify], [], [], timeout)[0]
+        if ready:
+            # the file is just read again, only look for its removal
+            self._read_events()
+
+    def _read_events(self):
+        data = os.read(self.inotify, 4096)
+        offset = 0
+        while offset + EVENT_HEADER_SIZE <= len(data):
+            wd, mask, cookie, length = struct.unpack_from(EVENT_HEADER, data, offset)
+            offset += EVENT_HEADER_SIZE + length
+            if wd == self.wd and mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                log.debug("%s moved or deleted, polling" % self.path)
+                self.gone = True
+
+    def events(self, timeout=None, verbose=False):
+        """Yield the LogEvents of the new lines, for timeout seconds
+            (forever if None).
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            for line in self.read_lines():
+                if verbose:
+                    log.debug("current line: %r" % line.strip())
+                event = parse_line(line)
+                if event is not None:
+                    yield event
+            if deadline is None:
+                self.wait(60)
+                continue
+            left = deadline - time.time()
+            if left <= 0:
+                return
+            self.wait(left)
@@ -0,0 +1,580 @@
+"""Typed database monitor counters.
+
+    DBStats holds the ldbm database monitor of a server: the global db
+    cache, the cn=database counters and, for each backend, the entry
+    cache, the dn cache and the per file stats. They are all read with
+    one search:
+
+        stats = conn.readDBStats()
+        print stats.backends['userRoot'].entrycache.hitratio
+        ...
+        later = conn.readDBStats()
+        rates = later.delta(stats)
+        print rates['dbcache']['pagein_rate']
+        print later.to_prometheus(labels={'instance': 'ldap1:389'})
+
+    Sampler polls cn=monitor, the ldbm monitor and the replication
+    agreements in a thread, and keeps the last samples in ring buffers.
+"""
+__all__ = ['DBStats', 'BackendStats', 'CacheStats', 'DBFileStats',
+           'RingBuffer', 'Sampler']
+
+import array
+import threading
+import time
+
+import ldap
+from ldap.cidict import cidict
+
+from dsadmin._constants import DN_LDBM, DN_MAPPING_TREE
+from dsadmin._replication import changes_sent
+from dsadmin.utils import normalizeDN
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+import logging
+log = logging.getLogger(__name__)
+
+
+DN_LDBM_MONITOR = "cn=monitor," + DN_LDBM
+DN_LDBM_DATABASE = "cn=database," + DN_LDBM_MONITOR
+
+
+def _int(value):
+    """Monitor values are strings: return them as int, or 0."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _counter_delta(cur, prev):
+    """A counter lower than before was reset, eg. by a restart."""
+    if cur < prev:
+        return cur
+    return cur - prev
+
+
+def _ratio(hits, tries):
+    """Hit percentage, 0 if nothing was tried."""
+    if not tries:
+        return 0.0
+    return 100.0 * hits / tries
+
+
+class CacheStats(object):
+    """Entry or dn cache counters of a backend."""
+    __slots__ = ('hits', 'tries', 'hitratio', 'size', 'maxsize', 'count')
+    GAUGES = ('hitratio', 'size', 'maxsize', 'count')
+
+    def __init__(self, entry, prefix):
+        """@param entry - the backend monitor entry
+            @param prefix - 'entry' or 'dn'
+        """
+        self.hits = _int(entry.getValue('%scachehits' % prefix))
+        self.tries = _int(entry.getValue('%scachetries' % prefix))
+        self.hitratio = _int(entry.getValue('%scachehitratio' % prefix))
+        self.size = _int(entry.getValue('current%scachesize' % prefix))
+        self.maxsize = _int(entry.getValue('max%scachesize' % prefix))
+        self.count = _int(entry.getValue('current%scachecount' % prefix))
+
+    def available(self):
+        return self.maxsize - self.size
+
+    def unitsize(self):
+        """Average size of the cached items."""
+        if not self.count:
+            return 0
+        return self.size / self.count
+
+    def as_dict(self):
+        return dict([(x, getattr(self, x)) for x in CacheStats.__slots__])
+
+    def delta(self, previous, interval):
+        hits = _counter_delta(self.hits, previous.hits)
+        tries = _counter_delta(self.tries, previous.tries)
+        return {
+            'hitratio': _ratio(hits, tries),
+            'tries_rate': tries / interval,
+            'size': self.size,
+            'count': self.count,
+        }
+
+
+class DBFileStats(object):
+    """Cache counters of a database file."""
+    __slots__ = ('name', 'cachehit', 'cachemiss', 'pagein', 'pageout')
+    COUNTERS = ('cachehit', 'cachemiss', 'pagein', 'pageout')
+
+    def __init__(self, name):
+        self.name = name
+        self.cachehit = self.cachemiss = self.pagein = self.pageout = 0
+
+    def as_dict(self):
+        return dict([(x, getattr(self, x)) for x in DBFileStats.__slots__])
+
+    def delta(self, previous, interval):
+        ret = {}
+        for counter in DBFileStats.COUNTERS:
+            ret[counter + '_rate'] = _counter_delta(
+                getattr(self, counter), getattr(previous, counter)) / interval
+        return ret
+
+
+class BackendStats(object):
+    """Monitor of a backend: its caches and its database files."""
+    # the per file attributes are named <counter>-<file number or name>
+    DBFILE_ATTRS = {
+        'dbfilename': 'name',
+        'dbfilecachehit': 'cachehit',
+        'dbfilecachemiss': 'cachemiss',
+        'dbfilepagein': 'pagein',
+        'dbfilepageout': 'pageout',
+    }
+
+    def __init__(self, name, entry):
+        """@param name - backend name
+            @param entry - the cn=monitor,cn=<name>,... entry
+        """
+        self.name = name
+        self.entrycache = CacheStats(entry, 'entry')
+        self.dncache = None
+        if entry.hasAttr('maxdncachesize'):
+            self.dncache = CacheStats(entry, 'dn')
+        byid = {}
+        for attr, vals in entry.iterAttrs():
+            parts = attr.lower().rsplit('-', 1)
+            counter = BackendStats.DBFILE_ATTRS.get(parts[0])
+            if counter is None or len(parts) < 2:
+                continue
+            dbfile = byid.get(parts[1])
+            if dbfile is None:
+                dbfile = byid[parts[1]] = DBFileStats(parts[1])
+            if counter == 'name':
+                dbfile.name = vals[0].split('/')[-1]
+            else:
+                setattr(dbfile, counter, _int(vals[0]))
+        # key by file name, stable between two reads
+        self.files = dict([(x.name, x) for x in byid.values()])
+
+    def as_dict(self):
+        ret = {
+            'entrycache': self.entrycache.as_dict(),
+            'files': dict([(k, v.as_dict()) for k, v in self.files.items()]),
+        }
+        if self.dncache:
+            ret['dncache'] = self.dncache.as_dict()
+        return ret
+
+
+class DBStats(object):
+    """The ldbm database monitor of a server at a given time."""
+    DBCACHE_ATTRS = ('hits', 'tries', 'hitratio', 'pagein', 'pageout',
+                     'roevict', 'rwevict')
+    # not counters: delta doesn't compute their rate
+    DBCACHE_GAUGES = ('hitratio', )
+
+    def __init__(self, entries, when=None):
+        """@param entries - the ldbm monitor entries, as returned by
+                    DBStats.search()
+            @param when - read time, default now
+        """
+        self.time = when or time.time()
+        self.dbcache = dict([(x, 0) for x in DBStats.DBCACHE_ATTRS])
+        self.db = {}
+        # backend names are case insensitive, like the DNs they come from
+        self.backends = cidict()
+        for entry in entries:
+            ndn = normalizeDN(entry.dn)
+            if ndn == normalizeDN(DN_LDBM_MONITOR):
+                for attr in DBStats.DBCACHE_ATTRS:
+                    self.dbcache[attr] = _int(entry.getValue('dbcache' + attr))
+            elif ndn == normalizeDN(DN_LDBM_DATABASE):
+                for attr, vals in entry.iterAttrs():
+                    if attr.lower().startswith('nsslapd-db-'):
+                        self.db[attr.lower()[len('nsslapd-db-'):]] = _int(vals[0])
+            else:
+                # cn=monitor,cn=<backend>,cn=ldbm database,...
+                rdns = ldap.explode_dn(entry.dn, 1)
+                self.backends[rdns[1]] = BackendStats(rdns[1], entry)
+
+    @staticmethod
+    def search(conn):
+        """Return the ldbm monitor entries with one subtree search."""
+        entries = conn.search_s(DN_LDBM, ldap.SCOPE_SUBTREE,
+                                "(|(cn=monitor)(cn=database))")
+        # skip any other cn=database entry
+        return [e for e in entries
+                if normalizeDN(e.dn).startswith('cn=monitor,')
+                or normalizeDN(e.dn) == normalizeDN(DN_LDBM_DATABASE)]
+
+    def delta(self, previous):
+        """Return the rates over the interval since previous, a dict:
+            {'interval': seconds,
+             'dbcache': {'hitratio': %, 'pagein_rate': per second, ...},
+             'backends': {name: {'entrycache': {...}, 'dncache': {...},
+                                 'files': {filename: {...}}}}}
+            hitratio is computed on the hits and tries of the interval,
+            not since the server started.
+        """
+        interval = float(self.time - previous.time)
+        if interval <= 0:
+            raise ValueError("previous stats must be older: interval %r" % interval)
+        dbcache = {}
+        for attr in DBStats.DBCACHE_ATTRS:
+            if attr in DBStats.DBCACHE_GAUGES:
+                continue
+            dbcache[attr + '_rate'] = _counter_delta(
+                self.dbcache[attr], previous.dbcache[attr]) / interval
+        dbcache['hitratio'] = _ratio(
+            _counter_delta(self.dbcache['hits'], previous.dbcache['hits']),
+            _counter_delta(self.dbcache['tries'], previous.dbcache['tries']))
+        backends = {}
+        for name, be in self.backends.items():
+            prevbe = previous.backends.get(name)
+            if prevbe is None:
+                # a new backend
+                continue
+            ret = {'entrycache': be.entrycache.delta(prevbe.entrycache, interval)}
+            if be.dncache and prevbe.dncache:
+                ret['dncache'] = be.dncache.delta(prevbe.dncache, interval)
+            ret['files'] = dict([
+                (fname, dbfile.delta(prevbe.files[fname], interval))
+                for fname, dbfile in be.files.items() if fname in prevbe.files])
+            backends[name] = ret
+        return {'interval': interval, 'dbcache': dbcache, 'backends': backends}
+
+    def flat(self):
+        """Return all the counters in a flat dict, eg.
+            {'dbcache.pagein': 10, 'userRoot.entrycache.hits': 5,
+             'userRoot.id2entry.db4.pagein': 4, ...}
+        """
+        ret = {}
+        for attr, value in self.dbcache.items():
+            ret['dbcache.' + attr] = value
+        for attr, value in self.db.items():
+            ret['db.' + attr] = value
+        for name, be in self.backends.items():
+            caches = [('entrycache', be.entrycache)]
+            if be.dncache:
+                caches.append(('dncache', be.dncache))
+            for cache, stats in caches:
+                for attr in CacheStats.__slots__:
+                    ret['%s.%s.%s' % (name, cache, attr)] = getattr(stats, attr)
+            for fname, dbfile in be.files.items():
+                for counter in DBFileStats.COUNTERS:
+                    ret['%s.%s.%s' % (name, fname, counter)] = getattr(dbfile, counter)
+        return ret
+
+    def as_dict(self):
+        return {
+            'time': self.time,
+            'dbcache': dict(self.dbcache),
+            'db': dict(self.db),
+            'backends': dict([(k, v.as_dict()) for k, v in self.backends.items()]),
+        }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+    def to_prometheus(self, prefix='dirsrv_ldbm', labels=None):
+        """Return the counters in the Prometheus text exposition format.
+            Counter names end with _total, as Prometheus expects.
+            @param labels - dict of labels added to every sample,
+                    eg. {'instance': 'ldap1:389'}
+        """
+        labels = labels or {}
+        samples = {}  # metric name -> list of (labels, value)
+        kinds = {}  # metric name -> counter or gauge
+
+        def add(name, value, kind='counter', **extra):
+            name = "%s_%s" % (prefix, name)
+            if kind == 'counter':
+                name += '_total'
+            lbl = dict(labels)
+            lbl.update(extra)
+            samples.setdefault(name, []).append((lbl, value))
+            kinds[name] = kind
+
+        for attr, value in self.dbcache.items():
+            kind = 'counter'
+            if attr in DBStats.DBCACHE_GAUGES:
+                kind = 'gauge'
+            add('dbcache_' + attr, value, kind)
+        # cn=database mixes sizes, rates and totals
+        for attr, value in self.db.items():
+            add('db_' + attr.replace('-', '_'), value, 'gauge')
+        for name, be in self.backends.items():
+            caches = [('entrycache', be.entrycache)]
+            if be.dncache:
+                caches.append(('dncache', be.dncache))
+            for cache, stats in caches:
+                for attr in CacheStats.__slots__:
+                    kind = 'counter'
+                    if attr in CacheStats.GAUGES:
+                        kind = 'gauge'
+                    add(cache + '_' + attr, getattr(stats, attr), kind, backend=name)
+            for fname, dbfile in be.files.items():
+                for counter in DBFileStats.COUNTERS:
+                    add('dbfile_' + counter, getattr(dbfile, counter),
+                        backend=name, file=fname)
+
+        lines = []
+        names = samples.keys()
+        names.sort()
+        for name in names:
+            lines.append("# TYPE %s %s" % (name, kinds[name]))
+            for lbl, value in samples[name]:
+                if lbl:
+                    keys = lbl.keys()
+                    keys.sort()
+                    lbltext = ','.join(['%s="%s"' % (
+                        k, str(lbl[k]).replace('\\', '\\\\').replace('"', '\\"'))
+                        for k in keys])
+                    lines.append("%s{%s} %s" % (name, lbltext, value))
+                else:
+                    lines.append("%s %s" % (name, value))
+        return "\n".join(lines) + "\n"
+
+    def format(self, bename):
+        """Return the text table of getDBStats for the backend bename."""
+        be = self.backends[bename]
+        ret = "cache   available ratio    count unitsize\n"
+        ec = be.entrycache
+        ret += "entry % 11d   % 3d % 8d % 5d" % (
+            ec.available(), ec.hitratio, ec.count, ec.unitsize())
+        if be.dncache:
+            dc = be.dncache
+            ret += "\ndn    % 11d   % 3d % 8d % 5d" % (
+                dc.available(), int(_ratio(dc.hits, dc.tries)), dc.count, dc.unitsize())
+
+        ret += "\n\nglobal db stats\n"
+        cols = [('hits', 'cachehits'), ('tries', 'cachetries'),
+                ('hitratio', 'ratio'), ('pagein', 'pagein'), ('pageout', 'pageout'),
+                ('roevict', 'roevict'), ('rwevict', 'rwevict')]
+        ret += _table([[title for attr, title in cols],
+                       [str(self.dbcache[attr]) for attr, title in cols]])
+
+        ret += "\n\nper file stats\n"
+        rows = [['dbfilename', 'cachehits', 'cachemisses', 'pagein', 'pageout']]
+        for fname in sorted(be.files):
+            dbfile = be.files[fname]
+            rows.append([fname] + [str(getattr(dbfile, x)) for x in DBFileStats.COUNTERS])
+        ret += _table(rows)
+        return ret
+
+
+def _table(rows):
+    """Right-align the columns of rows."""
+    widths = [max([len(row[i]) for row in rows]) for i in range(len(rows[0]))]
+    return "\n".join([''.join([' %*s' % (w, v) for w, v in zip(widths, row)])
+                      for row in rows])
+
+
+NAN = float('nan')
+
+
+class RingBuffer(object):
+    """The last `size` float values, in a preallocated array."""
+    __slots__ = ('data', 'size', 'count', 'next')
+
+    def __init__(self, size):
+        self.data = array.array('d', [NAN]) * size
+        self.size = size
+        self.count = 0  # number of stored values
+        self.next = 0  # index of the next write
+
+    def append(self, value):
+        self.data[self.next] = value
+        self.next = (self.next + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def values(self):
+        """Return the stored values, oldest first."""
+        if self.count < self.size:
+            return self.data[:self.count].tolist()
+        return (self.data[self.next:] + self.data[:self.next]).tolist()
+
+    def last(self):
+        if not self.count:
+            return NAN
+        return self.data[self.next - 1]
+
+
+def _percentile(values, p):
+    """Linear interpolation between the closest ranks, NaN if empty."""
+    values = [v for v in values if v == v]  # drop NaN
+    if not values:
+        return NAN
+    values.sort()
+    k = (len(values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+class Sampler(object):
+    """Poll a server every `interval` seconds and keep the last `size`
+        samples of every metric:
+        - monitor.<attr> the numeric cn=monitor attributes
+        - ldbm.<name> the DBStats.flat() counters
+        - agmt.<suffix>.<cn>.<name> changes_sent, changes_skipped and
+          update_in_progress of every replication agreement
+
+        Memory is constant: every metric has a RingBuffer of `size`
+        floats, aligned with the sample times. Missing values are NaN,
+        and a metric missing from `size` samples in a row (eg. a deleted
+        agreement or backend) is dropped.
+
+        The sampler thread uses the connection: don't share it.
+
+        ex. sampler = Sampler(DSAdmin(**auth), interval=10, size=360)
+            sampler.start()
+            ...
+            print sampler.percentile('monitor.currentconnections', 95)
+            print sampler.rate('monitor.opscompleted')
+            sampler.stop()
+    """
+    AGMT_ATTRS = ['cn', 'nsDS5ReplicaRoot', 'nsds5replicaChangesSentSinceStartup',
+                  'nsds5replicaChangesSkippedSinceStartup',
+                  'nsds5replicaUpdateInProgress']
+
+    def __init__(self, conn, interval=10, size=360):
+        self.conn = conn
+        self.interval = interval
+        self.size = size
+        self.times = RingBuffer(size)
+        self.buffers = {}
+        self.missing = {}  # metric name -> NaN values in a row
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def read(self):
+        """Query the server and return a dict metric name -> value."""
+        ret = {}
+        entry = self.conn.getEntry('cn=monitor', ldap.SCOPE_BASE)
+        for attr, vals in entry.iterAttrs():
+            if len(vals) == 1 and vals[0].isdigit():
+                ret['monitor.' + attr.lower()] = int(vals[0])
+        for name, value in DBStats(DBStats.search(self.conn)).flat().items():
+            ret['ldbm.' + name] = value
+        agmts = self.conn.search_s(
+            DN_MAPPING_TREE, ldap.SCOPE_SUBTREE,
+            "(objectclass=nsds5ReplicationAgreement)", Sampler.AGMT_ATTRS)
+        for agmt in agmts:
+            prefix = 'agmt.%s.%s.' % (normalizeDN(agmt.nsDS5ReplicaRoot or ''), agmt.cn)
+            ret[prefix + 'changes_sent'] = changes_sent(
+                agmt.nsds5replicaChangesSentSinceStartup or '0')
+            ret[prefix + 'changes_skipped'] = _int(
+                agmt.nsds5replicaChangesSkippedSinceStartup)
+            ret[prefix + 'update_in_progress'] = int(
+                (agmt.nsds5replicaUpdateInProgress or '').lower() == 'true')
+        return ret
+
+    def add(self, sample, when=None):
+        """Store a sample taken at `when`, default now."""
+        self.lock.acquire()
+        try:
+            for name in sample:
+                if name not in self.buffers:
+                    # a new metric: NaN for the previous samples
+                    buf = self.buffers[name] = RingBuffer(self.size)
+                    for i in range(len(self.times)):
+                        buf.append(NAN)
+                    self.missing[name] = len(self.times)
+            self.times.append(when or time.time())
+            for name, buf in self.buffers.items():
+                value = sample.get(name, NAN)
+                buf.append(value)
+                if value == value:
+                    self.missing[name] = 0
+                    continue
+                self.missing[name] += 1
+                if self.missing[name] >= self.size:
+                    # gone for a whole ring
+                    del self.buffers[name]
+                    del self.missing[name]
+        finally:
+            self.lock.release()
+
+    def sample(self):
+        """Take a sample now. Errors are logged and counted."""
+        try:
+            self.add(self.read())
+        except ldap.LDAPError:
+            self.errors += 1
+            log.exception("Cannot sample %s" % self.conn)
+
+    def _run(self):
+        while not self.stopped.isSet():
+            start = time.time()
+            try:
+                self.sample()
+            except Exception:
+                # eg. an unexpected counter value: keep the thread alive
+                self.errors += 1
+                log.exception("Cannot sample %s" % self.conn)
+            self.stopped.wait(max(0, self.interval - (time.time() - start)))
+
+    def start(self):
+        """Start sampling in a daemon thread."""
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run, name="Sampler %s" % self.conn)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def metrics(self):
+        self.lock.acquire()
+        try:
+            ret = self.buffers.keys()
+        finally:
+            self.lock.release()
+        ret.sort()
+        return ret
+
+    def history(self, name):
+        """Return (times, values) of a metric, oldest first."""
+        self.lock.acquire()
+        try:
+            return self.times.values(), self.buffers[name].values()
+        finally:
+            self.lock.release()
+
+    def last(self, name):
+        self.lock.acquire()
+        try:
+            return self.buffers[name].last()
+        finally:
+            self.lock.release()
+
+    def percentile(self, name, p):
+        """Return the p-th percentile (0-100) of the stored values."""
+        return _percentile(self.history(name)[1], p)
+
+    def rate(self, name):
+        """Return the per second increase of a counter over the stored
+            samples, counting a decrease as a reset.
+        """
+        times, values = self.history(name)
+        points = [(t, v) for t, v in zip(times, values) if v == v]
+        if len(points) < 2 or points[-1][0] == points[0][0]:
+            return NAN
+        total = 0
+        for i in range(1, len(points)):
+            total += _counter_delta(points[i][1], points[i - 1][1])
+        return total / (points[-1][0] - points[0][0])
@@ -0,0 +1,213 @@
+"""Declarative replication topology setup.
+
+    A TopologyPlan lists the servers, their replica roles for each suffix
+    and the agreements between them. execute() validates the whole plan
+    first, then configures all the servers concurrently, phase by phase:
+
+        plan = TopologyPlan(REPLBINDDN, REPLBINDPW)
+        for rid, m in enumerate(masters):
+            plan.add_replica(m, 'dc=example,dc=com', MASTER_TYPE, rid + 1)
+        for c in consumers:
+            plan.add_replica(c, 'dc=example,dc=com', LEAF_TYPE)
+        plan.full_mesh('dc=example,dc=com', masters)
+        plan.hub_spoke('dc=example,dc=com', masters[:1], consumers, init=True)
+        timings = plan.execute()
+
+    Every server is configured by its own thread, with its own connection.
+    The read-after-write checks of the single step methods are skipped.
+"""
+__all__ = ['TopologyPlan']
+
+import threading
+import time
+
+from dsadmin import DsError, InvalidArgumentError
+from dsadmin._constants import MASTER_TYPE, HUB_TYPE, LEAF_TYPE
+from dsadmin.utils import normalizeDN
+
+import logging
+log = logging.getLogger(__name__)
+
+
+# replica ID of hubs and consumers
+CONSUMER_RID = 65535
+
+
+class TopologyPlan(object):
+    """Servers, replicas and agreements to set up together."""
+    PHASES = ('prepare', 'replicas', 'agreements', 'init')
+
+    def __init__(self, binddn, bindpw):
+        """@param binddn, bindpw - the replication manager, created on
+                    every server and used by every agreement
+        """
+        self.binddn = binddn
+        self.bindpw = bindpw
+        self.servers = []  # in the order they were added
+        self.replicas = {}  # (server, normalized suffix) -> dict
+        self.agreements = []  # dicts
+
+    def _server(self, conn):
+        if conn not in self.servers:
+            self.servers.append(conn)
+
+    def add_replica(self, conn, suffix, role=MASTER_TYPE, rid=None, **kwargs):
+        """Plan a replica of suffix on conn.
+            @param role - MASTER_TYPE, HUB_TYPE or LEAF_TYPE
+            @param rid - the replica ID, required for masters
+            @param kwargs - further Replica.add arguments
+        """
+        self._server(conn)
+        if rid is None and role != MASTER_TYPE:
+            rid = CONSUMER_RID
+        self.replicas[(conn, normalizeDN(suffix))] = {
+            'suffix': suffix, 'role': role, 'rid': rid, 'kwargs': kwargs}
+
+    def add_agreement(self, supplier, consumer, suffix, init=False, **kwargs):
+        """Plan an agreement from supplier to consumer.
+            @param init - initialize the consumer once all the agreements
+                    are created
+            @param kwargs - further Replica.agreement_add arguments
+        """
+        self.agreements.append({
+            'supplier': supplier, 'consumer': consumer, 'suffix': suffix,
+            'init': init, 'kwargs': kwargs})
+
+    def full_mesh(self, suffix, masters, **kwargs):
+        """Plan agreements between every pair of masters."""
+        for supplier in masters:
+            for consumer in masters:
+                if supplier is not consumer:
+                    self.add_agreement(supplier, consumer, suffix, **kwargs)
+
+    def hub_spoke(self, suffix, suppliers, consumers, init=False, **kwargs):
+        """Plan agreements from every supplier to every consumer."""
+        for supplier in suppliers:
+            for consumer in consumers:
+                self.add_agreement(supplier, consumer, suffix, init=init, **kwargs)
+
+    def validate(self):
+        """Check the whole plan, and raise InvalidArgumentError listing
+            all the problems found.
+        """
+        errors = []
+        rids = {}  # (normalized suffix, rid) -> server
+        for (conn, nsuffix), replica in self.replicas.items():
+            role, rid = replica['role'], replica['rid']
+            if role not in (MASTER_TYPE, HUB_TYPE, LEAF_TYPE):
+                errors.append("%s %s: bad role %r" % (conn, nsuffix, role))
+            if role != MASTER_TYPE:
+                continue
+            if not isinstance(rid, int) or not 0 < rid < CONSUMER_RID:
+                errors.append("%s %s: bad replica ID %r for a master" % (conn, nsuffix, rid))
+            elif (nsuffix, rid) in rids:
+                errors.append("%s %s: replica ID %d already used by %s" % (
+                    conn, nsuffix, rid, rids[(nsuffix, rid)]))
+            else:
+                rids[(nsuffix, rid)] = conn
+        seen = {}
+        for agmt in self.agreements:
+            supplier, consumer = agmt['supplier'], agmt['consumer']
+            nsuffix = normalizeDN(agmt['suffix'])
+            name = "agreement %s -> %s %s" % (supplier, consumer, nsuffix)
+            if supplier is consumer:
+                errors.append("%s: supplier and consumer are the same" % name)
+            if (supplier, nsuffix) not in self.replicas:
+                errors.append("%s: no replica planned on the supplier" % name)
+            elif self.replicas[(supplier, nsuffix)]['role'] == LEAF_TYPE:
+                errors.append("%s: the supplier is a consumer" % name)
+            if (consumer, nsuffix) not in self.replicas:
+                errors.append("%s: no replica planned on the consumer" % name)
+            key = (str(supplier), str(consumer), nsuffix)
+            if key in seen:
+                errors.append("%s: planned twice" % name)
+            seen[key] = True
+        if errors:
+            raise InvalidArgumentError("Invalid topology plan:\n\t" + "\n\t".join(errors))
+
+    def _run(self, phase, work):
+        """Run work(conn) for every server concurrently.
+            Return {server name: seconds}, raise DsError if any failed.
+        """
+        timings = {}
+        errors = {}
+
+        def run(conn):
+            start = time.time()
+            try:
+                work(conn)
+            except Exception, e:
+                log.exception("%s failed on %s" % (phase, conn))
+                errors[str(conn)] = e
+            timings[str(conn)] = time.time() - start
+
+        threads = []
+        for conn in self.servers:
+            thread = threading.Thread(target=run, args=(conn,),
+                                      name="%s %s" % (phase, conn))
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise DsError("Phase %s failed on %s" % (phase, ', '.join([
+                "%s: %s" % x for x in errors.items()])))
+        return timings
+
+    def _prepare(self, conn):
+        """Create the suffixes, the changelog and the replication manager."""
+        needs_changelog = False
+        for (server, nsuffix), replica in self.replicas.items():
+            if server is not conn:
+                continue
+            if not conn.getBackendsForSuffix(replica['suffix']):
+                conn.addSuffix(replica['suffix'])
+            if replica['role'] != LEAF_TYPE:
+                needs_changelog = True
+        if needs_changelog:
+            conn.replica.changelog(verify=False)
+        conn.setupBindDN(self.binddn, self.bindpw, {
+            'nsIdleTimeout': '0',
+            'passwordExpirationTime': '20381010000000Z'}, verify=False)
+
+    def _replicas(self, conn):
+        for (server, nsuffix), replica in self.replicas.items():
+            if server is not conn:
+                continue
+            conn.replica.add(replica['suffix'], self.binddn, self.bindpw,
+                             rtype=replica['role'], rid=replica['rid'],
+                             verify=False, **replica['kwargs'])
+
+    def _agreements(self, conn):
+        for agmt in self.agreements:
+            if agmt['supplier'] is not conn:
+                continue
+            agmt['dn'] = conn.replica.agreement_add(
+                agmt['consumer'], agmt['suffix'], self.binddn, self.bindpw,
+                verify=False, **agmt['kwargs'])
+
+    def _init(self, conn):
+        agmtdns = [x['dn'] for x in self.agreements
+                   if x['supplier'] is conn and x['init']]
+        if agmtdns:
+            results = conn.replica.init_many(agmtdns)
+            failed = [dn for dn, result in results.items() if result['rc']]
+            if failed:
+                raise DsError("Init failed for %s" % failed)
+
+    def execute(self):
+        """Validate and apply the plan.
+            Return the timings: {phase: {'elapsed': seconds,
+                                         'servers': {name: seconds}}}
+        """
+        timings = {}
+        start = time.time()
+        self.validate()
+        timings['validate'] = {'elapsed': time.time() - start, 'servers': {}}
+        for phase in TopologyPlan.PHASES:
+            start = time.time()
+            servers = self._run(phase, getattr(self, '_' + phase))
+            timings[phase] = {'elapsed': time.time() - start, 'servers': servers}
+            log.info("Topology plan: %s done in %.2fs" % (phase, timings[phase]['elapsed']))
+        return timings
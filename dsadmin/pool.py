@@ -0,0 +1,143 @@
+"""Pool of bound and initialized DSAdmin connections.
+
+    python-ldap SimpleLDAPObject is not safe for concurrent synchronous
+    calls, so every thread checks out its own connection:
+
+        pool = DSAdminPool('localhost', 389, DN_DM, 'password', size=4)
+        with pool.connection() as conn:
+            conn.getEntry(DN_CONFIG)
+
+    Nested checkouts from the same thread return the same connection.
+"""
+__all__ = ['DSAdminPool']
+
+import Queue
+import threading
+import time
+
+import ldap
+
+from dsadmin import DSAdmin, DsError
+from dsadmin.brooker import TopologyGeneration
+
+import logging
+log = logging.getLogger(__name__)
+
+
+class _Checkout(object):
+    """Context manager returning a pooled connection to its pool."""
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self.pool.get(self.timeout)
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.put(self.conn)
+        return False
+
+
+class DSAdminPool(object):
+    """A fixed size pool of DSAdmin connections to the same server."""
+
+    def __init__(self, host='localhost', port=389, binddn='', bindpw='', size=4, check_interval=30, **kwargs):
+        """Create `size` bound connections.
+            @param check_interval - connections idle for more than
+                    check_interval seconds are checked before being handed
+                    out, and rebound if the server dropped them.
+                    None disables the check.
+            @param kwargs - further DSAdmin arguments, eg. sslport
+        """
+        self.host = host
+        self.port = port
+        self.binddn = binddn
+        self.bindpw = bindpw
+        self.size = size
+        self.check_interval = check_interval
+        self.kwargs = kwargs
+        # idle connections with the time they were released
+        self.generation = TopologyGeneration()
+        self._idle = Queue.Queue(size)
+        self._local = threading.local()
+        for i in range(size):
+            self._idle.put((self._connect(), time.time()))
+
+    def __str__(self):
+        return "%s:%s (%d connections)" % (self.host, self.port, self.size)
+
+    def _connect(self):
+        conn = DSAdmin(self.host, self.port, self.binddn, self.bindpw,
+                       **self.kwargs)
+        # a topology change made through one connection invalidates them all
+        conn.topology.generation = self.generation
+        return conn
+
+    def _check(self, conn):
+        """Rebind the connection if it doesn't answer a root DSE search."""
+        try:
+            conn.search_s('', ldap.SCOPE_BASE, '(objectclass=*)', ['1.1'])
+        except ldap.LDAPError:
+            log.info("Rebinding stale connection to %s" % self)
+            conn.rebind()
+
+    def get(self, timeout=None):
+        """Check out a connection: prefer the connection() context manager.
+            @param timeout - seconds to wait for an idle connection,
+                    None waits forever
+
+            @raise DsError - if no connection is available within timeout
+        """
+        local = self._local
+        if getattr(local, 'conn', None) is not None:
+            local.depth += 1
+            return local.conn
+        try:
+            conn, released = self._idle.get(True, timeout)
+        except Queue.Empty:
+            raise DsError("No connection to %s available after %ss" % (
+                self, timeout))
+        if self.check_interval is not None and \
+                time.time() - released > self.check_interval:
+            try:
+                self._check(conn)
+            except ldap.LDAPError:
+                # keep the pool size: next checkout will retry the rebind
+                self._idle.put((conn, 0))
+                raise
+        local.conn = conn
+        local.depth = 1
+        return conn
+
+    def put(self, conn):
+        """Return a connection obtained with get()."""
+        local = self._local
+        if getattr(local, 'conn', None) is not conn:
+            raise ValueError("Connection %s was not checked out by this thread" % conn)
+        local.depth -= 1
+        if local.depth:
+            return
+        local.conn = None
+        self._idle.put((conn, time.time()))
+
+    def connection(self, timeout=None):
+        """Return a context manager checking out a connection.
+
+            ex. with pool.connection() as conn:
+                    conn.getEntry(DN_CONFIG)
+        """
+        return _Checkout(self, timeout)
+
+    def close(self):
+        """Unbind idle connections. Checked out ones are left alone."""
+        while True:
+            try:
+                conn, released = self._idle.get(False)
+            except Queue.Empty:
+                break
+            try:
+                conn.unbind_s()
+            except ldap.LDAPError:
+                log.exception("Error closing connection to %s" % self)
@@ -0,0 +1,299 @@
+"""Run many cn=tasks,cn=config tasks concurrently.
+
+    Tasks are submitted to a TaskManager, which starts them respecting a
+    per-backend concurrency limit and follows all the running ones with a
+    single search. Every submit returns a TaskFuture:
+
+        tm = conn.tasks
+        futures = [tm.exportLDIF('/tmp/%s.ldif' % be, None, be=be)
+                   for be in backends]
+        done, notdone = tm.wait(futures)
+        for f in futures:
+            print f.name, f.result(), f.log
+
+    DSAdmin.importLDIF & co. use the manager too, blocking on their future.
+"""
+__all__ = ['TaskManager', 'TaskFuture', 'task_name', 'task_entry']
+
+import itertools
+import os
+import random
+import threading
+import time
+
+import ldap
+
+from dsadmin import Entry, DsError
+from dsadmin._constants import DN_TASKS
+from dsadmin.utils import normalizeDN
+
+import logging
+log = logging.getLogger(__name__)
+
+
+_counter = itertools.count(1)
+_counter_lock = threading.Lock()
+
+
+def task_name(kind):
+    """Return a task name that cannot clash with other tasks: the
+        timestamp is not enough when two tasks start in the same second,
+        so add the pid, a per-process counter and a random tag.
+        ex. import20130415120023-1234-1-3f2a
+    """
+    _counter_lock.acquire()
+    try:
+        count = _counter.next()
+    finally:
+        _counter_lock.release()
+    return "%s%s-%d-%d-%04x" % (kind, time.strftime("%Y%m%d%H%M%S"),
+                                os.getpid(), count, random.getrandbits(16))
+
+
+def task_entry(kind, container, **attrs):
+    """Return a new task Entry under cn=<container>,cn=tasks,cn=config.
+        Attributes with an empty value are skipped.
+    """
+    cn = task_name(kind)
+    entry = Entry("cn=%s,cn=%s,%s" % (cn, container, DN_TASKS))
+    entry.setValues('objectclass', 'top', 'extensibleObject')
+    entry.setValues('cn', cn)
+    for attr, value in attrs.items():
+        if value:
+            entry.setValues(attr, value)
+    return entry
+
+
+class TaskFuture(object):
+    """The state of a submitted task.
+
+        state is one of TaskFuture.QUEUED, RUNNING, DONE.
+        exitCode, status, log, currentItem and totalItems mirror the
+        nsTask* attributes as of the last TaskManager.poll().
+    """
+    QUEUED, RUNNING, DONE = 'queued', 'running', 'done'
+
+    def __init__(self, manager, entry, backend):
+        self.manager = manager
+        self.entry = entry
+        self.backend = backend
+        self.state = TaskFuture.QUEUED
+        self.exitCode = None
+        self.status = None
+        self.log = None
+        self.currentItem = None
+        self.totalItems = None
+
+    def _get_name(self):
+        return self.entry.getValue('cn')
+    name = property(_get_name)
+
+    def _get_dn(self):
+        return self.entry.dn
+    dn = property(_get_dn)
+
+    def done(self):
+        return self.state == TaskFuture.DONE
+
+    def running(self):
+        return self.state == TaskFuture.RUNNING
+
+    def progress(self):
+        """Return (nsTaskCurrentItem, nsTaskTotalItems), None if unknown."""
+        return self.currentItem, self.totalItems
+
+    def result(self, timeout=None):
+        """Wait for the task and return its exit code.
+            @param timeout - raise DsError if the task is not done
+                    after timeout seconds
+        """
+        if not self.done():
+            self.manager.wait([self], timeout)
+        if not self.done():
+            raise DsError("Task %s not done after %s seconds" % (self.name, timeout))
+        return self.exitCode
+
+    def _update(self, entry):
+        self.status = entry.nsTaskStatus
+        self.log = entry.nsTaskLog
+        if entry.nsTaskCurrentItem:
+            self.currentItem = int(entry.nsTaskCurrentItem)
+        if entry.nsTaskTotalItems:
+            self.totalItems = int(entry.nsTaskTotalItems)
+        if entry.nsTaskExitCode:
+            self.exitCode = int(entry.nsTaskExitCode)
+            self.state = TaskFuture.DONE
+
+    def __repr__(self):
+        return "<TaskFuture %s %s exitCode=%r>" % (self.name, self.state, self.exitCode)
+
+
+class TaskManager(object):
+    """Submit tasks and follow them together."""
+    ATTRS = ['cn', 'nsTaskLog', 'nsTaskStatus', 'nsTaskExitCode',
+             'nsTaskCurrentItem', 'nsTaskTotalItems']
+
+    def __init__(self, conn, per_backend=1, poll_min=0.1, poll_max=2.0):
+        """@param conn - a DSAdmin instance
+            @param per_backend - max running tasks for each backend
+            @param poll_min, poll_max - bounds of the interval between
+                    two polls in wait(), doubling while nothing happens
+        """
+        self.conn = conn
+        self.log = conn.log
+        self.per_backend = per_backend
+        self.poll_min = poll_min
+        self.poll_max = poll_max
+        self.queued = []
+        self.running = []
+        self.searches = 0
+
+    def submit(self, entry, backend=None):
+        """Queue a task entry and start it if the backend has room.
+            @param entry - a task Entry under cn=tasks,cn=config,
+                    named with task_name()
+            @param backend - the key of the concurrency limit, by
+                    default the nsInstance value or the backend of the
+                    nsIncludeSuffix/basedn suffix
+            @return TaskFuture
+        """
+        if backend is None:
+            backend = entry.nsInstance
+        if backend is None:
+            suffix = entry.nsIncludeSuffix or entry.basedn or ''
+            backends = self.conn.topology.backends(suffix)
+            if backends:
+                backend = backends[0].cn
+            else:
+                backend = normalizeDN(suffix)
+        future = TaskFuture(self, entry, backend.lower())
+        self.queued.append(future)
+        self._start()
+        return future
+
+    def _start(self):
+        """Start the queued tasks allowed by the per-backend limit."""
+        busy = {}
+        for future in self.running:
+            busy[future.backend] = busy.get(future.backend, 0) + 1
+        for future in self.queued[:]:
+            if busy.get(future.backend, 0) >= self.per_backend:
+                continue
+            self.queued.remove(future)
+            try:
+                self.conn.add_s(future.entry)
+            except ldap.LDAPError, e:
+                self.log.error("Cannot start task %s: %s" % (future.name, e))
+                future.exitCode = -1
+                future.status = str(e)
+                future.state = TaskFuture.DONE
+                continue
+            future.state = TaskFuture.RUNNING
+            self.running.append(future)
+            busy[future.backend] = busy.get(future.backend, 0) + 1
+
+    def poll(self):
+        """Refresh all the running tasks with one search and start the
+            queued ones that can. Return the futures that completed.
+        """
+        finished = []
+        if self.running:
+            filt = "(|%s)" % ''.join(["(cn=%s)" % f.name for f in self.running])
+            entries = self.conn.search_s(DN_TASKS, ldap.SCOPE_SUBTREE, filt,
+                                         TaskManager.ATTRS)
+            self.searches += 1
+            bydn = dict([(normalizeDN(e.dn), e) for e in entries])
+            for future in self.running[:]:
+                entry = bydn.get(normalizeDN(future.dn))
+                if entry is None:
+                    self.log.error("Task entry %s disappeared" % future.dn)
+                    future.exitCode = -1
+                    future.state = TaskFuture.DONE
+                else:
+                    future._update(entry)
+                if future.done():
+                    self.running.remove(future)
+                    finished.append(future)
+        if finished:
+            self._start()
+        return finished
+
+    def wait(self, futures=None, timeout=None):
+        """Wait for the futures (default all the submitted ones).
+            @param timeout - return after timeout seconds anyway
+            @return (done, notdone) lists
+
+            While a single running task is left to wait for, its entry is
+            watched with a persistent search (see DSAdmin.watchEntry)
+            instead of being polled: its end is noticed at once.
+        """
+        if futures is None:
+            futures = self.running + self.queued
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        interval = self.poll_min
+        while True:
+            if self.poll():
+                interval = self.poll_min
+            notdone = [f for f in futures if not f.done()]
+            if not notdone:
+                break
+            if len(notdone) == 1 and notdone[0].running() and \
+                    (deadline is None or deadline > time.time()):
+                self._watch(notdone[0], deadline)
+                continue
+            wait = interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.time())
+                if wait <= 0:
+                    break
+            time.sleep(wait)
+            interval = min(interval * 2, self.poll_max)
+        done = [f for f in futures if f.done()]
+        return done, notdone
+
+    def _watch(self, future, deadline):
+        """Block until the entry of a running task has an exit code,
+            disappears, or deadline is reached. The next poll() reads it.
+        """
+        timeout = None
+        if deadline is not None:
+            timeout = max(0, deadline - time.time())
+        for entry in self.conn.watchEntry(future.dn, TaskManager.ATTRS, timeout):
+            if entry is None or entry.nsTaskExitCode:
+                break
+
+    def importLDIF(self, ldiffile, suffix, be=None):
+        """Submit an import task of ldiffile into the backend be,
+            or the backend of suffix.
+        """
+        if be:
+            suffix = None
+        return self.submit(task_entry('import', 'import', nsFilename=ldiffile,
+                                      nsInstance=be, nsIncludeSuffix=suffix))
+
+    def exportLDIF(self, ldiffile, suffix, be=None, forrepl=False):
+        """Submit an export task of the backend be, or the backend of
+            suffix, to ldiffile.
+        """
+        if be:
+            suffix = None
+        nsExportReplica = None
+        if forrepl:
+            nsExportReplica = 'true'
+        return self.submit(task_entry('export', 'export', nsFilename=ldiffile,
+                                      nsInstance=be, nsIncludeSuffix=suffix,
+                                      nsExportReplica=nsExportReplica))
+
+    def createIndex(self, suffix, attr):
+        """Submit a task indexing attr in the backend of suffix."""
+        # assume 1 local backend
+        be = self.conn.getBackendsForSuffix(suffix)[0].cn
+        return self.submit(task_entry('index', 'index', nsIndexAttribute=attr,
+                                      nsInstance=be))
+
+    def fixupMemberOf(self, suffix, filt=None):
+        """Submit a memberOf fixup task under suffix."""
+        return self.submit(task_entry('fixupmemberof', 'memberOf task',
+                                      basedn=suffix, filter=filt))
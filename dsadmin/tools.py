@@ -2,7 +2,7 @@
     
     uses DSAdmin
 """
-__all__ = ['DSAdminTools']
+__all__ = ['DSAdminTools', 'CommandFuture']
 try:
     from subprocess import Popen, PIPE, STDOUT
     HASPOPEN = True
@@ -13,17 +13,22 @@ except ImportError:
 import sys
 import os
 import os.path
-import base64
 import urllib
-import urllib2
 import ldap
 import operator
-import select
+import Queue
+import threading
 import time
 import shutil
+import socket
+from socket import getfqdn
 
 import dsadmin
-from dsadmin import InvalidArgumentError
+from dsadmin import InvalidArgumentError, DsError
+from dsadmin.adminserver import get_client
+from dsadmin.errorlog import (
+    ErrorLogFollower, STARTED, STOPPED, BIND_CONFLICT, INIT_FAILED, EXITING
+)
 
 from dsadmin.utils import (
     getcfgdsuserdn, 
@@ -36,8 +41,8 @@ from dsadmin.utils import (
     update_admin_domain,getadminport,getdefaultsuffix,
     
     )
-from dsadmin._ldifconn import LDIFConn
-from dsadmin._constants import DN_DM
+from dsadmin._ldifconn import get_ldif_entry
+from dsadmin._constants import DN_DM, DN_CONFIG
 
 import logging
 logging.basicConfig(level=logging.INFO)
@@ -48,6 +53,79 @@ PATH_SETUP_DS_ADMIN = "/setup-ds-admin.pl"
 PATH_SETUP_DS = "/setup-ds.pl"
 PATH_ADM_CONF = "/etc/dirsrv/admin-serv/adm.conf"
 
+def _port_in_use(host, port, timeout=1):
+    """True if something accepts connections on host:port."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.connect((host, port))
+            return True
+        except socket.error:
+            return False
+    finally:
+        sock.close()
+
+
+def _instance_conflicts(arglist):
+    """Return the problems of a list of createInstance args: missing
+        names, ports or names used twice on the same host, and ports
+        already in use on this host. createInstance would return a
+        connection to a server found on the port instead of creating one.
+    """
+    errors = []
+    ports = {}
+    names = {}
+    for args in arglist:
+        name = args.get('newinst')
+        if not name:
+            errors.append("%r: missing newinst" % args)
+            continue
+        host = getfqdn(args.get('newhost', '')).lower()
+        port = int(args.get('newport', 389))
+        for used, key, what in ((ports, (host, port), "port %d" % port),
+                                (names, (host, name), "name")):
+            if key in used:
+                errors.append("%s: %s on %s already used by %s" % (
+                              name, what, host, used[key]))
+            else:
+                used[key] = name
+        if isLocalHost(host) and _port_in_use(host, port):
+            errors.append("%s: port %d on %s is already in use" % (name, port, host))
+    return errors
+
+
+class CommandFuture(object):
+    """The result of a function running in its own thread."""
+
+    def __init__(self, func, *args, **kwargs):
+        self._result = None
+        self._exc_info = None
+        self._thread = threading.Thread(target=self._run, args=(func, args, kwargs))
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _run(self, func, args, kwargs):
+        try:
+            self._result = func(*args, **kwargs)
+        except:
+            self._exc_info = sys.exc_info()
+
+    def done(self):
+        return not self._thread.isAlive()
+
+    def result(self, timeout=None):
+        """Wait for the function and return its result, or raise its
+            exception. Raise DsError after timeout seconds.
+        """
+        self._thread.join(timeout)
+        if self._thread.isAlive():
+            raise DsError("Command still running after %s seconds" % timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
 class DSAdminTools(object):
     """DSAdmin mix-in."""
 
@@ -90,148 +168,106 @@ class DSAdminTools(object):
 
     @staticmethod
     def cgiPost(host, port, username, password, uri, verbose, secure, args=None):
-        """Post the request to the admin server.
-
-           Admin server requires authentication, so we use the auth handler classes.
-
-            NOTE: the url classes in python use the deprecated
-            base64.encodestring() function, which truncates lines,
-            causing Apache to give us a 400 Bad Request error for the
-            Authentication string.  So, we have to tell
-            base64.encodestring() not to truncate."""
-        args = args or {}
-        prefix = 'http'
-        if secure:
-            prefix = 'https'
-        hostport = host + ":" + port
-        # construct our url
-        url = '%s://%s:%s%s' % (prefix, host, port, uri)
-        # tell base64 not to truncate lines
-        savedbinsize = base64.MAXBINSIZE
-        base64.MAXBINSIZE = 256
-        # create the password manager - we don't care about the realm
-        passman = urllib2.HTTPPasswordMgrWithDefaultRealm()
-        # add our password
-        passman.add_password(None, hostport, username, password)
-        # create the auth handler
-        authhandler = urllib2.HTTPBasicAuthHandler(passman)
-        # create our url opener that handles basic auth
-        opener = urllib2.build_opener(authhandler)
-        # make admin server think we are the console
-        opener.addheaders = [('User-Agent', 'Fedora-Console/1.0')]
-        if verbose:
-            print "requesting url", url
-            sys.stdout.flush()
-        exitCode = 1
-        try:
-            req = opener.open(url, urllib.urlencode(args))
-            for line in req:
-                if verbose:
-                    print line
-                ary = line.split(":")
-                if len(ary) > 1 and ary[0] == 'NMC_Status':
-                    exitCode = ary[1].strip()
-                    break
-            req.close()
-#         except IOError, e:
-#             print e
-#             print e.code
-#             print e.headers
-#             raise
-        finally:
-            # restore binsize
-            base64.MAXBINSIZE = savedbinsize
-        return exitCode
+        """Post the request to the admin server and return its NMC_Status.
+
+            The connections to each admin server are kept alive and shared
+            by all the threads, see adminserver.AdminServerClient.
+        """
+        client = get_client(host, port, username, password, secure)
+        return client.post(uri, args, verbose)
 
     @staticmethod
-    def serverCmd(self, cmd, verbose, timeout=120):
-        """NOTE: this tries to open the log!
+    def serverCmd(self, cmd, verbose, timeout=120, retries=3):
+        """Run the start or stop script of the instance and wait for the
+            errors log to tell it's done. Return 0 on success, 1 otherwise.
+            @param cmd - 'start' or 'stop'
+            @param timeout - seconds (default 120 if 0 or None)
+            @param retries - times the command is run again if the server
+                    logs a transient initialization failure
+
+            NOTE: this tries to open the log!
         """
         instanceDir = os.path.join(self.sroot, "slapd-" + self.inst)
 
         errLog = instanceDir + '/logs/errors'
         if hasattr(self, 'errlog'):
             errLog = self.errlog
-        done = False
-        started = True
-        lastLine = ""
         cmd = cmd.lower()
         fullCmd = instanceDir + "/" + cmd + "-slapd"
         if cmd == 'start':
-            cmdPat = 'slapd started.'
+            expected = STARTED
         else:
-            cmdPat = 'slapd stopped.'
+            expected = STOPPED
 
+        timeout = timeout or 120
         if "USE_GDB" in os.environ or "USE_VALGRIND" in os.environ:
             timeout = timeout * 3
-        timeout += int(time.time())
+        deadline = time.time() + timeout
         if cmd == 'stop':
             log.info("unbinding before stop")
             self.unbind()
 
         log.info("Setup error log")
-        logfp = open(errLog, 'r')
-        logfp.seek(0, os.SEEK_END)  # seek to end
-        pos = logfp.tell()  # get current position
-        logfp.seek(pos, os.SEEK_SET)  # reset the EOF flag
-
-        log.info("Running command: %r" % fullCmd)
-        rc = os.system(fullCmd)
-        while not done and int(time.time()) < timeout:
-            line = logfp.readline()
-            while not done and line:
-                lastLine = line
-                if verbose:
-                    log.debug("current line: %r" % line.strip())
-                if line.find(cmdPat) >= 0:
-                    started += 1
-                    if started == 2:
-                        done = True
-                elif line.find("Initialization Failed") >= 0:
-                    # sometimes the server fails to start - try again
-                    rc = os.system(fullCmd)
-                elif line.find("exiting.") >= 0:
+        follower = ErrorLogFollower(errLog)
+        try:
+            log.info("Running command: %r" % fullCmd)
+            rc = os.system(fullCmd)
+            done = False
+            for event in follower.events(deadline - time.time(), verbose):
+                if event.kind == expected:
+                    done = True
+                elif event.kind == BIND_CONFLICT:
+                    # server port conflicts with another one, just report and punt
+                    log.debug("last line: %r" % event.line)
+                    log.warn("This server cannot be started until the other server on this port is shutdown")
+                elif event.kind in (INIT_FAILED, EXITING) and retries > 0:
                     # possible transient condition - try again
+                    retries -= 1
                     rc = os.system(fullCmd)
-                pos = logfp.tell()
-                line = logfp.readline()
-            if line.find("PR_Bind") >= 0:
-                # server port conflicts with another one, just report and punt
-                log.debug("last line: %r" % lastLine.strip())
-                log.warn("This server cannot be started until the other server on this port is shutdown")
-                done = True
-            if not done:
-                time.sleep(2)
-                logfp.seek(pos, 0)
-        logfp.close()
-        if started < 2:
-            now = int(time.time())
-            if now > timeout:
-                log.warn(
-                    "Probable timeout: timeout=%d now=%d" % (timeout, now))
+                    continue
+                else:
+                    continue
+                break
+        finally:
+            follower.close()
 
+        if not done:
+            if time.time() > deadline:
+                log.warn("Probable timeout: timeout=%d" % timeout)
             log.error("Error: could not %s server %s %s: %d" % (
                       cmd, self.sroot, self.inst, rc))
             return 1
-        else:
-            log.info("%s was successful for %s %s" % (
-                     cmd, self.sroot, self.inst))
-            if cmd == 'start':
-                self.__localinit__()
+        log.info("%s was successful for %s %s" % (
+                 cmd, self.sroot, self.inst))
+        if cmd == 'start':
+            self.__localinit__()
         return 0
 
+    @staticmethod
+    def serverCmdAsync(self, cmd, verbose=False, timeout=120):
+        """Run serverCmd in a thread and return a CommandFuture of its
+            return code, so that many instances can be started or
+            stopped together:
+
+                futures = [DSAdminTools.serverCmdAsync(x, 'start') for x in conns]
+                failed = [f for f in futures if f.result()]
+
+            Don't use self until the command is done.
+        """
+        return CommandFuture(DSAdminTools.serverCmd, self, cmd, verbose, timeout)
+
     @staticmethod
     def stop(self, verbose=False, timeout=0):
         """Stop server or raise."""
         if not self.isLocal and hasattr(self, 'asport'):
-            log.info("stopping remote server ", self)
+            log.info("stopping remote server %s", self)
             self.unbind()
-            log.info("closed remote server ", self)
+            log.info("closed remote server %s", self)
             cgiargs = {}
             rc = DSAdminTools.cgiPost(self.host, self.asport, self.cfgdsuser,
                                       self.cfgdspwd,
                                       "/slapd-%s/Tasks/Operation/stop" % self.inst,
-                                      verbose, cgiargs)
+                                      verbose, getattr(self, 'assecure', False), cgiargs)
             log.info("stopped remote server %s rc = %d" % (self, rc))
             return rc
         else:
@@ -245,7 +281,7 @@ class DSAdminTools(object):
             rc = DSAdminTools.cgiPost(self.host, self.asport, self.cfgdsuser,
                                       self.cfgdspwd,
                                       "/slapd-%s/Tasks/Operation/start" % self.inst,
-                                      verbose, cgiargs)
+                                      verbose, getattr(self, 'assecure', False), cgiargs)
             log.debug("connecting remote server %s" % self)
             if not rc:
                 self.__localinit__()
@@ -261,12 +297,11 @@ class DSAdminTools(object):
         
             See DSAdmin.configSSL for the secargs values
         """
-        e = dsadmin.configSSL(secport, secargs)
-        log.info("entry is %r" % [e])
-        dn_config = e.dn
+        changes = dsadmin.configSSL(secport, secargs)
+        log.info("changes are %r" % changes)
         # get our cert dir
         e_config = dsadmin.getEntry(
-            dn_config, ldap.SCOPE_BASE, '(objectclass=*)')
+            DN_CONFIG, ldap.SCOPE_BASE, '(objectclass=*)')
         certdir = e_config.getValue('nsslapd-certdir')
         # have to stop the server before replacing any security files
         DSAdminTools.stop(dsadmin)
@@ -297,15 +332,21 @@ class DSAdminTools(object):
         DSAdminTools.start(dsadmin, True)
 
     @staticmethod
-    def runInfProg(prog, content, verbose):
-        """run a program that takes an .inf style file on stdin"""
+    def runInfProg(prog, content, verbose, tag=None):
+        """run a program that takes an .inf style file on stdin.
+            Its output is logged as it comes, each line prefixed by tag.
+            Return the exit code of the program.
+        """
         cmd = [prog]
         if log.isEnabledFor(logging.DEBUG):
             cmd.append('-ddd')
         else:
             cmd.extend(['-l', '/dev/null'])
         cmd.extend(['-s', '-f', '-'])
-        log.info("running: %s ", cmd)
+        prefix = ''
+        if tag:
+            prefix = "[%s] " % tag
+        log.info("%srunning: %s ", prefix, cmd)
         if HASPOPEN:
             pipe = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=STDOUT)
             child_stdin = pipe.stdin
@@ -316,18 +357,13 @@ class DSAdminTools(object):
             child_stdout = pipe.fromchild
         child_stdin.write(content)
         child_stdin.close()
-        while not pipe.poll():
-            (rr, wr, xr) = select.select([child_stdout], [], [], 1.0)
-            if rr and len(rr) > 0:
-                line = rr[0].readline()
-                if not line:
-                    break
-                log.debug(line)
-            else:
-                log.debug("timed out waiting to read from %s", cmd)
+        # blocking reads until the end of the output: each installer of
+        # create_instances is followed by its own thread
+        for line in iter(child_stdout.readline, ''):
+            log.debug("%s%s", prefix, line.rstrip('\n'))
         child_stdout.close()
         exitCode = pipe.wait()
-        log.debug("%s returned exit code %s" % (prog, exitCode))
+        log.debug("%s%s returned exit code %s" % (prefix, prog, exitCode))
         return exitCode
 
     @staticmethod
@@ -383,9 +419,8 @@ class DSAdminTools(object):
 
         # get default values from adm.conf
         if args['new_style'] and args['have_admin']:
-            admconf = LDIFConn(
-                args['prefix'] + PATH_ADM_CONF)
-            args['admconf'] = admconf.get('')
+            args['admconf'] = get_ldif_entry(
+                args['prefix'] + PATH_ADM_CONF, '')
 
         # next, get the configuration ds host and port
         if args['have_admin']:
@@ -438,6 +473,7 @@ class DSAdminTools(object):
             newconn.isLocal = isLocal
             if args['have_admin'] and not args['setup_admin']:
                 newconn.asport = asport
+                newconn.assecure = secure
                 newconn.cfgdsuser = args['cfgdsuser']
                 newconn.cfgdspwd = args['cfgdspwd']
             print "Warning: server at %s:%s already exists, returning connection to it" % \
@@ -497,7 +533,7 @@ class DSAdminTools(object):
                 prog = prog[:-3]
 
             content = formatInfData(args)
-            DSAdminTools.runInfProg(prog, content, verbose)
+            DSAdminTools.runInfProg(prog, content, verbose, args['newinst'])
 
         newconn = dsadmin.DSAdmin(args['newhost'], args['newport'],
                           args['newrootdn'], args['newrootpw'])
@@ -507,10 +543,67 @@ class DSAdminTools(object):
         # before.
         if args['have_admin'] and not args['setup_admin']:
             newconn.asport = asport
+            newconn.assecure = secure
             newconn.cfgdsuser = args['cfgdsuser']
             newconn.cfgdspwd = args['cfgdspwd']
         return newconn
 
+    @staticmethod
+    def create_instances(arglist, max_parallel=4, verbose=0):
+        """Create many instances concurrently, see createInstance.
+
+            All the instances are checked first: InvalidArgumentError is
+            raised before creating anything if two of them have the same
+            port or the same name on a host, or if a local port is
+            already in use.
+
+            Return the connections in the order of arglist. conn.setup_time
+            is the number of seconds its creation took. Raise DsError if
+            any creation failed, once the others are done.
+            @param arglist - list of createInstance args dicts
+            @param max_parallel - max installers running together
+        """
+        errors = _instance_conflicts(arglist)
+        if errors:
+            raise InvalidArgumentError("Conflicting instances:\n\t" + "\n\t".join(errors))
+
+        conns = [None] * len(arglist)
+        failed = {}
+        todo = Queue.Queue()
+        for i in range(len(arglist)):
+            todo.put(i)
+
+        def work():
+            while True:
+                try:
+                    i = todo.get_nowait()
+                except Queue.Empty:
+                    return
+                name = arglist[i]['newinst']
+                start = time.time()
+                try:
+                    conn = DSAdminTools.createInstance(arglist[i], verbose)
+                except Exception, e:
+                    log.exception("Cannot create instance %s" % name)
+                    failed[name] = e
+                    continue
+                conn.setup_time = time.time() - start
+                log.info("Instance %s created in %.2fs" % (name, conn.setup_time))
+                conns[i] = conn
+
+        threads = []
+        for i in range(min(max_parallel, len(arglist))):
+            thread = threading.Thread(target=work, name="create_instances %d" % i)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        if failed:
+            raise DsError("Cannot create %s" % ', '.join([
+                "%s: %s" % x for x in failed.items()]))
+        return conns
+
     @staticmethod
     def createAndSetupReplica(createArgs, repArgs):
         # pass this sub two dicts - the first one is a dict suitable to create
@@ -17,6 +17,9 @@ except ImportError:
 
 import re
 import os
+import binascii
+import threading
+import time
 import logging
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
@@ -29,6 +32,7 @@ import ldap
 import dsadmin
 from dsadmin import DN_CONFIG
 from dsadmin._constants import *
+from dsadmin._dn import DN, escape_value, escape_filter_value
 
 #
 # Decorator
@@ -61,14 +65,101 @@ def is_a_dn(dn):
     return (dn.find("=") > 0)
 
 
+class LRUCache(object):
+    """A thread-safe dict-like cache keeping at most maxsize keys.
+
+        When full, the least recently used key is discarded.
+        cache.hits and cache.misses count the get() results.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.lock.acquire()
+        try:
+            self.hits = self.misses = 0
+            self.map = {}
+            # circular doubly linked list of [prev, next, key, value]
+            # nodes: root[1] is the oldest, root[0] the newest
+            self.root = []
+            self.root[:] = [self.root, self.root, None, None]
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.map)
+
+    def get(self, key, default=None):
+        self.lock.acquire()
+        try:
+            node = self.map.get(key)
+            if node is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            # move to the most recently used position
+            prev, nxt = node[0], node[1]
+            prev[1], nxt[0] = nxt, prev
+            last = self.root[0]
+            node[0], node[1] = last, self.root
+            last[1] = self.root[0] = node
+            return node[3]
+        finally:
+            self.lock.release()
+
+    def __setitem__(self, key, value):
+        self.lock.acquire()
+        try:
+            node = self.map.get(key)
+            if node is not None:
+                node[3] = value
+                return
+            if len(self.map) >= self.maxsize:
+                oldest = self.root[1]
+                self.root[1], oldest[1][0] = oldest[1], self.root
+                del self.map[oldest[2]]
+            last = self.root[0]
+            node = [last, self.root, key, value]
+            last[1] = self.root[0] = self.map[key] = node
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """Return a dict with hits, misses, size and maxsize"""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self.map), 'maxsize': self.maxsize}
+
+
+# a lowercase DN without spaces, quotes or escapes is already normalized
+RE_NORMALIZED_DN = re.compile(r'^[a-z0-9.-]+=[a-z0-9._@-]+(,[a-z0-9.-]+=[a-z0-9._@-]+)*$')
+NORMALIZEDN_CACHE_SIZE = 4096
+
+
+@static_var("cache", LRUCache(NORMALIZEDN_CACHE_SIZE))
 def normalizeDN(dn, usespace=False):
-    # not great, but will do until we use a newer version of python-ldap
-    # that has DN utilities
-    ary = ldap.explode_dn(dn.lower())
+    """Return the lowercase DN without spaces between RDNs.
+
+        Results are kept in normalizeDN.cache (see LRUCache.stats), and
+        DNs that are already normalized skip parsing.
+    """
+    key = (dn, usespace)
+    ret = normalizeDN.cache.get(key)
+    if ret is not None:
+        return ret
     joinstr = ","
     if usespace:
         joinstr = ", "
-    return joinstr.join(ary)
+    if RE_NORMALIZED_DN.match(dn):
+        if usespace:
+            ret = dn.replace(",", joinstr)
+        else:
+            ret = dn
+    else:
+        ret = DN(dn).format(joinstr)
+    normalizeDN.cache[key] = ret
+    return ret
 
 
 def escapeDNValue(dn):
@@ -76,17 +167,13 @@ def escapeDNValue(dn):
 
      e.g.
     "dc=example,dc=com" -> \"dc\=example\,\ dc\=com\"'''
-    for cc in (' ', '"', '+', ',', ';', '<', '>', '='):
-        dn = dn.replace(cc, '\\' + cc)
-    return dn
+    return escape_value(dn)
 
 
 def escapeDNFiltValue(dn):
     '''convert special characters in a DN into LDAPv3 escapes
     for use in search filters'''
-    for cc in (' ', '"', '+', ',', ';', '<', '>', '='):
-        dn = dn.replace(cc, '\\%x' % ord(cc))
-    return dn
+    return escape_filter_value(dn)
 
 
 def suffixfilt(suffix):
@@ -94,8 +181,9 @@ def suffixfilt(suffix):
 
         eg. normalized, escaped, spaced...
     """
-    nsuffix = normalizeDN(suffix)
-    spacesuffix = normalizeDN(nsuffix, True)
+    dn = DN(suffix)
+    nsuffix = dn.normalized
+    spacesuffix = dn.format(', ')
     escapesuffix = escapeDNFiltValue(nsuffix)
     filt = '(|(cn=%s)(cn=%s)(cn=%s)(cn="%s")(cn="%s")(cn=%s)(cn="%s"))' % (escapesuffix, nsuffix, spacesuffix, nsuffix, spacesuffix, suffix, suffix)
     return filt
@@ -117,33 +205,107 @@ def get_sbin_dir(sroot=None, prefix=None):
 #
 # functions using sockets
 #
+# the local addresses are read again after LOCAL_ADDRESSES_TTL seconds,
+# host names resolved again after RESOLVE_TTL seconds
+LOCAL_ADDRESSES_TTL = 60
+RESOLVE_TTL = 300
+RESOLVE_CACHE_SIZE = 1024
+PROC_FIB_TRIE = '/proc/net/fib_trie'
+PROC_IF_INET6 = '/proc/net/if_inet6'
+RE_IFCONFIG_INET = re.compile(r'inet6? (?:addr:\s*)?([0-9A-Fa-f.:]+)')
+
+
+def _read_proc_addresses():
+    """Return the local addresses listed by the kernel in /proc/net.
+
+        In fib_trie the local addresses are the '/32 host LOCAL' leaves,
+        if_inet6 lists the IPv6 addresses as 32 hex digits.
+    """
+    addrs = set()
+    fp = open(PROC_FIB_TRIE)
+    try:
+        last = None
+        for line in fp:
+            line = line.strip()
+            if line.startswith('|-- '):
+                last = line[4:]
+            elif line.startswith('/32 host LOCAL') and last:
+                addrs.add(last)
+    finally:
+        fp.close()
+    if os.path.exists(PROC_IF_INET6):
+        fp = open(PROC_IF_INET6)
+        try:
+            for line in fp:
+                hexaddr = line.split()[0]
+                addrs.add(socket.inet_ntop(socket.AF_INET6, binascii.unhexlify(hexaddr)))
+        finally:
+            fp.close()
+    return addrs
+
+
+def _read_ifconfig_addresses():
+    """Return the local addresses printed by ifconfig -a."""
+    p = my_popen(['/sbin/ifconfig', '-a'], stdout=PIPE)
+    output = p.stdout.read()
+    p.wait()
+    return set([x.split('%')[0] for x in RE_IFCONFIG_INET.findall(output)])
+
+
+@static_var("cache", [0, None])
+def local_addresses():
+    """Return the set of the ip addresses of this host.
+
+        They are read from /proc/net, or from ifconfig where it does not
+        exist, at most once every LOCAL_ADDRESSES_TTL seconds.
+    """
+    expires, addrs = local_addresses.cache
+    if addrs is not None and time.time() < expires:
+        return addrs
+    if os.path.exists(PROC_FIB_TRIE):
+        addrs = _read_proc_addresses()
+    else:
+        addrs = _read_ifconfig_addresses()
+    local_addresses.cache[:] = [time.time() + LOCAL_ADDRESSES_TTL, addrs]
+    return addrs
+
+
+@static_var("cache", LRUCache(RESOLVE_CACHE_SIZE))
+def resolve(host_name):
+    """Return the set of the ip addresses of host_name, empty if it
+        does not resolve. Results are kept in resolve.cache for
+        RESOLVE_TTL seconds.
+    """
+    cached = resolve.cache.get(host_name)
+    if cached is not None and time.time() < cached[0]:
+        return cached[1]
+    try:
+        addrs = set([x[4][0] for x in socket.getaddrinfo(host_name, None)])
+    except socket.gaierror:
+        log.debug("no ip address for %r" % host_name)
+        addrs = set()
+    resolve.cache[host_name] = (time.time() + RESOLVE_TTL, addrs)
+    return addrs
+
+
 def isLocalHost(host_name):
     """True if host_name points to a local ip.
 
-        Uses gethostbyname()
+        Uses the cached resolve() and local_addresses(): no process is
+        forked, and the DNS is queried once per RESOLVE_TTL.
     """
     # first see if this is a "well known" local hostname
     if host_name == 'localhost' or host_name == 'localhost.localdomain':
         return True
 
-    # first lookup ip addr
-    try:
-        ip_addr = socket.gethostbyname(host_name)
-        if ip_addr.startswith("127."):
-            log.debug("this ip is on loopback, retain only the first octet")
-            ip_addr = '127.'
-    except socket.gaierror:
-        log.debug("no ip address for %r" % host_name)
-        return False
-
-    # next, see if this IP addr is one of our
-    # local addresses
-    p = my_popen(['/sbin/ifconfig', '-a'], stdout=PIPE)
-    child_stdout = p.stdout.read()
-    found = ('inet addr:' + ip_addr) in child_stdout
-    p.wait()
+    addrs = resolve(host_name)
+    for ip_addr in addrs:
+        if ip_addr.startswith("127.") or ip_addr == '::1':
+            log.debug("%r is on loopback" % host_name)
+            return True
 
-    return found
+    # next, see if one of its addresses is a local one
+    return bool(addrs & local_addresses())
 
 
 def getdomainname(name=''):
@@ -0,0 +1,76 @@
+"""Throughput of DSAdmin.addLDIF with and without pipelining.
+
+    The server is a stand-in with a configurable network latency and
+    a per-operation service time: pipelined adds overlap their round
+    trips, while add_s pays the full latency for every entry.
+
+    Run with:
+        python tests/addldif_bench.py [nentries] [latency_ms] [service_ms]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from dsadmin import DSAdmin
+
+
+class LatencyDSAdmin(DSAdmin):
+    """A DSAdmin answering adds after latency seconds, serving one
+    operation every service seconds."""
+    def __init__(self, latency, service):
+        self.latency = latency
+        self.service = service
+        self.last = 0
+        self.msgid = 0
+        self.completions = {}
+
+    def add(self, entry):
+        now = time.time()
+        self.last = max(now + self.latency, self.last + self.service)
+        self.msgid += 1
+        self.completions[self.msgid] = self.last
+        return self.msgid
+
+    def add_s(self, entry):
+        return self.result2(self.add(entry))
+
+    def result2(self, msgid):
+        delay = self.completions.pop(msgid) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return 105, [], msgid
+
+
+def make_ldif(nentries):
+    fd, path = tempfile.mkstemp(suffix='.ldif')
+    out = os.fdopen(fd, 'w')
+    for i in xrange(nentries):
+        out.write("dn: uid=user%d,ou=People,dc=example,dc=com\n"
+                  "objectclass: top\nobjectclass: person\n"
+                  "uid: user%d\ncn: User %d\nsn: %d\n\n" % (i, i, i, i))
+    out.close()
+    return path
+
+
+def main(nentries=2000, latency_ms=2, service_ms=0.05):
+    path = make_ldif(nentries)
+    try:
+        print "%d entries, latency %sms, service time %sms" % (
+            nentries, latency_ms, service_ms)
+        print "%8s %12s" % ('window', 'entries/s')
+        for window in (None, 1, 8, 32, 128):
+            conn = LatencyDSAdmin(latency_ms / 1000.0, service_ms / 1000.0)
+            start = time.time()
+            added = conn.addLDIF(path, window=window)
+            elapsed = time.time() - start
+            print "%8s %12.1f" % (window, added / elapsed)
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    args = [float(x) for x in sys.argv[1:4]]
+    if args:
+        args[0] = int(args[0])
+    main(*args)
@@ -0,0 +1,142 @@
+import base64
+import socket
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from dsadmin import DsError
+from dsadmin.adminserver import AdminServerClient, get_client
+from dsadmin.tools import DSAdminTools
+
+import logging
+logging.basicConfig(level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+AUTH = 'Basic ' + base64.b64encode('admin:' + 'x' * 100)
+server = None
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """A stand-in admin server: answers NMC_Status 0 to authenticated posts."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.server.requests.append((self.path, self.client_address,
+                                     self.rfile.read(int(self.headers['Content-Length']))))
+        if self.headers.get('Authorization') != AUTH:
+            body = 'Unauthorized\n'
+            self.send_response(401)
+        else:
+            body = 'Content-type: text/plain\n' + 'x' * 20000 + '\nNMC_Status: 0\nNMC_Description: done\n'
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def setup():
+    global server
+    server = Server(('127.0.0.1', 0), Handler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+
+
+def teardown():
+    get_client('127.0.0.1', server.server_port, 'admin', 'x' * 100).close()
+    server.shutdown()
+    server.server_close()
+
+
+def keepalive_test():
+    server.requests = []
+    client = AdminServerClient('127.0.0.1', server.server_port, 'admin', 'x' * 100)
+    try:
+        for i in range(5):
+            assert client.post('/slapd-m1/Tasks/Operation/stop', {'a': i}) == 0
+        # one connection for all the requests
+        assert len(set([x[1] for x in server.requests])) == 1
+        assert server.requests[-1][2] == 'a=4'
+    finally:
+        client.close()
+
+
+def unauthorized_test():
+    client = AdminServerClient('127.0.0.1', server.server_port, 'admin', 'wrong')
+    try:
+        client.post('/slapd-m1/Tasks/Operation/stop')
+        assert False, "a 401 should raise"
+    except DsError:
+        pass
+    client.close()
+
+
+def stale_connection_test():
+    server.requests = []
+    client = AdminServerClient('127.0.0.1', server.server_port, 'admin', 'x' * 100)
+    assert client.post('/a') == 0
+    # the server drops the idle connection
+    conn = client._idle.get(False)
+    conn.sock.close()
+    client._idle.put(conn)
+    assert client.post('/b') == 0
+    client.close()
+
+
+def parallel_test():
+    server.requests = []
+    results = []
+
+    def run():
+        for i in range(10):
+            results.append(DSAdminTools.cgiPost('127.0.0.1', server.server_port, 'admin',
+                                                'x' * 100, '/slapd-m1/Tasks/Operation/start',
+                                                False, False))
+    threads = [threading.Thread(target=run) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [0] * 40
+    # connections are reused across threads
+    assert len(set([x[1] for x in server.requests])) <= 4
+    assert get_client('127.0.0.1', server.server_port, 'admin', 'x' * 100) is \
+        get_client('127.0.0.1', str(server.server_port), 'admin', 'x' * 100)
+
+
+class BrokenConnection(object):
+    """A connection whose requests fail, remembering if it was closed."""
+    closed = False
+
+    def request(self, *args):
+        raise socket.error("connection refused")
+
+    def close(self):
+        self.closed = True
+
+
+def stale_connection_retry_failure_test():
+    client = AdminServerClient('127.0.0.1', server.server_port, 'admin', 'x' * 100)
+    assert client.post('/a') == 0
+    conn = client._idle.get(False)
+    conn.sock.close()
+    client._idle.put(conn)
+    # the retry fails too: its connection is closed, not leaked
+    retry = BrokenConnection()
+    client._connect = lambda: retry
+    try:
+        client.post('/b')
+        assert False, "a failed retry should raise"
+    except socket.error:
+        pass
+    assert retry.closed
+    assert client._idle.empty()
+    client.close()
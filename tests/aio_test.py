@@ -0,0 +1,134 @@
+import os
+import ldap
+from collections import deque
+from dsadmin import Entry, DN_TASKS
+from dsadmin import aio
+from dsadmin.aio import AsyncDSAdmin
+
+import logging
+logging.basicConfig(level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+
+class FakeConn(object):
+    """Answers every operation at once, keeping the results until read."""
+    def __init__(self, entries):
+        self.entries = dict([(e.dn, e) for e in entries])
+        self.responses = {}
+        self.msgid = 0
+        self.sent = []
+        self.task_polls = 0
+        self.rfd, self.wfd = os.pipe()
+
+    def fileno(self):
+        return self.rfd
+
+    def _queue(self, *responses):
+        self.msgid += 1
+        self.responses[self.msgid] = deque(responses)
+        return self.msgid
+
+    def search_ext(self, base, scope, filterstr, attrlist=None):
+        self.sent.append(('search', base))
+        if base == DN_TASKS:
+            self.task_polls += 1
+            found = [e for e in self.entries.values() if e.dn.endswith(DN_TASKS)]
+            if self.task_polls >= 2:
+                for e in found:
+                    e.setValues('nsTaskExitCode', '0')
+        elif base in self.entries:
+            found = [self.entries[base]]
+        else:
+            return self._queue(ldap.NO_SUCH_OBJECT({'desc': 'No such object'}))
+        responses = [(ldap.RES_SEARCH_ENTRY, [(e.dn, e.data)]) for e in found]
+        return self._queue(*(responses + [(ldap.RES_SEARCH_RESULT, [])]))
+
+    def add_ext(self, entry):
+        self.sent.append(('add', entry.dn))
+        if entry.dn in self.entries:
+            return self._queue(ldap.ALREADY_EXISTS({'desc': 'Already exists'}))
+        self.entries[entry.dn] = entry
+        return self._queue((ldap.RES_ADD, []))
+
+    def result3(self, msgid, all=1, timeout=None):
+        if msgid == ldap.RES_ANY:
+            pending = [k for k, v in self.responses.items() if v]
+            if not pending:
+                return None, None, None, None
+            msgid = pending[0]
+        queue = self.responses.get(msgid)
+        if not queue:
+            return None, None, None, None
+        response = queue.popleft()
+        if isinstance(response, Exception):
+            raise response
+        return response[0], response[1], msgid, []
+
+
+def make_conn():
+    return FakeConn([Entry(('o=e%d' % i, {'o': ['e%d' % i]})) for i in range(50)])
+
+
+def getEntry_test():
+    conn = make_conn()
+    aconn = AsyncDSAdmin(conn, max_outstanding=8)
+    futures = [aconn.getEntry('o=e%d' % i) for i in range(50)]
+    missing = aconn.getEntry('o=missing')
+    # no more than max_outstanding operations are sent at once
+    assert len(conn.sent) == 8
+    aconn.run()
+    assert [f.result().o for f in futures] == ['e%d' % i for i in range(50)]
+    assert isinstance(missing.exception(), ldap.NO_SUCH_OBJECT)
+    assert aconn.pending() == 0
+
+
+def add_callback_test():
+    conn = make_conn()
+    aconn = AsyncDSAdmin(conn)
+    done = []
+    f = aconn.add(Entry(('o=new', {'o': ['new']})))
+    f.add_done_callback(done.append)
+    dup = aconn.add(Entry(('o=e1', {'o': ['e1']})))
+    assert f.result() is True and done == [f]
+    try:
+        dup.result()
+        assert False, "adding an existing entry should fail"
+    except ldap.ALREADY_EXISTS:
+        pass
+
+
+def res_any_test():
+    # with python-ldap 3 all the results are read with RES_ANY
+    saved = aio.HASERRORMSGID
+    aio.HASERRORMSGID = True
+    try:
+        aconn = AsyncDSAdmin(make_conn())
+        futures = [aconn.search('o=e%d' % i) for i in range(10)]
+        aconn.run(futures)
+        assert [len(f.result()) for f in futures] == [1] * 10
+    finally:
+        aio.HASERRORMSGID = saved
+
+
+def task_test():
+    conn = make_conn()
+    aconn = AsyncDSAdmin(conn, poll_min=0.01, poll_max=0.02)
+    futures = [aconn.exportLDIF('/tmp/e%d.ldif' % i, 'o=e%d' % i) for i in range(3)]
+    assert aconn.next_timeout() is None
+    aconn.process()
+    assert aconn.next_timeout() is not None
+    assert [f.result(timeout=5) for f in futures] == [0, 0, 0]
+    # one search polls all the tasks
+    assert conn.task_polls == 2
+    assert futures[0].entry.nsTaskExitCode == '0'
+
+
+def timeout_test():
+    conn = make_conn()
+    aconn = AsyncDSAdmin(conn, poll_min=10, poll_max=10)
+    f = aconn.exportLDIF('/tmp/e.ldif', 'o=e1')
+    try:
+        f.result(timeout=0.05)
+        assert False, "the task should not be done"
+    except ldap.TIMEOUT:
+        pass
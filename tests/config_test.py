@@ -13,8 +13,10 @@ import config
 from config import log
 from config import *
 
+import ldap
 import dsadmin
-from dsadmin import DSAdmin, Entry
+from dsadmin import DSAdmin, Entry, DN_CONFIG
+from dsadmin.brooker import Config
 # Test harnesses
 from dsadmin_test import drop_backend, addbackend_harn
 from dsadmin_test import drop_added_entries
@@ -79,3 +81,101 @@ def access_loglevel_test():
     vals = [dsadmin.LOG_CACHE, dsadmin.LOG_REPLICA, dsadmin.LOG_CONNECT]
     assert conn.config.loglevel(vals, level='access') == sum(vals)
 
+
+
+def apply_test():
+    attr = 'nsslapd-accesslog-logbuffering'
+    old = conn.config.get(attr)
+    new = {'on': 'off'}.get(old, 'on')
+    try:
+        # dry run reports the change without writing it
+        changes = conn.config.apply({DN_CONFIG: {attr: new}}, dryrun=True)
+        assert changes == [{'dn': DN_CONFIG, 'action': 'modify',
+                            'mods': [(ldap.MOD_REPLACE, attr, [new])]}], changes
+        assert conn.config.get(attr) == old
+        assert conn.config.apply({DN_CONFIG: {attr: new}})
+        assert conn.config.get(attr) == new
+        # nothing left to do
+        assert conn.config.apply({DN_CONFIG: {attr: new}}) == []
+    finally:
+        conn.config.set(attr, old)
+
+
+def mods_test():
+    entry = Entry(('cn=x', {'a': ['1'], 'b': ['1', '2'], 'c': ['1']}))
+    mods = Config.mods(entry, {'a': 1, 'b': ('2', '1'), 'c': None,
+                               'd': None, 'e': ['x', 'y']})
+    assert sorted(mods) == sorted([(ldap.MOD_DELETE, 'c', None),
+                                   (ldap.MOD_ADD, 'e', ['x', 'y'])]), mods
+    # objectclass is never modified
+    entry = Entry(('cn=x', {'objectclass': ['top', 'extensibleObject'], 'a': ['1']}))
+    assert Config.mods(entry, {'objectclass': ['top', 'nsEncryptionModule'], 'a': '1'}) == []
+    # a case change is a change, but for the known case insensitive attributes
+    entry = Entry(('cn=x', {'nsslapd-security': ['On'],
+                            'nsslapd-errorlog': ['/var/log/Errors']}))
+    assert Config.mods(entry, {'nsslapd-security': 'on'}) == []
+    assert Config.mods(entry, {'nsslapd-errorlog': '/var/log/errors'}) == [
+        (ldap.MOD_REPLACE, 'nsslapd-errorlog', ['/var/log/errors'])]
+
+
+class FakeConn(object):
+    """Answer base searches from a dict {dn: Entry}, record the writes."""
+    def __init__(self, entries, errors=None):
+        self.entries = entries
+        self.errors = errors or {}
+        self.msgids = []
+        self.abandoned = []
+        self.writes = []
+        self.log = log
+
+    def search(self, dn, scope, filt, attrlist):
+        self.msgids.append(dn)
+        return len(self.msgids) - 1
+
+    def result(self, msgid):
+        dn = self.msgids[msgid]
+        if dn in self.errors:
+            raise self.errors[dn]
+        if self.entries.get(dn) is None:
+            raise ldap.NO_SUCH_OBJECT
+        return ldap.RES_SEARCH_RESULT, [self.entries[dn]]
+
+    def abandon(self, msgid):
+        self.abandoned.append(msgid)
+
+    def add_s(self, entry):
+        self.writes.append(('add', entry.dn))
+
+    def modify_s(self, dn, mods):
+        self.writes.append(('modify', dn))
+
+
+def read_error_test():
+    fake = FakeConn({}, {'cn=b': ldap.INSUFFICIENT_ACCESS()})
+    try:
+        Config(fake).read([('cn=a', []), ('cn=b', []), ('cn=c', []), ('cn=d', [])])
+        assert False, "the search error should raise"
+    except ldap.INSUFFICIENT_ACCESS:
+        pass
+    # the unread searches are abandoned
+    assert fake.abandoned == [2, 3], fake.abandoned
+
+
+def enable_ssl_test():
+    dn_rsa = 'cn=RSA,cn=encryption,cn=config'
+    fake = FakeConn({
+        'cn=encryption,cn=config': Entry(('cn=encryption,cn=config', {'nsSSL3': ['off']})),
+        DN_CONFIG: Entry((DN_CONFIG, {'nsslapd-security': ['off']})),
+    })
+    changes = Config(fake).enable_ssl(secport=1636)
+    # one round of searches, then the writes in order
+    assert len(fake.msgids) == 3
+    assert fake.writes == [('modify', 'cn=encryption,cn=config'),
+                           ('add', dn_rsa), ('modify', DN_CONFIG)], fake.writes
+    assert [x['dn'] for x in changes] == [x[1] for x in fake.writes]
+
+    # an existing RSA module is left alone
+    fake.entries[dn_rsa] = Entry((dn_rsa, {'nsSSLPersonalitySSL': ['Other-Cert']}))
+    fake.writes = []
+    changes = Config(fake).enable_ssl(secport=1636)
+    assert dn_rsa not in [x['dn'] for x in changes], changes
@@ -0,0 +1,95 @@
+"""Compare the DN functions based on ldap.explode_dn and str.replace
+    with the dsadmin._dn parser and escaping tables.
+
+    Run with:
+        python tests/dn_bench.py [ncalls]
+"""
+import sys
+import time
+
+import ldap
+from dsadmin._dn import DN, escape_value, escape_filter_value
+
+
+def old_normalizeDN(dn, usespace=False):
+    """The former normalizeDN, without cache"""
+    joinstr = ","
+    if usespace:
+        joinstr = ", "
+    return joinstr.join(ldap.explode_dn(dn.lower()))
+
+
+def new_normalizeDN(dn, usespace=False):
+    joinstr = ","
+    if usespace:
+        joinstr = ", "
+    return DN(dn).format(joinstr)
+
+
+def old_escapeDNValue(dn):
+    for cc in (' ', '"', '+', ',', ';', '<', '>', '='):
+        dn = dn.replace(cc, '\\' + cc)
+    return dn
+
+
+def old_escapeDNFiltValue(dn):
+    for cc in (' ', '"', '+', ',', ';', '<', '>', '='):
+        dn = dn.replace(cc, '\\%x' % ord(cc))
+    return dn
+
+
+def old_suffixfilt(suffix):
+    nsuffix = old_normalizeDN(suffix)
+    spacesuffix = old_normalizeDN(nsuffix, True)
+    escapesuffix = old_escapeDNFiltValue(nsuffix)
+    return '(|(cn=%s)(cn=%s)(cn=%s)(cn="%s")(cn="%s")(cn=%s)(cn="%s"))' % (
+        escapesuffix, nsuffix, spacesuffix, nsuffix, spacesuffix, suffix, suffix)
+
+
+def new_suffixfilt(suffix):
+    dn = DN(suffix)
+    nsuffix = dn.normalized
+    spacesuffix = dn.format(', ')
+    escapesuffix = escape_filter_value(nsuffix)
+    return '(|(cn=%s)(cn=%s)(cn=%s)(cn="%s")(cn="%s")(cn=%s)(cn="%s"))' % (
+        escapesuffix, nsuffix, spacesuffix, nsuffix, spacesuffix, suffix, suffix)
+
+
+DNS = [
+    'dc=example,dc=com',
+    'uid=User1, ou=People, dc=Example, dc=com',
+    'cn="dc=example,dc=com",cn=mapping tree,cn=config',
+    'cn=replica,cn=dc\\3Dexample\\2Cdc\\3Dcom,cn=mapping tree,cn=config',
+    'cn=userRoot,cn=ldbm database,cn=plugins,cn=config',
+]
+VALUES = ['dc=example,dc=com', 'o=NetscapeRoot', 'userRoot', '"dc=example, dc=com"']
+
+BENCHES = [
+    ('normalizeDN', DNS, old_normalizeDN, new_normalizeDN),
+    ('escapeDNValue', VALUES, old_escapeDNValue, escape_value),
+    ('escapeDNFiltValue', VALUES, old_escapeDNFiltValue, escape_filter_value),
+    ('suffixfilt', DNS[:1] + DNS[2:3], old_suffixfilt, new_suffixfilt),
+]
+
+
+def bench(func, args, ncalls):
+    loops = xrange(ncalls / len(args))
+    start = time.time()
+    for i in loops:
+        for arg in args:
+            func(arg)
+    return (time.time() - start) * 1e6 / (len(loops) * len(args))
+
+
+def main(ncalls=200000):
+    print "%-18s %10s %10s %8s" % ('function', 'old us', 'new us', 'speedup')
+    for name, args, old, new in BENCHES:
+        for arg in args:
+            assert old(arg) == new(arg), "%s(%r): %r != %r" % (
+                name, arg, old(arg), new(arg))
+        told, tnew = bench(old, args, ncalls), bench(new, args, ncalls)
+        print "%-18s %10.2f %10.2f %7.1fx" % (name, told, tnew, told / tnew)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:2]])
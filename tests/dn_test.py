@@ -0,0 +1,77 @@
+import ldap
+from dsadmin import DN
+from dsadmin._dn import SuffixTree, parse_dn, escape_dn_value, escape_value, escape_filter_value
+
+
+def parse_dn_test():
+    test = [
+        ('', ()),
+        ('dc=example, dc=com', ((('dc', 'example'),), (('dc', 'com'),))),
+        ('cn=a\\2Cb+sn=x ,o=y', ((('cn', 'a,b'), ('sn', 'x')), (('o', 'y'),))),
+        ('cn="dc=example,dc=com";o=x', ((('cn', 'dc=example,dc=com'),), (('o', 'x'),))),
+        # escaped spaces are kept
+        ('cn=\\ a\\ ,o=x', ((('cn', ' a '),), (('o', 'x'),))),
+    ]
+    for k, v in test:
+        r = parse_dn(k)
+        assert r == v, "Mismatch %r vs %r" % (r, v)
+
+
+def parse_dn_error_test():
+    for dn in ['cn', 'cn=a,', '=x', 'cn=a"b']:
+        try:
+            parse_dn(dn)
+            assert False, "%r should be invalid" % dn
+        except ldap.DECODING_ERROR:
+            pass
+
+
+def DN_test():
+    dn = DN('uid=Joe, ou=People, dc=Example, dc=com')
+    assert dn.normalized == 'uid=joe,ou=people,dc=example,dc=com'
+    assert dn.format(', ', lower=False) == 'uid=Joe, ou=People, dc=Example, dc=com'
+    assert dn.rdn == (('uid', 'Joe'),)
+    assert dn.parent == DN('ou=people,dc=example,dc=com')
+    assert dn.is_descendant_of('DC=example,DC=com')
+    assert dn.is_descendant_of('')
+    assert not dn.is_descendant_of(dn)
+    assert dn.is_descendant_of(dn, strict=False)
+    assert not DN('dc=xexample,dc=com').is_descendant_of('dc=example,dc=com')
+    assert len(set([dn, DN(str(dn)), DN(dn)])) == 1
+    assert str(DN('cn="dc=example,dc=com",cn=config')) == 'cn=dc\\=example\\,dc\\=com,cn=config'
+
+
+def escape_test():
+    test = [
+        (escape_dn_value, ' #a,b ', '\\ #a\\,b\\ '),
+        (escape_dn_value, 'a\\b', 'a\\\\b'),
+        (escape_value, 'plain', 'plain'),
+        (escape_value, 'o=a b', 'o\\=a\\ b'),
+        (escape_filter_value, 'o=a b', 'o\\3da\\20b'),
+    ]
+    for func, k, v in test:
+        r = func(k)
+        assert r == v, "%s: mismatch %r vs %r" % (func.__name__, r, v)
+
+
+def SuffixTree_test():
+    tree = SuffixTree()
+    for suffix in ['dc=example,dc=com', 'ou=People, dc=Example,dc=com',
+                   'o=a,ou=x,ou=people,dc=example,dc=com', 'o=other']:
+        tree.add(suffix, suffix.upper())
+    assert len(tree) == 4
+    assert 'DC=example,dc=com' in tree and 'dc=com' not in tree
+    assert tree.get('o=other') == 'O=OTHER'
+    assert tree.lookup('uid=joe,ou=people,dc=example,dc=com')[0] == 'ou=people,dc=example,dc=com'
+    assert tree.lookup('ou=people,dc=example,dc=com')[0] == 'ou=people,dc=example,dc=com'
+    assert tree.lookup('dc=com') is None
+    assert tree.parent('ou=people,dc=example,dc=com')[0] == 'dc=example,dc=com'
+    assert tree.parent('dc=example,dc=com') is None
+    # intermediate DNs that are not suffixes are skipped
+    assert tree.parent('o=a,ou=x,ou=people,dc=example,dc=com')[0] == 'ou=people,dc=example,dc=com'
+    assert [x[0] for x in tree.children('ou=people,dc=example,dc=com')] == [
+        'o=a,ou=x,ou=people,dc=example,dc=com']
+    assert [x[0] for x in tree.children('')] == ['dc=example,dc=com', 'o=other']
+    assert [x[0] for x in tree.items()] == [
+        'dc=example,dc=com', 'o=a,ou=x,ou=people,dc=example,dc=com',
+        'o=other', 'ou=people,dc=example,dc=com']
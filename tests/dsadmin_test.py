@@ -8,6 +8,7 @@ from config import *
 import ldap
 import time
 import sys
+import os
 import dsadmin
 from dsadmin import DSAdmin, Entry
 from dsadmin import NoSuchEntryError
@@ -238,3 +239,97 @@ def setupSSL_test():
     log.info("Testing ssl configuration")
     ssl_args.update({'dsadmin': conn})
     DSAdminTools.setupSSL(**ssl_args)
+
+
+def iter_search_harn(name, nentries):
+    addbackend_harn(conn, name)
+    suffix = 'o=%s' % name
+    for i in range(nentries):
+        e = Entry(('cn=user%d,%s' % (i, suffix), {
+                   'objectclass': ['top', 'person'],
+                   'cn': ['user%d' % i],
+                   'sn': ['%d' % i]
+                   }))
+        conn.add_s(e)
+        conn.added_entries.append(e.dn)
+    return suffix
+
+
+def iter_search_paged_test():
+    nentries = 50
+    suffix = iter_search_harn('itersearch1', nentries)
+    expected = set([x.dn for x in conn.search_s(
+        suffix, ldap.SCOPE_ONELEVEL, '(objectclass=person)', ['cn'])])
+    assert len(expected) == nentries, "Bad setup: %r" % expected
+    for page_size in (7, nentries, 0):
+        it = conn.iter_search(suffix, ldap.SCOPE_ONELEVEL,
+                              '(objectclass=person)', ['cn'], page_size=page_size)
+        entries = [e for e in it]
+        assert all([isinstance(e, Entry) for e in entries])
+        ret = set([e.dn for e in entries])
+        assert ret == expected, "page_size %d: missing %r" % (
+            page_size, expected - ret)
+
+
+def iter_search_abandon_test():
+    suffix = iter_search_harn('itersearch2', 20)
+    it = conn.iter_search(suffix, page_size=5)
+    e = it.next()
+    assert e.dn
+    it.close()
+    # the connection is still usable after abandoning the search
+    assert conn.getEntry(suffix)
+
+
+def addLDIF_window_test():
+    import tempfile
+    addbackend_harn(conn, 'addldif1')
+    suffix = 'o=addldif1'
+    fd, path = tempfile.mkstemp(suffix='.ldif')
+    out = os.fdopen(fd, 'w')
+    # children follow their parent at once: they must wait for its add
+    parent = 'ou=people,%s' % suffix
+    out.write("dn: %s\nobjectclass: top\nobjectclass: organizationalUnit\n"
+              "ou: people\n\n" % parent)
+    dns = ['cn=user%d,%s' % (i, parent) for i in range(30)]
+    for dn in dns:
+        out.write("dn: %s\nobjectclass: top\nobjectclass: person\n"
+                  "cn: %s\nsn: user\n\n" % (dn, dn.split(',')[0][3:]))
+    # a duplicate entry is skipped with cont=True
+    out.write("dn: %s\nobjectclass: top\nobjectclass: person\n"
+              "cn: user0\nsn: user\n\n" % dns[0])
+    out.close()
+    try:
+        added = conn.addLDIF(path, cont=True, window=8)
+    finally:
+        conn.added_entries.extend([parent] + dns)
+        os.unlink(path)
+    assert added == len(dns) + 1, "Added %r entries" % added
+    for dn in dns:
+        assert conn.getEntry(dn)
+
+
+def watchEntry_test():
+    addbackend_harn(conn, 'watch1')
+    dn = 'cn=watched,o=watch1'
+    entries = conn.watchEntry(dn, timeout=10)
+    assert entries.next() is None
+    e = Entry((dn, {'objectclass': ['top', 'person'],
+                    'cn': ['watched'], 'sn': ['watched']}))
+    conn.add_s(e)
+    conn.added_entries.append(dn)
+    start = time.time()
+    for entry in entries:
+        if entry:
+            break
+    assert entry.dn.lower() == dn, "Bad entry %r" % entry
+    # notified before the polling interval grows
+    assert time.time() - start < 1.5
+    entries.close()
+
+
+def waitForEntry_timeout_test():
+    start = time.time()
+    entry = conn.waitForEntry('cn=missing,o=watch1', timeout=1)
+    assert entry is None
+    assert 1 <= time.time() - start < 3
@@ -0,0 +1,80 @@
+"""Compare memory and throughput of dsadmin.Entry with the former
+    implementation copying every search result into a cidict.
+
+    Run with:
+        python tests/entry_bench.py [nentries]
+"""
+import gc
+import sys
+import time
+
+from ldap.cidict import cidict
+from dsadmin import Entry
+
+DEFAULT_ENTRIES = 500000
+
+
+class LegacyEntry(object):
+    """The pre-slots Entry: a dict per instance and a cidict copy per result"""
+    def __init__(self, entrydata):
+        self.ref = None
+        self.dn = entrydata[0]
+        self.data = cidict(entrydata[1])
+
+    def getValue(self, name):
+        return self.data.get(name, [None])[0]
+
+
+def rss_kb():
+    """Return the resident set size in kB (linux only)."""
+    for line in open('/proc/self/status'):
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1])
+    return 0
+
+
+def synthetic_result(nentries):
+    """A python-ldap like result list of person entries"""
+    ret = []
+    for i in xrange(nentries):
+        uid = 'user%07d' % i
+        ret.append(('uid=%s,ou=People,dc=example,dc=com' % uid, {
+            'objectClass': ['top', 'person', 'organizationalPerson', 'inetOrgPerson'],
+            'uid': [uid],
+            'cn': ['User %d' % i],
+            'sn': ['%d' % i],
+            'mail': ['%s@example.com' % uid],
+        }))
+    return ret
+
+
+def bench(cls, result):
+    gc.collect()
+    before = rss_kb()
+    start = time.time()
+    entries = [cls(x) for x in result]
+    wrapped = time.time() - start
+
+    start = time.time()
+    for e in entries:
+        e.getValue('CN')
+    lookup = time.time() - start
+    used = rss_kb() - before
+    del entries
+    return wrapped, lookup, used
+
+
+def main(nentries=DEFAULT_ENTRIES):
+    result = synthetic_result(nentries)
+    print "%d entries" % nentries
+    print "%-12s %10s %10s %12s" % ('class', 'wrap (s)', 'lookup (s)', 'memory (kB)')
+    for cls in (LegacyEntry, Entry):
+        wrapped, lookup, used = bench(cls, result)
+        print "%-12s %10.3f %10.3f %12d" % (cls.__name__, wrapped, lookup, used)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(int(sys.argv[1]))
+    else:
+        main()
@@ -85,3 +85,22 @@ class TestEntry(object):
         uentry_s, entry_s = map(str, (uentry, entry))
         assert uentry_s == entry_s, "Mismatching entries [%r] vs [%r]" % (
             uentry, entry)
+
+    def test_lazy_data(self):
+        raw = {'O': ['pippo'], 'objectClass': ['organization', 'top']}
+        e = Entry(('o=pippo', raw))
+        # lookups don't materialize the cidict
+        assert e.o == 'pippo'
+        assert e.hasValue('objectclass', 'top')
+        assert e.getValues('missing') == []
+        assert e._data is None
+        # modifications do, and never touch the raw dict
+        e.setValues('description', 'lazy')
+        assert e._data is not None
+        assert e.getValue('DESCRIPTION') == 'lazy'
+        assert 'description' not in raw
+
+    def test_no_instance_dict(self):
+        e = Entry('o=pippo')
+        assert not hasattr(e, '__dict__')
+        assert e.missing is None
@@ -0,0 +1,151 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from dsadmin.errorlog import ErrorLogFollower, parse_line
+from dsadmin.errorlog import STARTED, STOPPED, BIND_CONFLICT
+from dsadmin.tools import DSAdminTools
+
+import logging
+logging.basicConfig(level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+tmpdir = None
+
+
+def setup():
+    global tmpdir
+    tmpdir = tempfile.mkdtemp()
+
+
+def teardown():
+    shutil.rmtree(tmpdir)
+
+
+def append(path, *lines):
+    fp = open(path, 'a')
+    try:
+        for line in lines:
+            fp.write(line)
+    finally:
+        fp.close()
+
+
+def parse_line_test():
+    event = parse_line('[18/Oct/2013:10:00:00 +0200] - slapd started.  Listening on All Interfaces port 389 for LDAP requests\n')
+    assert event.kind == STARTED
+    assert event.when == '18/Oct/2013:10:00:00 +0200'
+    assert parse_line('[18/Oct/2013:10:00:00 +0200] - slapd shutting down - signaling operation threads\n') is None
+    assert parse_line("PR_Bind() on All Interfaces port 389 failed\n").kind == BIND_CONFLICT
+
+
+def follower_test():
+    path = os.path.join(tmpdir, 'errors')
+    append(path, '[old] - slapd started.\n')
+    follower = ErrorLogFollower(path)
+    try:
+        # existing lines are skipped, partial lines wait for their end
+        assert follower.read_lines() == []
+        append(path, 'first\n', 'sec')
+        assert follower.read_lines() == ['first\n']
+        append(path, 'ond\n')
+        assert follower.read_lines() == ['second\n']
+        # events() returns after the timeout
+        start = time.time()
+        assert list(follower.events(timeout=0.2)) == []
+        assert time.time() - start >= 0.2
+    finally:
+        follower.close()
+
+
+def follower_wakeup_test():
+    path = os.path.join(tmpdir, 'errors2')
+    append(path, '')
+    follower = ErrorLogFollower(path)
+    try:
+        timer = threading.Timer(0.2, append, (path, '[now] - slapd stopped.\n'))
+        timer.start()
+        start = time.time()
+        for event in follower.events(timeout=5):
+            break
+        assert event.kind == STOPPED and event.when == 'now'
+        assert time.time() - start < 1, "woke up late"
+    finally:
+        follower.close()
+
+
+def follower_rotation_test():
+    path = os.path.join(tmpdir, 'errors3')
+    append(path, 'before\n')
+    follower = ErrorLogFollower(path)
+    try:
+        os.rename(path, path + '.1')
+        append(path, 'after\n')
+        assert follower.read_lines() == ['after\n']
+    finally:
+        follower.close()
+
+
+class FakeInstance(object):
+    """An instance directory whose start script writes the errors log."""
+    def __init__(self, name, message='slapd started.'):
+        self.sroot = tmpdir
+        self.inst = name
+        self.initialized = False
+        instdir = os.path.join(tmpdir, 'slapd-' + name)
+        os.makedirs(os.path.join(instdir, 'logs'))
+        self.errlog = os.path.join(instdir, 'logs', 'errors')
+        append(self.errlog, '')
+        script = os.path.join(instdir, 'start-slapd')
+        append(script, "#!/bin/sh\n(sleep 0.3; echo '[now] - %s' >> %s) &\n" % (
+            message, self.errlog))
+        os.chmod(script, 0755)
+
+    def __localinit__(self):
+        self.initialized = True
+
+    def unbind(self):
+        pass
+
+
+def serverCmd_test():
+    inst = FakeInstance('one')
+    start = time.time()
+    assert DSAdminTools.serverCmd(inst, 'start', False, 10) == 0
+    assert inst.initialized
+    assert time.time() - start < 2
+
+
+def serverCmd_bind_conflict_test():
+    inst = FakeInstance('conflict', 'PR_Bind() on All Interfaces port 389 failed')
+    assert DSAdminTools.serverCmd(inst, 'start', False, 10) == 1
+    assert not inst.initialized
+
+
+def serverCmdAsync_test():
+    insts = [FakeInstance('async%d' % i) for i in range(4)]
+    start = time.time()
+    futures = [DSAdminTools.serverCmdAsync(x, 'start', timeout=10) for x in insts]
+    assert [f.result(10) for f in futures] == [0] * 4
+    # the starts overlap
+    assert time.time() - start < 1.2
+
+
+def follower_recreated_test():
+    path = os.path.join(tmpdir, 'errors4')
+    append(path, 'before\n')
+    follower = ErrorLogFollower(path)
+    try:
+        # the new log is created after the old one is moved away
+        os.rename(path, path + '.1')
+        timer = threading.Timer(0.3, append, (path, '[now] - slapd started.\n'))
+        timer.start()
+        start = time.time()
+        for event in follower.events(timeout=5):
+            break
+        assert event.kind == STARTED
+        assert time.time() - start < 1, "woke up late"
+    finally:
+        follower.close()
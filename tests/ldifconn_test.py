@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+from dsadmin._ldifconn import LDIFConn, LDIFIndex, iter_ldif, get_ldif_entry
+
+import logging
+logging.basicConfig(level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+LDIF = """dn: cn=config
+cn: config
+nsslapd-instancedir: /usr/lib64/dirsrv/slapd-test
+
+dn: cn=ldbm database,cn=plugi
+ ns,cn=config
+cn: ldbm database
+
+dn:: Y249bW9uaXRvcixjbj1jb25maWc=
+cn: monitor
+"""
+DNS = ['cn=config', 'cn=ldbm database,cn=plugins,cn=config', 'cn=monitor,cn=config']
+
+ldif_path = None
+
+
+def setup():
+    global ldif_path
+    fd, ldif_path = tempfile.mkstemp(suffix='.ldif')
+    os.write(fd, LDIF)
+    os.close(fd)
+
+
+def teardown():
+    os.unlink(ldif_path)
+
+
+def iter_ldif_test():
+    ret = [e.dn for e in iter_ldif(ldif_path)]
+    expected = [e.dn for e in LDIFConn(ldif_path).dnlist]
+    assert ret == expected == DNS, "Mismatch %r vs %r" % (ret, expected)
+
+
+def get_ldif_entry_test():
+    e = get_ldif_entry(ldif_path, 'CN=Config')
+    assert e.getValue('nsslapd-instancedir') == '/usr/lib64/dirsrv/slapd-test'
+    assert not get_ldif_entry(ldif_path, 'cn=missing')
+
+
+def get_ldif_entry_nodn_test():
+    fd, path = tempfile.mkstemp(suffix='.conf')
+    os.write(fd, "ldapurl: ldap://localhost:389/o=NetscapeRoot\nSuiteSpotUserID: nobody\n")
+    os.close(fd)
+    try:
+        e = get_ldif_entry(path, '')
+        assert e.SuiteSpotUserID == 'nobody', "Bad entry %r" % e
+    finally:
+        os.unlink(path)
+
+
+def ldif_index_test():
+    index = LDIFIndex(ldif_path)
+    for dn in DNS:
+        assert index.get(dn).dn == dn
+    assert 'cn=monitor, cn=config' in index
+    assert not index.get('cn=missing')
+
+
+def ldif_index_file_test():
+    indexfile = tempfile.mktemp()
+    try:
+        LDIFIndex(ldif_path, indexfile).close()
+        # reuse the stored index
+        index = LDIFIndex(ldif_path, indexfile)
+        assert index.get(DNS[1]).cn == 'ldbm database'
+        index.close()
+    finally:
+        for ext in ('', '.db', '.dat', '.dir', '.bak'):
+            if os.path.exists(indexfile + ext):
+                os.unlink(indexfile + ext)
@@ -0,0 +1,199 @@
+from dsadmin import Entry
+from dsadmin.monitor import DBStats, DN_LDBM_MONITOR, DN_LDBM_DATABASE
+from dsadmin.monitor import RingBuffer, Sampler
+from nose.tools import raises
+
+import logging
+logging.basicConfig(level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+
+def monitor_entries(n=1):
+    """The ldbm monitor entries after n units of load."""
+    ldbmmon = Entry((DN_LDBM_MONITOR, {
+        'dbcachehits': [str(90 * n)], 'dbcachetries': [str(100 * n)],
+        'dbcachehitratio': ['90'], 'dbcachepagein': [str(10 * n)],
+        'dbcachepageout': [str(2 * n)], 'dbcacheroevict': ['0'],
+        'dbcacherwevict': ['0'],
+    }))
+    dbdb = Entry((DN_LDBM_DATABASE, {
+        'nsslapd-db-abort-rate': ['0'], 'nsslapd-db-cache-size-bytes': ['10485760'],
+    }))
+    bemon = Entry(("cn=monitor,cn=userRoot,cn=ldbm database,cn=plugins,cn=config", {
+        'entrycachehits': [str(50 * n)], 'entrycachetries': [str(100 * n)],
+        'entrycachehitratio': ['50'], 'currententrycachesize': ['2000'],
+        'maxentrycachesize': ['10000'], 'currententrycachecount': ['10'],
+        'dncachehits': [str(99 * n)], 'dncachetries': [str(100 * n)],
+        'dncachehitratio': ['99'], 'currentdncachesize': ['100'],
+        'maxdncachesize': ['1000'], 'currentdncachecount': ['10'],
+        'entrycache-hashtables': ['slot stats'],
+        'dbfilename-0': ['userRoot/id2entry.db4'], 'dbfilecachehit-0': [str(5 * n)],
+        'dbfilecachemiss-0': [str(n)], 'dbfilepagein-0': [str(4 * n)],
+        'dbfilepageout-0': ['0'],
+        'dbfilename-1': ['userRoot/entryrdn.db4'], 'dbfilecachehit-1': ['3'],
+        'dbfilecachemiss-1': ['0'], 'dbfilepagein-1': ['0'],
+        'dbfilepageout-1': ['0'],
+    }))
+    return [ldbmmon, dbdb, bemon]
+
+
+def parse_test():
+    stats = DBStats(monitor_entries(), when=100)
+    assert stats.dbcache['pagein'] == 10
+    assert stats.db['cache-size-bytes'] == 10485760
+    be = stats.backends['userRoot']
+    # backend names are case insensitive
+    assert stats.backends['userroot'] is be
+    assert be.entrycache.hitratio == 50
+    assert be.entrycache.available() == 8000
+    assert be.dncache.hits == 99
+    assert sorted(be.files) == ['entryrdn.db4', 'id2entry.db4']
+    assert be.files['id2entry.db4'].pagein == 4
+
+
+def delta_test():
+    prev = DBStats(monitor_entries(1), when=100)
+    cur = DBStats(monitor_entries(3), when=110)
+    rates = cur.delta(prev)
+    assert rates['interval'] == 10
+    assert rates['dbcache']['pagein_rate'] == 2.0
+    assert rates['dbcache']['hitratio'] == 90.0
+    be = rates['backends']['userRoot']
+    assert be['entrycache']['hitratio'] == 50.0
+    assert be['files']['id2entry.db4']['pagein_rate'] == 0.8
+
+
+def delta_reset_test():
+    # a restart resets the counters
+    prev = DBStats(monitor_entries(3), when=100)
+    cur = DBStats(monitor_entries(1), when=110)
+    assert cur.delta(prev)['dbcache']['pagein_rate'] == 1.0
+
+
+@raises(ValueError)
+def delta_order_test():
+    prev = DBStats(monitor_entries(), when=100)
+    DBStats(monitor_entries(), when=100).delta(prev)
+
+
+def prometheus_test():
+    text = DBStats(monitor_entries()).to_prometheus(labels={'instance': 'ldap1:389'})
+    assert '# TYPE dirsrv_ldbm_dbcache_pagein_total counter' in text
+    assert 'dirsrv_ldbm_dbcache_pagein_total{instance="ldap1:389"} 10\n' in text
+    # gauges keep their name
+    assert 'dirsrv_ldbm_entrycache_hitratio{backend="userRoot",instance="ldap1:389"} 50\n' in text
+    assert '# TYPE dirsrv_ldbm_entrycache_hitratio gauge' in text
+    assert 'dirsrv_ldbm_dbfile_pagein_total{backend="userRoot",file="id2entry.db4",instance="ldap1:389"} 4\n' in text
+    assert 'dirsrv_ldbm_entrycache_hitratio_total' not in text
+
+
+def json_test():
+    from dsadmin.monitor import json
+    stats = DBStats(monitor_entries(), when=100)
+    data = json.loads(stats.to_json())
+    assert data['backends']['userRoot']['entrycache']['count'] == 10
+    assert data['time'] == 100
+
+
+def format_test():
+    text = DBStats(monitor_entries()).format('userRoot')
+    assert DBStats(monitor_entries()).format('USERROOT') == text
+    assert text.startswith("cache   available ratio    count unitsize\n")
+    assert "entry        8000    50       10   200" in text
+    assert "id2entry.db4" in text
+
+
+def ringbuffer_test():
+    buf = RingBuffer(3)
+    assert buf.values() == []
+    assert buf.last() != buf.last()  # NaN
+    for i in range(5):
+        buf.append(i)
+    assert len(buf) == 3
+    assert buf.values() == [2.0, 3.0, 4.0]
+    assert buf.last() == 4.0
+
+
+class MonitorConn(object):
+    """Answers the Sampler searches with growing counters."""
+    def __init__(self):
+        self.n = 0
+
+    def getEntry(self, dn, scope):
+        self.n += 1
+        return Entry(('cn=monitor', {
+            'opscompleted': [str(100 * self.n)],
+            'currentconnections': [str(self.n % 4)],
+            'version': ['389-Directory/1.2.11'],
+        }))
+
+    def search_s(self, base, scope, filt, attrs=None):
+        if 'nsds5ReplicationAgreement' in filt:
+            return [Entry(('cn=meTo_host:389,cn=replica,cn=o\\3Dx,cn=mapping tree,cn=config', {
+                'cn': ['meTo_host:389'], 'nsDS5ReplicaRoot': ['o=x'],
+                'nsds5replicaChangesSentSinceStartup': ['1:%d/0 2:5/0' % self.n],
+                'nsds5replicaUpdateInProgress': ['FALSE'],
+            }))]
+        return monitor_entries(self.n)
+
+
+def sampler_test():
+    sampler = Sampler(MonitorConn(), size=4)
+    for i in range(6):
+        sampler.add(sampler.read(), when=10 * i)
+    assert 'monitor.version' not in sampler.metrics()
+    times, values = sampler.history('monitor.opscompleted')
+    assert times == [20, 30, 40, 50]
+    assert values == [300, 400, 500, 600]
+    assert sampler.rate('monitor.opscompleted') == 10.0
+    assert sampler.last('agmt.o=x.meTo_host:389.changes_sent') == 11
+    assert sampler.last('ldbm.dbcache.pagein') == 60
+    assert sampler.percentile('monitor.currentconnections', 50) == 1.5
+
+
+def sampler_new_metric_test():
+    sampler = Sampler(None, size=4)
+    sampler.add({'a': 1}, when=1)
+    sampler.add({'a': 2, 'b': 5}, when=2)
+    values = sampler.history('b')[1]
+    assert values[0] != values[0] and values[1] == 5
+    assert sampler.history('a')[1] == [1, 2]
+
+
+def sampler_thread_test():
+    import time
+    sampler = Sampler(MonitorConn(), interval=0.01, size=10)
+    sampler.start()
+    time.sleep(0.2)
+    sampler.stop()
+    assert len(sampler.times) == 10
+    assert not sampler.errors
+
+
+def sampler_drop_metric_test():
+    sampler = Sampler(None, size=4)
+    sampler.add({'a': 1, 'b': 1}, when=1)
+    for i in range(3):
+        sampler.add({'a': 1}, when=2 + i)
+    assert 'b' in sampler.metrics()
+    # missing from a whole ring
+    sampler.add({'a': 1}, when=5)
+    assert sampler.metrics() == ['a']
+    sampler.add({'a': 1, 'b': 2}, when=6)
+    assert sampler.history('b')[1][-1] == 2
+
+
+class BrokenConn(MonitorConn):
+    def getEntry(self, dn, scope):
+        raise ValueError("unexpected counter")
+
+
+def sampler_thread_error_test():
+    import time
+    sampler = Sampler(BrokenConn(), interval=0.01, size=10)
+    sampler.start()
+    time.sleep(0.1)
+    # the thread survives the errors
+    assert sampler.thread.isAlive()
+    sampler.stop()
+    assert sampler.errors > 1
@@ -0,0 +1,55 @@
+"""Normalize DNs drawn from a skewed distribution, as the suffix and
+    backend lookups do, with and without the normalizeDN cache.
+
+    Run with:
+        python tests/normalizedn_bench.py [ncalls] [ndistinct]
+"""
+import random
+import sys
+import time
+
+import ldap
+from dsadmin.utils import normalizeDN
+
+
+def uncached_normalizeDN(dn, usespace=False):
+    """The former normalizeDN"""
+    ary = ldap.explode_dn(dn.lower())
+    joinstr = ","
+    if usespace:
+        joinstr = ", "
+    return joinstr.join(ary)
+
+
+def skewed_dns(ncalls, ndistinct):
+    """A few suffixes and config entries are very hot, user entries are not"""
+    population = ['dc=example,dc=com', 'o=NetscapeRoot', 'cn=config',
+                  'cn=ldbm database,cn=plugins,cn=config',
+                  'cn="dc=example,dc=com",cn=mapping tree,cn=config']
+    for i in range(len(population), ndistinct):
+        population.append('uid=User%d, ou=People, dc=Example, dc=com' % i)
+    rnd = random.Random(42)
+    ret = []
+    for i in xrange(ncalls):
+        # pareto index: the first elements are picked most of the times
+        idx = int(rnd.paretovariate(0.6)) - 1
+        ret.append(population[idx % ndistinct])
+    return ret
+
+
+def main(ncalls=1000000, ndistinct=100000):
+    dns = skewed_dns(ncalls, ndistinct)
+    print "%d calls on %d distinct dns (%d used)" % (
+        ncalls, ndistinct, len(set(dns)))
+    for func in (uncached_normalizeDN, normalizeDN):
+        start = time.time()
+        for dn in dns:
+            func(dn)
+        elapsed = time.time() - start
+        print "%-22s %8.3fs %8.2fus/call" % (
+            func.__name__, elapsed, elapsed * 1e6 / ncalls)
+    print "cache: %r" % normalizeDN.cache.stats()
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])
@@ -0,0 +1,137 @@
+from dsadmin import DsError, InvalidArgumentError
+from dsadmin import MASTER_TYPE, HUB_TYPE, LEAF_TYPE
+from dsadmin.plan import TopologyPlan, CONSUMER_RID
+
+import threading
+import logging
+logging.basicConfig(level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+SUFFIX = 'dc=example,dc=com'
+calls = []
+calls_lock = threading.Lock()
+
+
+def record(*args):
+    calls_lock.acquire()
+    try:
+        calls.append(args)
+    finally:
+        calls_lock.release()
+
+
+class FakeReplica(object):
+    def __init__(self, conn):
+        self.conn = conn
+
+    def changelog(self, dbname='changelogdb', verify=True):
+        assert not verify
+        record('changelog', self.conn.name)
+
+    def add(self, suffix, binddn, bindpw, rtype=MASTER_TYPE, rid=None, verify=True, **kwargs):
+        assert not verify
+        record('replica', self.conn.name, rtype, rid)
+
+    def agreement_add(self, consumer, suffix=None, binddn=None, bindpw=None, verify=True, **kwargs):
+        assert not verify
+        if self.conn.fail:
+            raise DsError("agreement failed")
+        record('agreement', self.conn.name, consumer.name)
+        return 'cn=meTo_%s,cn=replica' % consumer.name
+
+    def init_many(self, agmtdns, **kwargs):
+        record('init', self.conn.name, tuple(agmtdns))
+        return dict([(dn, {'rc': 0}) for dn in agmtdns])
+
+
+class FakeConn(object):
+    def __init__(self, name, fail=False):
+        self.name = name
+        self.fail = fail
+        self.replica = FakeReplica(self)
+
+    def getBackendsForSuffix(self, suffix):
+        return []
+
+    def addSuffix(self, suffix):
+        record('suffix', self.name)
+
+    def setupBindDN(self, binddn, bindpw, attrs=None, verify=True):
+        assert not verify
+        record('binddn', self.name)
+
+    def __str__(self):
+        return self.name
+
+
+def make_plan(masters, consumers):
+    plan = TopologyPlan('cn=replrepl,cn=config', 'password')
+    for rid, m in enumerate(masters):
+        plan.add_replica(m, SUFFIX, MASTER_TYPE, rid + 1)
+    for c in consumers:
+        plan.add_replica(c, SUFFIX, LEAF_TYPE)
+    plan.full_mesh(SUFFIX, masters)
+    plan.hub_spoke(SUFFIX, masters[:1], consumers, init=True)
+    return plan
+
+
+def validate_test():
+    m1, m2, c1 = FakeConn('m1'), FakeConn('m2'), FakeConn('c1')
+    plan = make_plan([m1, m2], [c1])
+    plan.validate()
+    assert plan.replicas[(c1, SUFFIX)]['rid'] == CONSUMER_RID
+    # collect all the problems at once
+    plan.add_replica(m2, SUFFIX, MASTER_TYPE, 1)
+    plan.add_replica(FakeConn('h1'), SUFFIX, 'boss')
+    plan.add_agreement(c1, m1, SUFFIX)
+    plan.add_agreement(m1, m1, SUFFIX)
+    plan.add_agreement(m1, m2, SUFFIX)
+    plan.add_agreement(m1, FakeConn('x'), SUFFIX)
+    try:
+        plan.validate()
+        assert False, "plan should be invalid"
+    except InvalidArgumentError, e:
+        msg = str(e)
+    for expected in ('already used', 'bad role', 'the supplier is a consumer',
+                     'supplier and consumer are the same', 'planned twice',
+                     'no replica planned on the consumer'):
+        assert expected in msg, "%r not in %r" % (expected, msg)
+
+
+def execute_test():
+    del calls[:]
+    masters = [FakeConn('m%d' % i) for i in range(3)]
+    consumers = [FakeConn('c%d' % i) for i in range(4)]
+    plan = make_plan(masters, consumers)
+    plan.add_replica(FakeConn('h0'), SUFFIX, HUB_TYPE)
+    timings = plan.execute()
+    for phase in TopologyPlan.PHASES:
+        assert len(timings[phase]['servers']) == 8
+    # phases do not overlap
+    kinds = [x[0] for x in calls]
+    last = dict([(k, i) for i, k in enumerate(kinds)])
+    first = {}
+    for i, k in enumerate(kinds):
+        first.setdefault(k, i)
+    assert last['binddn'] < first['replica']
+    assert last['replica'] < first['agreement']
+    assert last['agreement'] < first['init']
+    # no changelog on consumers
+    assert sorted([x[1] for x in calls if x[0] == 'changelog']) == ['h0', 'm0', 'm1', 'm2']
+    assert len([x for x in calls if x[0] == 'agreement']) == 6 + 4
+    inits = [x for x in calls if x[0] == 'init']
+    assert len(inits) == 1 and inits[0][1] == 'm0' and len(inits[0][2]) == 4
+
+
+def execute_error_test():
+    del calls[:]
+    m1, m2 = FakeConn('m1', fail=True), FakeConn('m2')
+    plan = make_plan([m1, m2], [])
+    try:
+        plan.execute()
+        assert False, "execute should fail"
+    except DsError, e:
+        assert 'agreements' in str(e) and 'm1' in str(e)
+    # the other server completed its phase, no init was attempted
+    assert ('agreement', 'm2', 'm1') in calls
+    assert not [x for x in calls if x[0] == 'init']
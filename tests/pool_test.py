@@ -0,0 +1,94 @@
+"""Test DSAdminPool against the configured instance."""
+from __future__ import with_statement
+
+from nose.tools import *
+
+import config
+from config import log
+from config import *
+
+import threading
+import ldap
+import dsadmin
+from dsadmin import DsError
+from dsadmin.pool import DSAdminPool
+
+pool = None
+
+
+def setup():
+    global pool
+    pool = DSAdminPool(size=4, **config.auth)
+
+
+def teardown():
+    pool.close()
+
+
+def checkout_test():
+    with pool.connection() as conn:
+        e = conn.getEntry(dsadmin.DN_CONFIG)
+        assert e.dn
+
+
+def nested_checkout_test():
+    with pool.connection() as conn:
+        with pool.connection() as conn2:
+            assert conn is conn2
+    assert pool._idle.qsize() == pool.size
+
+
+@raises(DsError)
+def exhausted_test():
+    taken = threading.Semaphore(0)
+    release = threading.Event()
+
+    def hold():
+        with pool.connection():
+            taken.release()
+            release.wait()
+    threads = [threading.Thread(target=hold) for i in range(pool.size)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        taken.acquire()
+    try:
+        pool.get(timeout=0.5)
+    finally:
+        release.set()
+        for t in threads:
+            t.join()
+
+
+def rebind_test():
+    with pool.connection() as conn:
+        conn.unbind_s()
+    # check every connection on checkout
+    pool.check_interval = -1
+    try:
+        for i in range(pool.size):
+            with pool.connection() as conn:
+                assert conn.getEntry(dsadmin.DN_CONFIG)
+    finally:
+        pool.check_interval = 30
+
+
+def stress_test():
+    nthreads, ncalls = 32, 50
+    errors = []
+
+    def worker():
+        try:
+            for i in range(ncalls):
+                with pool.connection(timeout=60) as conn:
+                    conn.getEntry(dsadmin.DN_CONFIG, attrlist=['cn'])
+        except Exception, e:
+            log.exception("worker failed")
+            errors.append(e)
+    threads = [threading.Thread(target=worker) for i in range(nthreads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, "Errors: %r" % errors
+    assert pool._idle.qsize() == pool.size
@@ -171,6 +171,15 @@ def status_test():
     assert status
 
 
+def status_all_test():
+    statuses = conn.replica.status_all()
+    dns = [x.dn.lower() for x in statuses]
+    assert conn.agreement_dn.lower() in dns, "Missing agreement %r" % dns
+    st = statuses[dns.index(conn.agreement_dn.lower())]
+    assert str(st) == conn.replica.status(conn.agreement_dn)
+    assert isinstance(st.changes_sent, int)
+
+
 def list_test():
     # was get_entries_test():
     replicas = conn.replica.list()
@@ -212,6 +221,14 @@ def wait_for_init_test():
     raise NotImplementedError()
 
 
+def init_many_test():
+    results = conn.replica.init_many([conn.agreement_dn], max_parallel=2)
+    result = results[conn.agreement_dn]
+    assert result['rc'] == 0, "Init failed %r" % result
+    assert result['attempts'] >= 1
+    assert result['elapsed'] >= 0
+
+
 def setup_agreement_default_test():
     user = {
         'binddn': DN_RMANAGER,
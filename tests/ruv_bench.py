@@ -0,0 +1,110 @@
+"""Parse and compare the RUVs of a big topology, with the former
+    regex/dict CSN and RUV and with the packed key arrays.
+
+    Run with:
+        python tests/ruv_bench.py [nservers] [nrids] [nrounds]
+"""
+import random
+import re
+import sys
+import time
+
+from dsadmin import Entry
+from dsadmin._replication import RUV, align
+
+
+class LegacyCSN(object):
+    """The former CSN: a regex and four ints"""
+    csnre = re.compile(r'(.{8})(.{4})(.{4})(.{4})')
+
+    def __init__(self, csnstr):
+        match = LegacyCSN.csnre.match(csnstr)
+        self.csnstr = csnstr
+        self.ts = self.seq = self.rid = self.subseq = 0
+        if match:
+            self.ts = int(match.group(1), 16)
+            self.seq = int(match.group(2), 16)
+            self.rid = int(match.group(3), 16)
+            self.subseq = int(match.group(4), 16)
+
+    def __cmp__(self, oth):
+        if self is oth:
+            return 0
+        diff = (oth.ts - self.ts or oth.seq - self.seq or
+                oth.rid - self.rid or oth.subseq - self.subseq)
+        if diff > 0:
+            return 1
+        elif diff < 0:
+            return -1
+        return 0
+
+
+class LegacyRUV(object):
+    """The former RUV: a dict of dicts of CSN"""
+    re_gen = re.compile(r'\{replicageneration\}\s+(\w+)')
+    re_ruv = re.compile(r'\{replica\s+(\d+)\s+(.+?)\}\s*(\w*)\s*(\w*)')
+
+    def __init__(self, ent):
+        self.rid = {}
+        for item in ent.getValues('nsds50ruv'):
+            matchgen = LegacyRUV.re_gen.match(item)
+            matchruv = LegacyRUV.re_ruv.match(item)
+            if matchgen:
+                self.gen = LegacyCSN(matchgen.group(1))
+            elif matchruv:
+                self.rid[int(matchruv.group(1))] = {
+                    'url': matchruv.group(2),
+                    'min': LegacyCSN(matchruv.group(3)),
+                    'max': LegacyCSN(matchruv.group(4))}
+
+    def lags(self, oth):
+        return dict([(rid, oth.rid[rid]['max'].ts - elem['max'].ts)
+                     for rid, elem in self.rid.items() if rid in oth.rid])
+
+
+def ruv_entries(nservers, nrids):
+    rnd = random.Random(42)
+    now = int(time.time())
+    ret = []
+    for i in range(nservers):
+        vals = ['{replicageneration} 51dc3bac000000010000']
+        for rid in range(1, nrids + 1):
+            vals.append('{replica %d ldap://m%d.example.com:389} %08x%04x%04x0000 %08x%04x%04x0000' % (
+                rid, rid, now - 86400, 0, rid, now - rnd.randint(0, 600),
+                rnd.randint(0, 10), rid))
+        ret.append(Entry(('nsuniqueid=ffffffff-ffffffff-ffffffff-ffffffff,dc=example,dc=com',
+                          {'nsds50ruv': vals})))
+    return ret
+
+
+def legacy_round(entries):
+    ruvs = [LegacyRUV(e) for e in entries]
+    for a in ruvs:
+        for b in ruvs:
+            a.lags(b)
+
+
+def packed_round(entries):
+    ruvs = [RUV(e) for e in entries]
+    rids, rows = align(ruvs)
+    rows = [[key >> 32 for key in row] for row in rows]
+    for a in rows:
+        for b in rows:
+            [y - x for x, y in zip(a, b)]
+
+
+def main(nservers=12, nrids=12, nrounds=200):
+    entries = ruv_entries(nservers, nrids)
+    print "%d servers, %d replica IDs, %d rounds of parse + all pair lags" % (
+        nservers, nrids, nrounds)
+    for func in (legacy_round, packed_round):
+        start = time.time()
+        for i in xrange(nrounds):
+            func(entries)
+        elapsed = time.time() - start
+        print "%-14s %8.3fs %8.2fms/round" % (
+            func.__name__, elapsed, elapsed * 1e3 / nrounds)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:4]])
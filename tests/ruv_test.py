@@ -0,0 +1,155 @@
+from dsadmin import Entry, NoSuchEntryError
+from dsadmin._replication import RUV, CSN, ReplicationTopology
+from dsadmin._replication import csn_key, parse_csns, align
+from dsadmin._replication import AgreementStatus, changes_by_rid, changes_sent
+
+import time
+import logging
+logging.basicConfig(level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+GEN = '{replicageneration} 51dc3bac000000010000'
+
+
+def make_ruv(*maxts):
+    """A RUV with one element per replica ID 1..n and the given max ts."""
+    vals = [GEN]
+    for rid, ts in enumerate(maxts):
+        if ts is not None:
+            vals.append('{replica %d ldap://m%d:389} 51dc3bac000000%02x0000 %08x0000%04x0000' % (
+                rid + 1, rid + 1, rid + 1, ts, rid + 1))
+    return RUV(Entry(('nsuniqueid=ffffffff-ffffffff-ffffffff-ffffffff,o=x',
+                      {'nsds50ruv': vals})))
+
+
+def csn_test():
+    csn = CSN('51dc3bac000300020000')
+    assert (csn.ts, csn.seq, csn.rid, csn.subseq) == (0x51dc3bac, 3, 2, 0)
+    assert csn.key == 0x51dc3bac00030002
+    assert CSN.fromkey(csn.key) == csn
+    # invalid or empty CSNs have key 0
+    assert csn_key('') == 0 and csn_key('zz') == 0
+    assert not CSN('').ts and repr(CSN('')) == ''
+    keys = parse_csns(['51dc3bac000000010000', '51dc3bad000000010000'])
+    assert keys[0] < keys[1]
+
+
+def ruv_arrays_test():
+    ruv = make_ruv(1000, None, 990)
+    assert list(ruv.rids) == [1, 3]
+    assert ruv.maxs[1] >> 32 == 990
+    keys = ruv.keys([2, 3], 'max')
+    assert keys[0] == 0 and keys[1] >> 32 == 990
+    # the dict view is still there
+    assert ruv.rid[1]['max'].ts == 1000
+    assert ruv.rid[1]['url'] == 'ldap://m1:389'
+    rids, rows = align([make_ruv(1000), make_ruv(1000, 5)])
+    assert rids == [1, 2]
+    assert rows[0][1] == 0 and rows[1][1] >> 32 == 5
+
+
+def ruv_cmp_test():
+    old, new = make_ruv(1000, 990), make_ruv(1000, 995)
+    assert old == make_ruv(1000, 990)
+    # as CSN, cmp is 1 when the second one is newer
+    assert cmp(old, new) == 1 and cmp(new, old) == -1
+    diff, text = old.getdiffs(new)
+    assert diff == 1
+    assert 'rid 2 maxcsn is behind by 0:00:05' in text
+
+
+def ruv_lastmod_test():
+    ruv = RUV(Entry(('o=x', {
+        'nsds50ruv': [GEN, '{replica 1 ldap://m1:389} 51dc3bac000000010000 51dc3bad000000010000'],
+        'nsruvReplicaLastModified': ['{replica 1 ldap://m1:389} 51dc3bae'],
+    })))
+    assert ruv.rid[1]['lastmod'] == 0x51dc3bae
+
+
+def changes_sent_test():
+    assert changes_sent('12') == 12
+    assert changes_sent('1:10/0 2:5/3') == 15
+    assert changes_by_rid('1:10/0 2:5/3') == {1: (10, 0), 2: (5, 3)}
+    assert changes_by_rid('12') == {}
+
+
+def agreement_status_test():
+    import datetime
+    st = AgreementStatus(Entry(('cn=meTo_m2:389,cn=replica,cn=o\\3Dx,cn=mapping tree,cn=config', {
+        'cn': ['meTo_m2:389'], 'nsDS5ReplicaRoot': ['o=x'],
+        'nsDS5ReplicaHost': ['m2'], 'nsDS5ReplicaPort': ['389'],
+        'nsds5replicaUpdateInProgress': ['FALSE'],
+        'nsds5replicaLastUpdateStart': ['20130415120023Z'],
+        'nsds5replicaLastUpdateEnd': ['0'],
+        'nsds5replicaChangesSentSinceStartup': ['1:10/0 2:5/3'],
+        'nsds5replicaLastUpdateStatus': ['0 Replica acquired successfully: Incremental update succeeded'],
+        'nsds5ReplicaLastInitStatus': ['0 Total update succeeded'],
+    })))
+    assert st.port == 389
+    assert not st.update_in_progress and not st.init_in_progress
+    assert st.last_update_start == datetime.datetime(2013, 4, 15, 12, 0, 23)
+    assert st.last_update_end is None
+    assert st.last_update_code == 0
+    assert st.changes_sent == 15 and st.changes_by_rid[2] == (5, 3)
+    text = str(st)
+    assert text.startswith("Status for meTo_m2:389 agmt m2:389\n")
+    assert "Num. Changes Sent: 1:10/0 2:5/3\n" in text
+    assert "Reap Active: None\n" in text
+
+
+class FakeReplica(object):
+    def __init__(self, ruv, delay):
+        self._ruv = ruv
+        self.delay = delay
+
+    def ruv(self, suffix, tryrepl=False):
+        time.sleep(self.delay)
+        if self._ruv is None:
+            raise NoSuchEntryError("RUV not found: suffix: %r" % suffix)
+        return self._ruv
+
+
+class FakeConn(object):
+    """Stands for a DSAdmin: only conn.replica.ruv is used."""
+    def __init__(self, name, ruv, delay=0.0):
+        self.name = name
+        self.replica = FakeReplica(ruv, delay)
+
+    def __str__(self):
+        return self.name
+
+
+def lag_test():
+    conns = [FakeConn('m1:389', make_ruv(1000, 990)),
+             FakeConn('m2:389', make_ruv(995, 1000)),
+             FakeConn('m3:389', make_ruv(1000, None))]
+    topo = ReplicationTopology(conns, 'o=x').fetch()
+    assert not topo.errors
+    matrix = topo.lag_matrix()
+    assert matrix[1][('m2:389', 'm1:389')] == 5
+    assert matrix[1][('m1:389', 'm2:389')] == -5
+    assert matrix[2][('m3:389', 'm2:389')] is None
+    worst = topo.worst_lag()
+    assert worst[1] == ('m2:389', 5)
+    assert worst[2] == ('m3:389', None)
+    assert 'rid 1: m2:389 is 0:00:05 behind' in str(topo)
+
+
+def parallel_fetch_test():
+    conns = [FakeConn('m%d:389' % i, make_ruv(1000), delay=0.3) for i in range(6)]
+    start = time.time()
+    topo = ReplicationTopology(conns, 'o=x').fetch()
+    assert time.time() - start < 1.0
+    assert len(topo.ruvs) == 6
+
+
+def fetch_errors_test():
+    conns = [FakeConn('m1:389', make_ruv(1000)),
+             FakeConn('m2:389', None),
+             FakeConn('m3:389', make_ruv(1000), delay=2)]
+    start = time.time()
+    topo = ReplicationTopology(conns, 'o=x').fetch(timeout=0.3)
+    assert time.time() - start < 1.0
+    assert topo.ruvs.keys() == ['m1:389']
+    assert isinstance(topo.errors['m2:389'], NoSuchEntryError)
+    assert 'no answer' in topo.errors['m3:389']
@@ -0,0 +1,66 @@
+"""Test the TaskManager against the configured instance."""
+from nose.tools import *
+
+import config
+from config import log
+from config import *
+
+import os
+import tempfile
+import dsadmin
+from dsadmin import DSAdmin, Entry
+from dsadmin.tasks import TaskManager, TaskFuture, task_name
+# Test harnesses
+from dsadmin_test import addbackend_harn, drop_added_entries
+
+conn = None
+
+
+def setup():
+    global conn
+    conn = DSAdmin(**config.auth)
+    conn.verbose = True
+    conn.added_entries = []
+    conn.added_backends = set()
+    conn.added_replicas = []
+    addbackend_harn(conn, 'tasks1')
+    addbackend_harn(conn, 'tasks2')
+
+
+def teardown():
+    drop_added_entries(conn)
+
+
+def task_name_test():
+    names = [task_name('export') for i in range(1000)]
+    assert len(set(names)) == len(names)
+    assert names[0].startswith('export')
+
+
+def concurrent_export_test():
+    tm = TaskManager(conn, per_backend=1)
+    tmpdir = tempfile.mkdtemp()
+    futures = []
+    for i in range(2):
+        for name in ('tasks1', 'tasks2'):
+            ldiffile = os.path.join(tmpdir, "%s-%d.ldif" % (name, i))
+            futures.append(tm.exportLDIF(ldiffile, 'o=%s' % name))
+    # one running task for each backend
+    states = [f.state for f in futures]
+    assert states.count(TaskFuture.RUNNING) == 2, "Bad states %r" % states
+    done, notdone = tm.wait(timeout=120)
+    assert not notdone, "Tasks not done %r" % notdone
+    for f in futures:
+        assert f.result() == 0, "Task failed %r: %s" % (f, f.log)
+    # one search per poll, whatever the number of tasks
+    assert tm.searches < 120
+
+
+def exportLDIF_test():
+    fd, ldiffile = tempfile.mkstemp(suffix='.ldif')
+    os.close(fd)
+    try:
+        assert conn.exportLDIF(ldiffile, 'o=tasks1') == 0
+        assert 'o=tasks1' in open(ldiffile).read().lower()
+    finally:
+        os.unlink(ldiffile)
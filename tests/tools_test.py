@@ -0,0 +1,103 @@
+import os
+import socket
+import shutil
+import tempfile
+import threading
+import time
+
+from dsadmin import InvalidArgumentError, DsError
+from dsadmin.tools import DSAdminTools
+
+import logging
+logging.basicConfig(level=logging.DEBUG)
+log = logging.getLogger(__name__)
+
+
+def runInfProg_test():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        prog = os.path.join(tmpdir, 'setup-ds.pl')
+        fp = open(prog, 'w')
+        fp.write("#!/bin/sh\ncat\nexit 3\n")
+        fp.close()
+        os.chmod(prog, 0755)
+        start = time.time()
+        assert DSAdminTools.runInfProg(prog, "[General]\n" * 1000, False, 'm1') == 3
+        assert time.time() - start < 1
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+class FakeConn(object):
+    def __init__(self, args):
+        self.args = args
+
+
+def fake_create(running, peak):
+    lock = threading.Lock()
+
+    def createInstance(args, verbose=0):
+        lock.acquire()
+        running.append(args['newinst'])
+        peak[0] = max(peak[0], len(running))
+        lock.release()
+        time.sleep(0.2)
+        running.remove(args['newinst'])
+        if args['newinst'] == 'bad':
+            raise InvalidArgumentError("missing required arguments")
+        return FakeConn(args)
+    return staticmethod(createInstance)
+
+
+def create_instances_test():
+    arglist = [{'newinst': 'm%d' % i, 'newhost': 'localhost', 'newport': 10200 + i}
+               for i in range(6)]
+    running, peak = [], [0]
+    saved = DSAdminTools.__dict__['createInstance']
+    DSAdminTools.createInstance = fake_create(running, peak)
+    try:
+        start = time.time()
+        conns = DSAdminTools.create_instances(arglist, max_parallel=3)
+        # two rounds of three
+        assert time.time() - start < 0.6
+        assert peak[0] == 3
+        assert [c.args['newinst'] for c in conns] == ['m%d' % i for i in range(6)]
+        assert conns[0].setup_time >= 0.2
+
+        try:
+            DSAdminTools.create_instances(arglist + [{'newinst': 'bad', 'newport': 1}])
+            assert False, "a failed creation should raise"
+        except DsError:
+            pass
+    finally:
+        DSAdminTools.createInstance = saved
+
+
+def create_instances_conflict_test():
+    arglist = [
+        {'newinst': 'm1', 'newhost': 'localhost', 'newport': 10200},
+        {'newinst': 'm2', 'newhost': 'localhost', 'newport': 10200},
+        {'newinst': 'm1', 'newhost': 'localhost', 'newport': 10201},
+        {'newhost': 'localhost', 'newport': 10202},
+    ]
+    try:
+        DSAdminTools.create_instances(arglist)
+        assert False, "conflicting instances should be refused"
+    except InvalidArgumentError, e:
+        msg = str(e)
+        assert 'm2: port 10200' in msg
+        assert 'm1: name' in msg
+        assert 'missing newinst' in msg
+
+
+def create_instances_port_in_use_test():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    port = listener.getsockname()[1]
+    try:
+        DSAdminTools.create_instances([{'newinst': 'm1', 'newhost': 'localhost', 'newport': port}])
+        assert False, "a port in use should be refused"
+    except InvalidArgumentError, e:
+        assert ('m1: port %d' % port) in str(e) and 'in use' in str(e), str(e)
+    listener.close()
@@ -0,0 +1,119 @@
+"""Test the topology cache against the configured instance."""
+from nose.tools import *
+
+import config
+from config import log
+from config import *
+
+import ldap
+import time
+import dsadmin
+from dsadmin import DSAdmin, Entry, NoSuchEntryError
+from dsadmin import DN_MAPPING_TREE
+# Test harnesses
+from dsadmin_test import addbackend_harn, drop_added_entries
+
+conn = None
+
+
+def setup():
+    global conn
+    conn = DSAdmin(**config.auth)
+    conn.verbose = True
+    conn.added_entries = []
+    conn.added_backends = set()
+    conn.added_replicas = []
+    addbackend_harn(conn, 'topology1')
+
+
+def teardown():
+    drop_added_entries(conn)
+
+
+def cached_lookups_test():
+    conn.topology.refresh()
+    searches = conn.topology.searches
+    for i in range(10):
+        bes = conn.getBackendsForSuffix('o=topology1')
+        mtent = conn.getMTEntry('O=Topology1')
+    assert conn.topology.searches == searches
+    assert [x.cn.lower() for x in bes] == ['topology1'], "Bad backends %r" % bes
+    assert mtent.getValue('nsslapd-backend').lower() == 'topology1'
+    assert conn.backend.list(name='topology1')
+    assert conn.backend.list(suffix='o=topology1')
+
+
+def copies_test():
+    # modifying a returned entry doesn't touch the cache
+    mtent = conn.getMTEntry('o=topology1')
+    mtent.setValue('nsslapd-backend', 'changed')
+    assert conn.getMTEntry('o=topology1').getValue('nsslapd-backend').lower() == 'topology1'
+    be = conn.backend.list(name='topology1')[0]
+    be.update({'nsslapd-suffix': 'o=changed'})
+    assert conn.getBackendsForSuffix('o=topology1')
+    # attrs limits the returned attributes
+    mtent = conn.getMTEntry('o=topology1', ['cn'])
+    assert mtent.getAttrs() == ['cn'], mtent.getAttrs()
+    assert conn.getBackendsForSuffix('o=topology1', ['nsslapd-suffix'])[0].cn is None
+
+
+def invalidate_on_write_test():
+    conn.topology.refresh()
+    searches = conn.topology.searches
+    # a write under the mapping tree invalidates the cache
+    mtdn = conn.getMTEntry('o=topology1').dn
+    conn.modify_s(mtdn, [(ldap.MOD_REPLACE, 'description', 'topology')])
+    assert conn.topology.stale
+    assert conn.getMTEntry('o=topology1').description == 'topology'
+    assert conn.topology.searches == searches + 2
+    # other writes don't
+    conn.modify_s('o=topology1', [(ldap.MOD_REPLACE, 'description', 'data')])
+    assert not conn.topology.stale
+
+
+def new_suffix_test():
+    addbackend_harn(conn, 'topology2')
+    assert conn.getBackendsForSuffix('o=topology2')
+    assert 'o=topology2' in conn.topology.suffixes()
+
+
+@raises(NoSuchEntryError)
+def missing_suffix_test():
+    conn.getMTEntry('o=missing')
+
+
+def suffix_routing_test():
+    conn.topology.refresh()
+    searches = conn.topology.searches
+    assert conn.topology.suffix_for('uid=joe,ou=People,O=Topology1') == 'o=topology1'
+    assert conn.topology.suffix_for('o=missing') is None
+    bes = conn.topology.backends_for('ou=people,o=topology1')
+    assert [x.cn.lower() for x in bes] == ['topology1'], "Bad backends %r" % bes
+    assert 'o=topology1' in conn.topology.child_suffixes()
+    assert conn.findParentSuffix('ou=sub,o=topology1') == 'o=topology1'
+    assert conn.findParentSuffix('o=topology1') == ''
+    assert conn.topology.searches == searches
+
+
+def shared_generation_test():
+    from dsadmin.brooker import Topology, TopologyGeneration
+    generation = TopologyGeneration()
+    other = Topology(conn, generation=generation)
+    mine = Topology(conn, generation=generation)
+    other.refresh()
+    mine.refresh()
+    assert not other.stale
+    # a write seen by one cache invalidates the other one
+    mine.invalidate(conn.getMTEntry('o=topology1').dn)
+    assert other.stale
+    other.refresh()
+    assert not other.stale
+    # a ttl reloads what other clients changed
+    other.ttl = 0
+    time.sleep(0.01)
+    assert other.stale
+
+
+@raises(ldap.NO_SUCH_OBJECT)
+def missing_backend_test():
+    conn.backend.list(name='missing')
@@ -1,5 +1,7 @@
 
 from nose import *
+import os
+import ldap
 import dsadmin
 from dsadmin.utils import *
 
@@ -16,6 +18,32 @@ def normalizeDN_test():
         assert r == v, "Mismatch %r vs %r" % (r, v)
 
 
+def normalizeDN_cache_test():
+    normalizeDN.cache.clear()
+    dns = ['dc=example,dc=com', 'DC=Example, DC=com', 'cn=a b,dc=com']
+    expected = [normalizeDN(dn) for dn in dns]
+    assert normalizeDN.cache.misses == len(dns)
+    assert [normalizeDN(dn) for dn in dns] == expected
+    assert normalizeDN.cache.hits == len(dns)
+    # fast path and explode_dn agree
+    for dn in ['dc=example,dc=com', 'uid=user_1@example.com,ou=people,dc=example']:
+        r = normalizeDN(dn, True)
+        v = ', '.join(ldap.explode_dn(dn))
+        assert r == v, "Mismatch %r vs %r" % (r, v)
+
+
+def LRUCache_test():
+    cache = LRUCache(3)
+    for i in range(3):
+        cache[i] = i
+    assert cache.get(0) == 0
+    cache[3] = 3  # discards 1, the least recently used
+    assert cache.get(1) is None
+    assert [cache.get(i) for i in (0, 2, 3)] == [0, 2, 3]
+    assert len(cache) == 3
+    assert cache.stats() == {'hits': 4, 'misses': 1, 'size': 3, 'maxsize': 3}
+
+
 def escapeDNValue_test():
     test = [(r'"dc=example, dc=com"', r'\"dc\=example\,\ dc\=com\"')]
     for k, v in test:
@@ -47,6 +75,58 @@ def isLocalHost_test():
         assert r == v, "Mismatch %r vs %r on %r" % (r, v, k)
 
 
+FIB_TRIE = """Local:
+  +-- 0.0.0.0/0 3 0 5
+     +-- 127.0.0.0/8 2 0 2
+           |-- 127.0.0.1
+              /32 host LOCAL
+        |-- 127.255.255.255
+           /32 link BROADCAST
+     +-- 192.0.2.0/24 2 0 2
+           |-- 192.0.2.0
+              /24 link UNICAST
+           |-- 192.0.2.2
+              /32 host LOCAL
+"""
+
+
+def local_addresses_test():
+    import tempfile
+    from dsadmin import utils
+    fd, path = tempfile.mkstemp()
+    os.write(fd, FIB_TRIE)
+    os.close(fd)
+    saved = utils.PROC_FIB_TRIE, utils.PROC_IF_INET6, utils.local_addresses.cache[:]
+    utils.PROC_FIB_TRIE, utils.PROC_IF_INET6 = path, path + '.missing'
+    utils.local_addresses.cache[:] = [0, None]
+    try:
+        assert local_addresses() == set(['127.0.0.1', '192.0.2.2'])
+        assert isLocalHost('192.0.2.2')
+        assert not isLocalHost('192.0.2.255')
+        # cached: the file is not read again
+        os.unlink(path)
+        assert local_addresses() == set(['127.0.0.1', '192.0.2.2'])
+    finally:
+        utils.PROC_FIB_TRIE, utils.PROC_IF_INET6, utils.local_addresses.cache[:] = saved
+
+
+def resolve_cache_test():
+    calls = []
+    getaddrinfo = socket.getaddrinfo
+
+    def counting(*args):
+        calls.append(args)
+        return getaddrinfo(*args)
+    socket.getaddrinfo = counting
+    try:
+        resolve.cache.clear()
+        for i in range(10):
+            assert '127.0.0.1' in resolve('127.0.0.1')
+        assert len(calls) == 1
+    finally:
+        socket.getaddrinfo = getaddrinfo
+
+
 def update_newhost_with_fqdn_test():
     test = [
         ({'newhost':'localhost'}, ('localhost.localdomain', True)),
@@ -0,0 +1,61 @@
+"""Measure the cost of the former per-connection method wrapping against
+    the class-level SimpleLDAPObject overrides of DSAdmin.
+
+    No server is needed: connections are created with nobind=True and
+    get_option() is used as a local call.
+
+    Run with:
+        python tests/wrapping_bench.py [nconnections] [ncalls]
+"""
+import sys
+import time
+
+import ldap
+from ldap.ldapobject import SimpleLDAPObject
+from dsadmin import DSAdmin
+
+
+def legacy_wrapper(f, name):
+    """The former dsadmin.wrapper: one closure per method per connection"""
+    def inner(*args, **kargs):
+        if name == 'result':
+            return f(*args, **kargs)
+        elif name.startswith('add'):
+            return f(*args, **kargs)
+        else:
+            return f(*args, **kargs)
+    return inner
+
+
+class LegacyDSAdmin(DSAdmin):
+    def __init__(self, *args, **kwargs):
+        for name in dir(SimpleLDAPObject):
+            attr = getattr(self, name)
+            if callable(attr):
+                setattr(self, name, legacy_wrapper(attr, name))
+        DSAdmin.__init__(self, *args, **kwargs)
+
+
+def bench(cls, nconnections, ncalls):
+    start = time.time()
+    for i in xrange(nconnections):
+        conn = cls(nobind=True)
+    construction = (time.time() - start) / nconnections
+
+    start = time.time()
+    for i in xrange(ncalls):
+        conn.get_option(ldap.OPT_PROTOCOL_VERSION)
+    percall = (time.time() - start) / ncalls
+    return construction, percall
+
+
+def main(nconnections=1000, ncalls=100000):
+    print "%-14s %16s %16s" % ('class', 'construction (us)', 'per call (us)')
+    for cls in (LegacyDSAdmin, DSAdmin):
+        construction, percall = bench(cls, nconnections, ncalls)
+        print "%-14s %16.1f %16.3f" % (
+            cls.__name__, construction * 1e6, percall * 1e6)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:3]])